@@ -0,0 +1,193 @@
+"""
+备份流程基准测试：在合成服务器目录上依次测量扫描、压缩与上传，上传目标为本进程内的 FTP/SFTP 服务器，
+可注入延迟与带宽上限；结果追加到 JSON Lines 文件，并与相同参数的上一次结果对比
+
+    python benchmarks/backup_pipeline.py --shape mixed --target ftp --target sftp
+    python benchmarks/backup_pipeline.py --shape region --scale 0.5 --latency-ms 20 --bandwidth-mb 40 --workers 4
+    python benchmarks/backup_pipeline.py --shape nbt --world-dir /tmp/fb_world --label my-change
+
+--world-dir 指定的目录会保留生成的合成目录，参数相同时直接复用，便于在不同版本之间对比
+峰值内存为截至该阶段结束时整个进程(含本地服务器)的最大常驻内存
+"""
+import os
+import sys
+import time
+import logging
+import argparse
+import platform
+import tempfile
+from typing import Optional
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from ftp_backup.config import Config
+from ftp_backup.backup_util import BackupManager
+from ftp_backup.ftp_manager import FTPManager
+from ftp_backup.sftp_manager import SFTPManager
+from ftp_backup.scanner import ExcludeMatcher, scan_directory
+from ftp_backup.metrics import BackupMetrics
+from synthetic_world import SHAPES, generate_world
+from result_log import append_result, find_previous, git_revision
+
+try:
+    import resource
+except ImportError:
+    resource = None  # Windows 上不统计峰值内存
+
+MB = 1024 * 1024
+DEFAULT_RESULTS = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results', 'backup_pipeline.jsonl')
+
+
+class _Server:
+    logger = logging.getLogger('pipeline_benchmark')
+
+
+def peak_rss_mb() -> Optional[float]:
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux 以 KB 为单位，macOS 以字节为单位
+    return round(peak / (MB if sys.platform == 'darwin' else 1024), 1)
+
+
+def phase_result(seconds: float, total_bytes: int, files: int) -> dict:
+    return {
+        'seconds': round(seconds, 3),
+        'mb_per_second': round(total_bytes / MB / seconds, 2) if seconds > 0 else None,
+        'files_per_second': round(files / seconds, 1) if seconds > 0 else None,
+        'peak_rss_mb': peak_rss_mb(),
+    }
+
+
+def bench_scan(config: Config) -> dict:
+    start = time.perf_counter()
+    result = scan_directory(config.server_dir, ExcludeMatcher(config.exclude_patterns))
+    record = phase_result(time.perf_counter() - start, 0, result.total_files)
+    record.update(files=result.total_files, bytes=result.total_bytes)
+    return record
+
+
+def bench_compress(config: Config) -> dict:
+    manager = BackupManager(_Server(), config)
+    metrics = BackupMetrics('benchmark')
+    start = time.perf_counter()
+    archive = manager.create_backup(metrics=metrics)
+    elapsed = time.perf_counter() - start
+    if archive is None:
+        raise RuntimeError("压缩失败")
+    record = phase_result(elapsed, metrics.source_bytes, metrics.files)
+    record.update(archive=str(archive), archive_bytes=metrics.archive_bytes, source_bytes=metrics.source_bytes,
+                  files=metrics.files, phases={k: round(v, 3) for k, v in metrics.phases.items()},
+                  compression_ratio=round(metrics.archive_bytes / metrics.source_bytes, 4)
+                  if metrics.source_bytes else None)
+    return record
+
+
+def bench_upload(config: Config, target: str, archive: str, work_dir: str, args) -> dict:
+    if target == 'sftp':
+        from local_sftp_server import LocalSFTPServer as server_class
+        manager = SFTPManager(_Server())
+    else:
+        from local_ftp_server import LocalFTPServer as server_class
+        manager = FTPManager(_Server())
+    remote_root = os.path.join(work_dir, f'remote_{target}')
+    server = server_class(remote_root, latency_ms=args.latency_ms, bandwidth_mb=args.bandwidth_mb).start()
+    config.protocol, config.host, config.port = target, server.host, server.port
+    config.username, config.password, config.remote_path = 'bench', 'bench', '/'
+    try:
+        start = time.perf_counter()
+        if not manager.connect(config):
+            raise RuntimeError(f"{target} 连接失败")
+        connected = time.perf_counter()
+        if not manager.upload_file(archive, config):
+            raise RuntimeError(f"{target} 上传失败")
+        elapsed = time.perf_counter() - connected
+        size = os.path.getsize(archive)
+        remote_size = os.path.getsize(os.path.join(remote_root, os.path.basename(archive)))
+        if remote_size != size:
+            raise RuntimeError(f"{target} 远程文件大小不一致: {remote_size} / {size}")
+        record = phase_result(elapsed, size, 1)
+        record.update(connect_seconds=round(connected - start, 3), bytes=size)
+        return record
+    finally:
+        manager.disconnect()
+        server.stop()
+
+
+def print_report(record: dict, previous: Optional[dict]):
+    world = record['world']
+    print(f"目录: {world['files']} 个文件，{world['bytes'] / MB:.1f} MB  版本: {record['label']}")
+    print(f"{'阶段':<14}{'耗时(s)':>10}{'MB/s':>10}{'文件/s':>12}{'峰值内存(MB)':>14}{'对比':>10}")
+    for name, phase in record['results'].items():
+        delta = ''
+        old = (previous or {}).get('results', {}).get(name)
+        if old and old.get('mb_per_second') and phase.get('mb_per_second'):
+            delta = f"{(phase['mb_per_second'] / old['mb_per_second'] - 1) * 100:+.1f}%"
+        elif old and old.get('files_per_second') and phase.get('files_per_second'):
+            delta = f"{(phase['files_per_second'] / old['files_per_second'] - 1) * 100:+.1f}%"
+        print(f"{name:<16}{phase['seconds']:>10.2f}{phase['mb_per_second'] or 0:>10.1f}"
+              f"{phase['files_per_second'] or 0:>12.0f}{phase['peak_rss_mb'] or 0:>14.1f}{delta:>10}")
+    compress = record['results']['compress']
+    print(f"压缩率: {compress['compression_ratio']}  压缩内部阶段: {compress['phases']}")
+    if previous is not None:
+        print(f"对比基准: {previous['label']} ({previous['timestamp']})")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='备份流程基准测试')
+    parser.add_argument('--shape', choices=sorted(SHAPES), default='mixed')
+    parser.add_argument('--scale', type=float, default=1.0, help='文件数量倍数')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--world-dir', help='合成目录的保存位置，参数相同时复用')
+    parser.add_argument('--target', action='append', choices=['ftp', 'sftp'], default=[])
+    parser.add_argument('--latency-ms', type=float, default=0, help='本地服务器注入的单向延迟')
+    parser.add_argument('--bandwidth-mb', type=float, default=0, help='本地服务器的上行带宽上限(MB/s)')
+    parser.add_argument('--workers', type=int, default=Config.compress_workers)
+    parser.add_argument('--compress-level', type=int, default=Config.compress_level)
+    parser.add_argument('--archive-format', choices=['zip', 'tar.zst'], default=Config.archive_format)
+    parser.add_argument('--results', default=DEFAULT_RESULTS, help='结果文件(JSON Lines)')
+    parser.add_argument('--label', help='结果标签，默认为当前 git 提交')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+    logging.getLogger('paramiko').setLevel(logging.WARNING)
+    targets = args.target or ['ftp', 'sftp']
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        world_dir = args.world_dir or os.path.join(work_dir, 'server')
+        print(f"正在生成合成目录 {world_dir} ...")
+        generate_world(world_dir, args.shape, args.scale, args.seed)
+
+        config = Config()
+        config.server_dir = world_dir
+        config.local_path = os.path.join(work_dir, 'backups')
+        config.compress_workers = args.workers
+        config.compress_level = args.compress_level
+        config.archive_format = args.archive_format
+
+        results = {'scan': bench_scan(config)}
+        results['compress'] = bench_compress(config)
+        archive = results['compress'].pop('archive')
+        for target in targets:
+            results[f'upload_{target}'] = bench_upload(config, target, archive, work_dir, args)
+
+    params = {
+        'shape': args.shape, 'scale': args.scale, 'seed': args.seed, 'targets': targets,
+        'latency_ms': args.latency_ms, 'bandwidth_mb': args.bandwidth_mb, 'workers': args.workers,
+        'compress_level': args.compress_level, 'archive_format': args.archive_format,
+    }
+    record = {
+        'label': args.label or git_revision(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'params': params,
+        'world': {'files': results['scan']['files'], 'bytes': results['scan']['bytes']},
+        'results': results,
+    }
+    previous = find_previous(args.results, params)
+    print_report(record, previous)
+    append_result(args.results, record)
+
+
+if __name__ == '__main__':
+    main()
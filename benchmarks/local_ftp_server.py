@@ -0,0 +1,269 @@
+"""
+进程内 FTP 服务器，仅供基准测试使用，接受任意用户名密码，文件存放在指定的本地目录
+只实现插件用到的命令（被动模式、STOR/APPE/RETR 与 REST 续传、SIZE、MLSD/NLST、MKD/DELE 等）
+"""
+import os
+import socket
+import posixpath
+import threading
+from typing import Optional
+from net_shaper import make_link_limiter, shape
+
+ENCODING = 'utf-8'
+DATA_BLOCK_SIZE = 256 * 1024
+DATA_ACCEPT_TIMEOUT = 10
+FEATURES = ('MLST type*;size*;modify*;', 'REST STREAM', 'SIZE', 'EPSV', 'PASV', 'UTF8')
+
+
+class _Session:
+    def __init__(self, server: 'LocalFTPServer', sock):
+        self.server = server
+        self.sock = sock
+        self.buffer = b''
+        self.cwd = '/'
+        self.rest = 0
+        self.rename_from: Optional[str] = None
+        self.passive: Optional[socket.socket] = None
+
+    def __reply(self, text: str):
+        self.sock.sendall((text + '\r\n').encode(ENCODING))
+
+    def __read_line(self) -> Optional[str]:
+        while b'\r\n' not in self.buffer:
+            data = self.sock.recv(4096)
+            if not data:
+                return None
+            self.buffer += data
+        line, self.buffer = self.buffer.split(b'\r\n', 1)
+        return line.decode(ENCODING, 'replace')
+
+    def __virtual(self, path: str) -> str:
+        return posixpath.normpath(posixpath.join(self.cwd, path or '.'))
+
+    def __real(self, path: str) -> str:
+        return os.path.join(self.server.root, self.__virtual(path).lstrip('/'))
+
+    def __open_passive(self) -> int:
+        self.__close_passive()
+        self.passive = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.passive.bind((self.server.host, 0))
+        self.passive.listen(1)
+        self.passive.settimeout(DATA_ACCEPT_TIMEOUT)
+        return self.passive.getsockname()[1]
+
+    def __close_passive(self):
+        if self.passive is not None:
+            self.passive.close()
+            self.passive = None
+
+    def __accept_data(self):
+        if self.passive is None:
+            self.__reply('425 Use PASV or EPSV first')
+            return None
+        self.__reply('150 Opening data connection')
+        try:
+            conn, _ = self.passive.accept()
+        except OSError:
+            self.__reply('425 Data connection failed')
+            return None
+        finally:
+            self.__close_passive()
+        return shape(conn, self.server.latency_ms, self.server.limiter)
+
+    def __store(self, path: str, append: bool):
+        real = self.__real(path)
+        offset, self.rest = self.rest, 0
+        if append:
+            mode = 'ab'
+        elif offset and os.path.exists(real):
+            mode = 'r+b'
+        else:
+            mode, offset = 'wb', 0
+        try:
+            f = open(real, mode)
+        except OSError as e:
+            self.__reply(f'550 {e.strerror}')
+            return
+        conn = self.__accept_data()
+        if conn is None:
+            f.close()
+            return
+        with f:
+            if mode == 'r+b':
+                f.seek(offset)
+                f.truncate()
+            while True:
+                data = conn.recv(DATA_BLOCK_SIZE)
+                if not data:
+                    break
+                f.write(data)
+        conn.close()
+        self.__reply('226 Transfer complete')
+
+    def __send_data(self, payload):
+        conn = self.__accept_data()
+        if conn is None:
+            return
+        try:
+            if isinstance(payload, bytes):
+                conn.sendall(payload)
+            else:
+                with payload:
+                    while True:
+                        data = payload.read(DATA_BLOCK_SIZE)
+                        if not data:
+                            break
+                        conn.sendall(data)
+        except OSError:
+            # 客户端读取所需范围后提前关闭数据连接
+            self.__reply('426 Transfer aborted')
+            return
+        finally:
+            conn.close()
+        self.__reply('226 Transfer complete')
+
+    def __retrieve(self, path: str):
+        offset, self.rest = self.rest, 0
+        try:
+            f = open(self.__real(path), 'rb')
+        except OSError as e:
+            self.__reply(f'550 {e.strerror}')
+            return
+        f.seek(offset)
+        self.__send_data(f)
+
+    def __list(self, path: str, facts: bool):
+        real = self.__real(path)
+        if not os.path.isdir(real):
+            self.__reply('550 No such directory')
+            return
+        lines = []
+        for name in sorted(os.listdir(real)):
+            if not facts:
+                lines.append(name)
+                continue
+            st = os.stat(os.path.join(real, name))
+            kind = 'dir' if os.path.isdir(os.path.join(real, name)) else 'file'
+            lines.append(f'type={kind};size={st.st_size}; {name}')
+        self.__send_data(''.join(line + '\r\n' for line in lines).encode(ENCODING))
+
+    def __handle(self, cmd: str, arg: str) -> bool:
+        if cmd == 'USER':
+            self.__reply('331 Password required')
+        elif cmd == 'PASS':
+            self.__reply('230 Logged in')
+        elif cmd == 'SYST':
+            self.__reply('215 UNIX Type: L8')
+        elif cmd == 'FEAT':
+            self.__reply('211-Features:')
+            for feature in FEATURES:
+                self.__reply(' ' + feature)
+            self.__reply('211 End')
+        elif cmd in ('TYPE', 'MODE', 'STRU', 'OPTS', 'NOOP'):
+            self.__reply('200 OK')
+        elif cmd == 'PWD':
+            self.__reply(f'257 "{self.cwd}"')
+        elif cmd == 'CWD':
+            if os.path.isdir(self.__real(arg)):
+                self.cwd = self.__virtual(arg)
+                self.__reply('250 OK')
+            else:
+                self.__reply('550 No such directory')
+        elif cmd == 'PASV':
+            port = self.__open_passive()
+            host = self.server.host.replace('.', ',')
+            self.__reply(f'227 Entering Passive Mode ({host},{port >> 8},{port & 0xFF})')
+        elif cmd == 'EPSV':
+            self.__reply(f'229 Entering Extended Passive Mode (|||{self.__open_passive()}|)')
+        elif cmd == 'REST':
+            self.rest = int(arg)
+            self.__reply(f'350 Restarting at {self.rest}')
+        elif cmd in ('STOR', 'APPE'):
+            self.__store(arg, cmd == 'APPE')
+        elif cmd == 'RETR':
+            self.__retrieve(arg)
+        elif cmd in ('NLST', 'MLSD'):
+            self.__list(arg, cmd == 'MLSD')
+        elif cmd == 'SIZE':
+            real = self.__real(arg)
+            if os.path.isfile(real):
+                self.__reply(f'213 {os.path.getsize(real)}')
+            else:
+                self.__reply('550 No such file')
+        elif cmd == 'MKD':
+            try:
+                os.mkdir(self.__real(arg))
+                self.__reply(f'257 "{self.__virtual(arg)}" created')
+            except OSError as e:
+                self.__reply(f'550 {e.strerror}')
+        elif cmd in ('DELE', 'RMD'):
+            try:
+                (os.remove if cmd == 'DELE' else os.rmdir)(self.__real(arg))
+                self.__reply('250 OK')
+            except OSError as e:
+                self.__reply(f'550 {e.strerror}')
+        elif cmd == 'RNFR':
+            self.rename_from = self.__real(arg)
+            self.__reply('350 Ready for RNTO')
+        elif cmd == 'RNTO':
+            try:
+                os.replace(self.rename_from, self.__real(arg))
+                self.__reply('250 OK')
+            except (OSError, TypeError):
+                self.__reply('550 Rename failed')
+            self.rename_from = None
+        elif cmd == 'QUIT':
+            self.__reply('221 Bye')
+            return False
+        else:
+            self.__reply('502 Command not implemented')
+        return True
+
+    def run(self):
+        try:
+            self.__reply('220 Local benchmark FTP server')
+            while True:
+                line = self.__read_line()
+                if line is None:
+                    break
+                cmd, _, arg = line.partition(' ')
+                if not self.__handle(cmd.upper(), arg):
+                    break
+        except OSError:
+            pass
+        finally:
+            self.__close_passive()
+            self.sock.close()
+
+
+class LocalFTPServer:
+    def __init__(self, root: str, host: str = '127.0.0.1', port: int = 0,
+                 latency_ms: float = 0, bandwidth_mb: float = 0):
+        self.root = root
+        self.latency_ms = latency_ms
+        self.limiter = make_link_limiter(bandwidth_mb)
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind((host, port))
+        self.sock.listen(16)
+        self.host, self.port = self.sock.getsockname()
+        self.running = False
+
+    def __serve(self):
+        while self.running:
+            try:
+                client, _ = self.sock.accept()
+            except OSError:
+                return
+            session = _Session(self, shape(client, self.latency_ms, self.limiter))
+            threading.Thread(target=session.run, name='local_ftp_session', daemon=True).start()
+
+    def start(self) -> 'LocalFTPServer':
+        os.makedirs(self.root, exist_ok=True)
+        self.running = True
+        threading.Thread(target=self.__serve, name='local_ftp_server', daemon=True).start()
+        return self
+
+    def stop(self):
+        self.running = False
+        self.sock.close()
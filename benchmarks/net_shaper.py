@@ -0,0 +1,129 @@
+"""
+基准测试用的网络模拟：为本地服务器接受的连接注入单向延迟与入站带宽上限
+"""
+import time
+import queue
+import socket
+import threading
+from typing import Optional
+
+from ftp_backup.throttle import TokenBucket, MB
+
+RECV_SIZE = 64 * 1024
+# 入站队列最多缓存的数据段数，队列满时停止读取，由 TCP 窗口向客户端施加背压
+QUEUE_SEGMENTS = 256
+
+
+def make_link_limiter(bandwidth_mb: float) -> Optional[TokenBucket]:
+    # 同一服务器的所有连接共享一个令牌桶，模拟一条上行链路
+    return TokenBucket(bandwidth_mb * MB) if bandwidth_mb > 0 else None
+
+
+class ShapedSocket:
+    """
+    包装服务器端套接字：收到的数据先经过带宽限制，再在延迟队列中停留 latency 秒后才交给服务器，
+    发送的数据同样延迟 latency 秒发出，往返时间为 2 * latency
+    延迟通过队列实现而不是在每次读写时休眠，客户端的流水线写入不会因此被串行化
+    """
+
+    def __init__(self, sock: socket.socket, latency: float = 0, limiter: Optional[TokenBucket] = None):
+        self.sock = sock
+        self.latency = max(latency, 0)
+        self.limiter = limiter
+        self.timeout: Optional[float] = None
+        self.inbound = queue.Queue(maxsize=QUEUE_SEGMENTS)
+        self.outbound = queue.Queue()
+        self.buffer = b''
+        self.eof = False
+        self.closed = False
+        threading.Thread(target=self.__receive, name='shaped_socket_recv', daemon=True).start()
+        if self.latency > 0:
+            threading.Thread(target=self.__send_delayed, name='shaped_socket_send', daemon=True).start()
+
+    def __receive(self):
+        try:
+            while True:
+                data = self.sock.recv(RECV_SIZE)
+                if not data:
+                    break
+                if self.limiter is not None:
+                    self.limiter.consume(len(data))
+                self.inbound.put((time.monotonic() + self.latency, data))
+        except OSError:
+            pass
+        self.inbound.put((time.monotonic() + self.latency, b''))
+
+    def __send_delayed(self):
+        while True:
+            item = self.outbound.get()
+            if item is None:
+                break
+            due, data = item
+            delay = due - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            try:
+                self.sock.sendall(data)
+            except OSError:
+                break
+        self.__close_socket()
+
+    def __close_socket(self):
+        # 先 shutdown 以唤醒阻塞在 recv 上的接收线程，否则连接不会立即关闭
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.sock.close()
+
+    def settimeout(self, timeout: Optional[float]):
+        self.timeout = timeout
+
+    def gettimeout(self) -> Optional[float]:
+        return self.timeout
+
+    def recv(self, n: int) -> bytes:
+        if not self.buffer and not self.eof:
+            try:
+                due, data = self.inbound.get(timeout=self.timeout)
+            except queue.Empty:
+                raise socket.timeout('timed out')
+            delay = due - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            self.eof = not data
+            self.buffer = data
+        data, self.buffer = self.buffer[:n], self.buffer[n:]
+        return data
+
+    def send(self, data) -> int:
+        if self.latency <= 0:
+            return self.sock.send(data)
+        self.outbound.put((time.monotonic() + self.latency, bytes(data)))
+        return len(data)
+
+    def sendall(self, data):
+        if self.latency <= 0:
+            self.sock.sendall(data)
+        else:
+            self.send(data)
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        if self.latency > 0:
+            # 由发送线程在发出剩余数据后关闭
+            self.outbound.put(None)
+        else:
+            self.__close_socket()
+
+    def __getattr__(self, name):
+        return getattr(self.sock, name)
+
+
+def shape(sock: socket.socket, latency_ms: float, limiter: Optional[TokenBucket]):
+    # 未设置延迟与带宽时直接使用原始套接字
+    if latency_ms <= 0 and limiter is None:
+        return sock
+    return ShapedSocket(sock, latency_ms / 1000, limiter)
@@ -0,0 +1,184 @@
+"""
+插件加载与热重载基准测试：在全新的解释器中测量导入插件、on_load 与 !!fb reload 的耗时，
+并记录加载后已导入的较重依赖(paramiko/cryptography/chardet/apscheduler)；结果追加到 JSON Lines 文件，
+并与相同参数的上一次结果对比
+
+    python benchmarks/plugin_load.py
+    python benchmarks/plugin_load.py --protocol sftp --auto-backup --repeat 10
+    python benchmarks/plugin_load.py --label before-lazy-import
+
+重载分别测量配置未变化、只修改 keep_local_backups 与修改 host 三种情况
+插件运行在一个只实现了所用接口的模拟 MCDR 服务器上，需要安装 mcdreforged；
+mcdreforged 在计时前预先导入，import 只统计插件自身及其依赖的耗时
+"""
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import platform
+import statistics
+import tempfile
+import subprocess
+from typing import Optional
+from result_log import append_result, find_previous, git_revision
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_RESULTS = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results', 'plugin_load.jsonl')
+HEAVY_MODULES = ('paramiko', 'cryptography', 'chardet', 'apscheduler')
+# 重载场景: 名称与写入配置文件的修改
+RELOAD_CASES = (
+    ('reload_unchanged', {}),
+    ('reload_keep_local', {'keep_local_backups': 5}),
+    ('reload_host', {'host': '127.0.0.2'}),
+)
+
+
+class _Source:
+    def has_permission(self, level: int) -> bool:
+        return True
+
+    def reply(self, message):
+        pass
+
+
+class _Server:
+    """
+    模拟 MCDR 的 PluginServerInterface，配置文件读写自 config_dir
+    """
+
+    logger = logging.getLogger('load_benchmark')
+
+    def __init__(self, config_dir: str):
+        self.config_dir = config_dir
+
+    def load_config_simple(self, file_name: str, target_class, default_config: Optional[dict] = None):
+        with open(os.path.join(self.config_dir, file_name), 'r', encoding='utf-8') as f:
+            return target_class.deserialize(json.load(f))
+
+    def register_command(self, node):
+        pass
+
+    def register_event_listener(self, event, callback):
+        pass
+
+    def get_plugin_command_source(self):
+        return _Source()
+
+    def is_server_running(self) -> bool:
+        return False
+
+    def execute(self, command: str):
+        pass
+
+
+def write_config(path: str, values: dict):
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(values, f)
+
+
+def run_child(args) -> dict:
+    # 在子进程中执行，导入插件前 sys.modules 中没有任何被测模块
+    sys.path.insert(0, ROOT)
+    config_path = os.path.join(args.work_dir, 'config.json')
+    values = {
+        'protocol': args.protocol, 'host': '127.0.0.1', 'port': 2121 if args.protocol == 'ftp' else 2222,
+        'server_dir': os.path.join(args.work_dir, 'server'), 'local_path': os.path.join(args.work_dir, 'backups'),
+        'auto_backup': args.auto_backup,
+    }
+    write_config(config_path, values)
+    result = {}
+
+    # MCDR 加载插件时已导入，不计入插件的导入耗时
+    import mcdreforged.api.all
+    import mcdreforged.api.utils.serializer
+    start = time.perf_counter()
+    import ftp_backup
+    result['import'] = time.perf_counter() - start
+
+    server = _Server(args.work_dir)
+    start = time.perf_counter()
+    ftp_backup.on_load(server, None)
+    result['on_load'] = time.perf_counter() - start
+    result['modules'] = sorted(name for name in HEAVY_MODULES if name in sys.modules)
+
+    for name, changes in RELOAD_CASES:
+        values.update(changes)
+        write_config(config_path, values)
+        start = time.perf_counter()
+        ftp_backup.command_handler.reload_config(_Source())
+        result[name] = time.perf_counter() - start
+    ftp_backup.on_unload(server)
+    return result
+
+
+def measure(args) -> dict:
+    # 每次在全新的解释器中执行，取各阶段耗时的中位数
+    runs = []
+    for _ in range(args.repeat):
+        with tempfile.TemporaryDirectory() as work_dir:
+            os.makedirs(os.path.join(work_dir, 'server'))
+            command = [sys.executable, os.path.abspath(__file__), '--child', '--work-dir', work_dir,
+                       '--protocol', args.protocol] + (['--auto-backup'] if args.auto_backup else [])
+            output = subprocess.check_output(command, cwd=work_dir).decode()
+            runs.append(json.loads(output.strip().splitlines()[-1]))
+    results = {}
+    for name in ['import', 'on_load'] + [name for name, _ in RELOAD_CASES]:
+        results[name] = {'ms': round(statistics.median(run[name] for run in runs) * 1000, 2),
+                         'min_ms': round(min(run[name] for run in runs) * 1000, 2)}
+    results['startup'] = {'ms': round(results['import']['ms'] + results['on_load']['ms'], 2),
+                          'min_ms': round(min(run['import'] + run['on_load'] for run in runs) * 1000, 2)}
+    return {'results': results, 'modules': runs[-1]['modules']}
+
+
+def print_report(record: dict, previous: Optional[dict]):
+    params = record['params']
+    print(f"协议: {params['protocol']}  定时备份: {'开' if params['auto_backup'] else '关'}  "
+          f"重复: {params['repeat']} 次  版本: {record['label']}")
+    print(f"{'阶段':<18}{'中位数(ms)':>12}{'最快(ms)':>12}{'对比':>10}")
+    for name, phase in record['results'].items():
+        delta = ''
+        old = (previous or {}).get('results', {}).get(name)
+        if old and old.get('ms'):
+            delta = f"{(phase['ms'] / old['ms'] - 1) * 100:+.1f}%"
+        print(f"{name:<20}{phase['ms']:>12.2f}{phase['min_ms']:>12.2f}{delta:>10}")
+    print(f"加载后已导入: {', '.join(record['modules']) or '无'}")
+    if previous is not None:
+        print(f"对比基准: {previous['label']} ({previous['timestamp']})，已导入: {', '.join(previous['modules']) or '无'}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='插件加载与热重载基准测试')
+    parser.add_argument('--protocol', choices=['ftp', 'sftp'], default='ftp')
+    parser.add_argument('--auto-backup', action='store_true', help='启用定时备份(会导入 APScheduler)')
+    parser.add_argument('--repeat', type=int, default=5, help='重复次数，每次使用新的解释器')
+    parser.add_argument('--results', default=DEFAULT_RESULTS, help='结果文件(JSON Lines)')
+    parser.add_argument('--label', help='结果标签，默认为当前 git 提交')
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--work-dir', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+
+    if args.child:
+        print(json.dumps(run_child(args)))
+        return
+
+    measured = measure(args)
+    params = {'protocol': args.protocol, 'auto_backup': args.auto_backup, 'repeat': args.repeat}
+    record = {
+        'label': args.label or git_revision(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'params': params,
+        'modules': measured['modules'],
+        'results': measured['results'],
+    }
+    previous = find_previous(args.results, params)
+    print_report(record, previous)
+    append_result(args.results, record)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,38 @@
+"""
+基准测试结果文件(JSON Lines)的读写：每次运行追加一条记录，按参数查找上一次结果用于对比
+"""
+import os
+import json
+import subprocess
+from typing import Optional
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.DEVNULL,
+                                       cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def find_previous(results_path: str, params: dict) -> Optional[dict]:
+    previous = None
+    try:
+        with open(results_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                if record.get('params') == params:
+                    previous = record
+    except OSError:
+        pass
+    return previous
+
+
+def append_result(results_path: str, record: dict):
+    os.makedirs(os.path.dirname(os.path.abspath(results_path)), exist_ok=True)
+    with open(results_path, 'a', encoding='utf-8') as f:
+        f.write(json.dumps(record, ensure_ascii=False) + '\n')
+    print(f"结果已追加至 {results_path}")
@@ -0,0 +1,109 @@
+"""
+SFTP 上传吞吐量基准测试：对比 paramiko 默认的 sftp_client.put 与插件调优后的 SFTP 传输
+
+    python benchmarks/sftp_throughput.py --size-mb 256
+    python benchmarks/sftp_throughput.py --size-mb 64 --latency-ms 40 --bandwidth-mb 20
+    python benchmarks/sftp_throughput.py --host example.com --port 22 --username u --password p --remote-path /tmp
+
+未指定 --host 时在本进程内启动一个临时 SFTP 服务器
+"""
+import os
+import sys
+import time
+import logging
+import argparse
+import tempfile
+import paramiko
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from ftp_backup.config import Config
+from ftp_backup.sftp_manager import SFTPManager
+from local_sftp_server import LocalSFTPServer
+
+
+class _Server:
+    logger = logging.getLogger('sftp_benchmark')
+
+
+def make_test_file(directory: str, size_mb: int) -> str:
+    path = os.path.join(directory, 'payload.bin')
+    with open(path, 'wb') as f:
+        for _ in range(size_mb):
+            f.write(os.urandom(1024 * 1024))
+    return path
+
+
+def bench_put(config: Config, file_path: str) -> float:
+    transport = paramiko.Transport((config.host, config.port))
+    transport.connect(username=config.username, password=config.password)
+    sftp = paramiko.SFTPClient.from_transport(transport)
+    try:
+        start = time.perf_counter()
+        sftp.put(file_path, f"{config.remote_path}/put.bin".replace('//', '/'))
+        return time.perf_counter() - start
+    finally:
+        sftp.close()
+        transport.close()
+
+
+def bench_manager(config: Config, file_path: str) -> float:
+    manager = SFTPManager(_Server())
+    if not manager.connect(config):
+        raise RuntimeError("SFTP连接失败")
+    try:
+        start = time.perf_counter()
+        if not manager.upload_to(file_path, 'tuned.bin', config):
+            raise RuntimeError("SFTP上传失败")
+        return time.perf_counter() - start
+    finally:
+        manager.disconnect()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='SFTP 上传吞吐量基准测试')
+    parser.add_argument('--size-mb', type=int, default=128)
+    parser.add_argument('--host')
+    parser.add_argument('--port', type=int, default=22)
+    parser.add_argument('--username', default='bench')
+    parser.add_argument('--password', default='bench')
+    parser.add_argument('--remote-path', default='/')
+    parser.add_argument('--window-mb', type=int, default=Config.sftp_window_mb)
+    parser.add_argument('--max-packet-kb', type=int, default=Config.sftp_max_packet_kb)
+    parser.add_argument('--block-kb', type=int, default=Config.sftp_block_kb)
+    parser.add_argument('--cipher', action='append', default=[])
+    parser.add_argument('--compression', action='store_true')
+    parser.add_argument('--latency-ms', type=float, default=0, help='本地服务器注入的单向延迟')
+    parser.add_argument('--bandwidth-mb', type=float, default=0, help='本地服务器的上行带宽上限(MB/s)')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+    logging.getLogger('paramiko').setLevel(logging.WARNING)
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        server = None
+        config = Config()
+        if args.host is None:
+            server = LocalSFTPServer(os.path.join(work_dir, 'remote'), latency_ms=args.latency_ms,
+                                     bandwidth_mb=args.bandwidth_mb).start()
+            config.host, config.port = server.host, server.port
+        else:
+            config.host, config.port = args.host, args.port
+        config.username, config.password = args.username, args.password
+        config.remote_path = args.remote_path
+        config.sftp_window_mb = args.window_mb
+        config.sftp_max_packet_kb = args.max_packet_kb
+        config.sftp_block_kb = args.block_kb
+        config.sftp_ciphers = args.cipher
+        config.sftp_compression = args.compression
+
+        file_path = make_test_file(work_dir, args.size_mb)
+        try:
+            for name, bench in (('sftp_client.put', bench_put), ('SFTPManager', bench_manager)):
+                elapsed = bench(config, file_path)
+                print(f"{name:<16} {args.size_mb / elapsed:8.2f} MB/s  ({elapsed:.2f} s)")
+        finally:
+            if server is not None:
+                server.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,114 @@
+"""
+生成合成的服务器目录，供基准测试使用，相同的参数与种子总是生成相同的内容
+
+    nbt     大量 gzip 压缩的小 NBT 文件（玩家数据、统计、数据文件）
+    region  大型 .mca 区域文件，区块数据以 zlib 压缩，几乎不可再压缩
+    jar     不可压缩的模组 jar
+    mixed   以上三种按较小数量组合
+"""
+import os
+import gzip
+import json
+import zlib
+import struct
+import random
+import shutil
+from typing import Dict
+
+SECTOR_SIZE = 4096
+CHUNKS_PER_REGION = 32 * 32
+MARKER_NAME = '.synthetic_world.json'
+# 每种形态的文件数量与大小，乘以 scale 后取整
+SHAPES: Dict[str, Dict[str, int]] = {
+    'nbt': {'nbt_files': 5000},
+    'region': {'region_files': 24},
+    'jar': {'jar_files': 16},
+    'mixed': {'nbt_files': 1500, 'region_files': 8, 'jar_files': 6},
+}
+NBT_KEYS = [b'DataVersion', b'Pos', b'Motion', b'Rotation', b'Health', b'foodLevel', b'XpLevel',
+            b'Inventory', b'id', b'Count', b'Slot', b'tag', b'Damage', b'Dimension', b'SelectedItemSlot']
+
+
+def _fake_nbt(rng: random.Random, size: int) -> bytes:
+    # 重复的键名加随机数值，与真实 NBT 的可压缩程度相近
+    parts = []
+    total = 0
+    while total < size:
+        key = rng.choice(NBT_KEYS)
+        part = struct.pack('>bH', rng.randint(1, 10), len(key)) + key + struct.pack('>q', rng.getrandbits(24))
+        parts.append(part)
+        total += len(part)
+    return b''.join(parts)
+
+
+def _chunk_payload(rng: random.Random) -> bytes:
+    # 区块内大量重复的方块调色板索引夹杂少量随机数据，压缩后约 2-6 KB
+    palette = bytes(rng.randrange(16) for _ in range(64))
+    body = palette * rng.randint(40, 120) + rng.randbytes(rng.randint(256, 2048))
+    return zlib.compress(_fake_nbt(rng, 512) + body, 6)
+
+
+def _write_region(path: str, rng: random.Random):
+    locations = bytearray(SECTOR_SIZE)
+    timestamps = bytearray(SECTOR_SIZE)
+    sectors = []
+    offset = 2
+    for index in range(CHUNKS_PER_REGION):
+        if rng.random() < 0.15:
+            continue  # 未生成的区块
+        data = _chunk_payload(rng)
+        chunk = struct.pack('>IB', len(data) + 1, 2) + data
+        count = (len(chunk) + SECTOR_SIZE - 1) // SECTOR_SIZE
+        sectors.append(chunk.ljust(count * SECTOR_SIZE, b'\0'))
+        struct.pack_into('>I', locations, index * 4, offset << 8 | count)
+        struct.pack_into('>I', timestamps, index * 4, 1700000000 + rng.randrange(10 ** 6))
+        offset += count
+    with open(path, 'wb') as f:
+        f.write(locations)
+        f.write(timestamps)
+        for sector in sectors:
+            f.write(sector)
+
+
+def _write(path: str, data: bytes):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(data)
+
+
+def generate_world(root: str, shape: str = 'mixed', scale: float = 1.0, seed: int = 0) -> dict:
+    """
+    在 root 下生成合成服务器目录，返回生成参数；目录中已有相同参数生成的内容时直接复用
+    """
+    if shape not in SHAPES:
+        raise ValueError(f"未知的目录形态: {shape}")
+    params = {'shape': shape, 'scale': scale, 'seed': seed}
+    marker = os.path.join(root, MARKER_NAME)
+    if os.path.exists(marker):
+        with open(marker, 'r', encoding='utf-8') as f:
+            if json.load(f) == params:
+                return params
+        for name in ('world', 'mods'):
+            shutil.rmtree(os.path.join(root, name), ignore_errors=True)
+    elif os.path.isdir(root) and os.listdir(root):
+        # 只覆盖由本脚本生成的目录，避免误删真实的服务器目录
+        raise ValueError(f"目录非空且不是合成目录: {root}")
+
+    rng = random.Random(seed)
+    counts = {key: max(int(value * scale), 1) for key, value in SHAPES[shape].items()}
+    world = os.path.join(root, 'world')
+    _write(os.path.join(root, 'server.properties'), b'level-name=world\nmax-players=20\n')
+    for i in range(counts.get('nbt_files', 0)):
+        folder = ('playerdata', 'stats', 'data', 'advancements')[i % 4]
+        data = _fake_nbt(rng, rng.randint(1024, 16 * 1024))
+        _write(os.path.join(world, folder, f'{rng.getrandbits(64):016x}.dat'), gzip.compress(data, 6, mtime=0))
+    side = max(int(counts.get('region_files', 0) ** 0.5), 1)
+    for i in range(counts.get('region_files', 0)):
+        path = os.path.join(world, 'region', f'r.{i % side}.{i // side}.mca')
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        _write_region(path, rng)
+    for i in range(counts.get('jar_files', 0)):
+        _write(os.path.join(root, 'mods', f'mod_{i:03d}.jar'), rng.randbytes(rng.randint(1, 12) * 1024 * 1024))
+    with open(marker, 'w', encoding='utf-8') as f:
+        json.dump(params, f)
+    return params
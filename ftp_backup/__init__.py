@@ -3,18 +3,16 @@ from .config import Config
 from .ftp_manager import FTPManager
 from .sftp_manager import SFTPManager
 from .commands import CommandHandler
-from .backup_util import BackupManager
+from .orchestrator import create_instances
 from .server_controller import ServerController
 
 config: Config
-transfer_manager: object
-backup_manager: BackupManager
 server_controller: ServerController
 command_handler: CommandHandler
 
 
 def on_load(server: PluginServerInterface, old_module):
-    global config, transfer_manager, backup_manager, server_controller, command_handler
+    global config, server_controller, command_handler
 
     try:
         def init_config():
@@ -36,16 +34,16 @@ def on_load(server: PluginServerInterface, old_module):
             transfer_manager = FTPManager(server)
             server.logger.error("未知的协议，已选择默认FTP协议")
 
-        backup_manager = BackupManager(server, config)
         server_controller = ServerController(server)
         command_handler = CommandHandler(
             server,
             config,
             transfer_manager,
-            backup_manager,
+            create_instances(server, config),
             server_controller
         )
         command_handler.register_commands()
+        command_handler.start_workers()
 
         if config.auto_backup:
             command_handler.start_timed_tasks()
@@ -57,5 +55,8 @@ def on_load(server: PluginServerInterface, old_module):
 
 
 def on_unload(server: PluginServerInterface):
-    transfer_manager.disconnect()
-    command_handler.shutdown_scheduler()
\ No newline at end of file
+    command_handler.stop_workers()
+    command_handler.close_connections()
+    command_handler.shutdown_scheduler()
+    for instance in command_handler.instances:
+        instance.backup_manager.catalog.close()
\ No newline at end of file
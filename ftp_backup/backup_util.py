@@ -1,10 +1,29 @@
 import os
 import time
+import shutil
 import zipfile
-import fnmatch
-from typing import Optional, Generator
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, List, Optional, Tuple
 from mcdreforged.api.all import PluginServerInterface
 from .config import Config
+from .compressor import ParallelCompressor, resolve_workers, READ_BLOCK_SIZE
+from .chunk_store import ChunkStore, Snapshot, SnapshotFile, SNAPSHOT_SUFFIX
+from .stream_pipe import StreamUpload, TeeWriter
+from .throttle import TokenBucket, ThrottledReader
+from .staging import StagingArea, STAGING_DIR
+from .retention import RetentionPolicy
+from .metrics import BackupMetrics, format_eta
+from .restore import INDEX_SUFFIX, build_member_index, index_path
+from .checksum import HashingWriter, checksum_path, new_hasher
+from .catalog import BackupCatalog, CATALOG_NAME, LOCATION_LOCAL
+from .synthetic import ReusePlan, plan_reuse
+from .scanner import ExcludeMatcher, ScannedFile, scan_directory
+from .region_delta import (DELTA_SUFFIX, RegionFormatError, RegionState, fingerprint, is_region_file,
+                           make_delta, parse_region, read_file, region_state_path)
+from .codec import CodecPolicy, TarZstWriter, ARCHIVE_TAR_ZST, ARCHIVE_SUFFIXES, archive_suffix
+from .manifest import (BackupManifest, FileEntry, MANIFEST_NAME, MANIFEST_SUFFIX,
+                       BACKUP_FULL, BACKUP_INCREMENTAL, BACKUP_DIFFERENTIAL,
+                       manifest_path, load_manifest, load_latest_manifest, diff_files)
 
 
 class BackupManager:
@@ -17,13 +36,51 @@ class BackupManager:
         self.backup = False
         self.total_files = None
         self.processed_files = 0
+        self.total_bytes = 0
+        self.processed_bytes = 0
         self.abort_backup = False
+        self.read_limiter: Optional[TokenBucket] = None
+        self.source_dir = self.config.server_dir
+        self.metrics = BackupMetrics()
+        self.chunk_store: Optional[ChunkStore] = None
+        self.exclude_matcher = ExcludeMatcher(self.config.exclude_patterns)
+        self.codec_policy = self.__build_codec_policy()
+        self.last_timestamp = ''
+        self.catalog = BackupCatalog(os.path.join(self.backup_dir, CATALOG_NAME))
 
     def update_config(self, new_config: Config):
         self.config = self.__validate_config(new_config)
-        self.backup_dir = os.path.abspath(self.config.local_path)
-        os.makedirs(self.backup_dir, exist_ok=True)
+        backup_dir = os.path.abspath(self.config.local_path)
+        os.makedirs(backup_dir, exist_ok=True)
+        if backup_dir != self.backup_dir:
+            self.catalog.close()
+            self.catalog = BackupCatalog(os.path.join(backup_dir, CATALOG_NAME))
+        self.backup_dir = backup_dir
         self.__validate_backup_dir()
+        self.chunk_store = None
+        self.exclude_matcher = ExcludeMatcher(self.config.exclude_patterns)
+        self.codec_policy = self.__build_codec_policy()
+
+    def __build_codec_policy(self) -> CodecPolicy:
+        return CodecPolicy(self.config.codec_rules, self.config.compress_level,
+                           self.config.detect_incompressible)
+
+    def __next_timestamp(self) -> str:
+        # 备份名精确到秒，队列中连续执行的备份可能在同一秒内开始，等到下一秒以免覆盖尚未上传的备份
+        timestamp = time.strftime("%Y%m%d-%H%M%S")
+        while timestamp <= self.last_timestamp:
+            time.sleep(0.1)
+            timestamp = time.strftime("%Y%m%d-%H%M%S")
+        self.last_timestamp = timestamp
+        return timestamp
+
+    def use_chunk_store(self) -> bool:
+        return self.config.storage_backend.lower() == 'chunk'
+
+    def get_chunk_store(self) -> ChunkStore:
+        if self.chunk_store is None:
+            self.chunk_store = ChunkStore(self.backup_dir, self.config.chunk_size_kb * 1024)
+        return self.chunk_store
 
     def __validate_backup_dir(self):
         if not os.access(self.backup_dir, os.W_OK):
@@ -38,96 +95,457 @@ class BackupManager:
             raise ValueError(f"服务器目录不存在: {config.server_dir}")
         if not os.access(config.server_dir, os.R_OK):
             raise PermissionError(f"目录不可读: {config.server_dir}")
+        if config.checksum_algorithm:
+            new_hasher(config.checksum_algorithm)
         return config
 
-    def __should_include(self, path: str) -> bool:
-        rel_path = os.path.relpath(path, self.config.server_dir)
-        for pattern in self.config.exclude_patterns:
-            if fnmatch.fnmatch(rel_path, pattern):
-                return False
-            if fnmatch.fnmatch(rel_path, os.path.join(pattern, '*')):
-                return False
-        return True
-
-    def __get_total_files(self) -> int:
-        total = 0
-        for root, dirs, files in os.walk(self.config.server_dir):
-            dirs[:] = [d for d in dirs if self.__should_include(os.path.join(root, d))]
-            total += len(files)
-        return total
-
-    def __walk_files(self) -> Generator[str, None, None]:
-        for root, dirs, files in os.walk(self.config.server_dir):
-            dirs[:] = [d for d in dirs if self.__should_include(os.path.join(root, d))]
-            for file in files:
-                full_path = os.path.join(root, file)
-                if self.__should_include(full_path):
-                    yield full_path
-
-    def create_backup(self) -> Optional[str]:
+    def __scan_entries(self) -> Tuple[Dict[str, FileEntry], Dict[str, ScannedFile]]:
+        result = scan_directory(self.source_dir, self.exclude_matcher)
+        entries, scanned = {}, {}
+        for f in result.files:
+            entries[f.rel_path] = FileEntry(f.size, f.mtime_ns)
+            scanned[f.rel_path] = f
+        return entries, scanned
+
+    def __plan_manifest(self, filename: str) -> Tuple[BackupManifest, Optional[BackupManifest]]:
+        # 根据备份模式与全量周期确定本次备份类型及参考清单
+        mode = self.config.backup_mode.lower()
+        if mode not in (BACKUP_INCREMENTAL, BACKUP_DIFFERENTIAL):
+            return BackupManifest(filename), None
+        latest = load_latest_manifest(self.backup_dir)
+        if latest is None:
+            self.server.logger.info("§6未找到可用的历史备份清单，本次执行全量备份")
+            return BackupManifest(filename), None
+        interval = self.config.full_backup_interval
+        if 0 < interval <= latest.chain_length + 1:
+            self.server.logger.info(f"§6已达到全量备份周期 ({interval})，本次执行全量备份")
+            return BackupManifest(filename), None
+        if mode == BACKUP_DIFFERENTIAL:
+            reference = latest if latest.backup_type == BACKUP_FULL else load_manifest(self.backup_dir, latest.root)
+            if reference is None:
+                self.server.logger.info("§6基准全量备份缺失，本次执行全量备份")
+                return BackupManifest(filename), None
+        else:
+            reference = latest
+        return BackupManifest(filename, mode, latest.root, latest.name, latest.chain_length + 1), reference
+
+    def __plan_region_state(self, manifest: BackupManifest,
+                            reference: Optional[BackupManifest]) -> Tuple[Optional[RegionState], Optional[RegionState]]:
+        # 返回本次备份与参考备份的区块指纹，未变更的区域文件直接沿用参考备份的指纹
+        if not self.config.region_delta or \
+                self.config.backup_mode.lower() not in (BACKUP_INCREMENTAL, BACKUP_DIFFERENTIAL):
+            return None, None
+        state = RegionState()
+        if reference is None:
+            return state, None
+        reference_state = RegionState.load(region_state_path(os.path.join(self.backup_dir, reference.name)))
+        if reference_state is None:
+            self.server.logger.info("§6参考备份没有区块指纹，本次区域文件按完整文件备份")
+            return state, None
+        changed = set(manifest.changed)
+        for path, table in reference_state.files.items():
+            if path in manifest.files and path not in changed:
+                state.files[path] = table
+        return state, reference_state
+
+    def create_backup(self, stream_upload: Optional[StreamUpload] = None,
+                      read_limiter: Optional[TokenBucket] = None, source_dir: Optional[str] = None,
+                      metrics: Optional[BackupMetrics] = None) -> Optional[str]:
+        # source_dir 为暂存目录时从暂存副本读取，服务器可在压缩期间正常运行
+        self.read_limiter = read_limiter
+        self.source_dir = source_dir or self.config.server_dir
+        self.metrics = metrics or BackupMetrics()
+        if self.use_chunk_store():
+            return self.__create_chunk_backup()
+        output_path = None
+        reuse = ReusePlan()
         try:
             # 生成备份文件名和路径
-            timestamp = time.strftime("%Y%m%d-%H%M%S")
-            filename = f"backup_{timestamp}.zip"
+            timestamp = self.__next_timestamp()
             self.abort_backup = False
-            output_path = os.path.join(self.backup_dir, filename)
 
             # 确保备份目录存在
             if not os.path.isdir(self.backup_dir):
                 os.makedirs(self.backup_dir, exist_ok=True)
 
-            # 初始化备份参数
-            self.total_files = self.__get_total_files()
+            # 扫描文件并与参考清单对比
+            with self.metrics.phase('scan'):
+                entries, scanned = self.__scan_entries()
+                suffix = archive_suffix(self.config.archive_format)
+                manifest, reference = self.__plan_manifest(f"backup_{timestamp}{suffix}")
+                manifest.changed, manifest.deleted = diff_files(
+                    entries, reference.files if reference is not None else {},
+                    self.source_dir, self.config.manifest_hash)
+            if manifest.backup_type != BACKUP_FULL:
+                kind = 'inc' if manifest.backup_type == BACKUP_INCREMENTAL else 'diff'
+                manifest.name = f"backup_{timestamp}_{kind}{suffix}"
+            manifest.files = entries
+            filename = manifest.name
+            output_path = os.path.join(self.backup_dir, filename)
+            region_state, reference_state = self.__plan_region_state(manifest, reference)
+
+            # 初始化备份参数，启用区域文件差量时 .mca 文件单独处理
+            files = [scanned[path] for path in manifest.changed]
+            regions = []
+            if region_state is not None:
+                regions = [f for f in files if is_region_file(f.rel_path)]
+                files = [f for f in files if not is_region_file(f.rel_path)]
+            if manifest.backup_type == BACKUP_FULL and self.config.synthetic_full and \
+                    self.config.archive_format.lower() != ARCHIVE_TAR_ZST:
+                reuse = self.__plan_reuse(manifest, files)
+                files = [f for f in files if f.rel_path not in reuse.members]
+            self.total_files = len(files) + len(regions) + len(reuse.members)
+            self.total_bytes = sum(f.size for f in files) + sum(f.size for f in regions) + reuse.reused_bytes
             self.processed_files = 0
+            self.processed_bytes = 0
             start_time = time.time()
+            self.metrics.name = filename
+            self.metrics.backup_type = manifest.backup_type
+            self.metrics.files = self.total_files
+            self.metrics.source_bytes = self.total_bytes
+
+            # 流式上传时压缩包直接写入管道，可选同时保留本地副本
+            local_file = None
+            if stream_upload is None:
+                target = output_path
+            else:
+                stream_upload.start(filename)
+                if self.config.stream_keep_local:
+                    local_file = open(output_path, 'wb')
+                    target = TeeWriter(local_file, stream_upload.pipe)
+                else:
+                    target = stream_upload.pipe
+            # 写出压缩包时同步计算校验值，流式上传时即为发送的数据，无需再次读取压缩包
+            hashing = None
+            if self.config.checksum_algorithm:
+                if stream_upload is None:
+                    local_file = target = open(output_path, 'wb')
+                hashing = target = HashingWriter(target, self.config.checksum_algorithm)
 
-            # 创建 ZIP 压缩包
-            with zipfile.ZipFile(output_path, 'w', zipfile.ZIP_DEFLATED) as zipf:
+            if manifest.backup_type == BACKUP_FULL:
                 self.server.logger.info("§b开始压缩，共发现 {} 个文件".format(self.total_files))
-                self.backup = True
-                # 遍历并压缩文件
-                for full_path in self.__walk_files():
-                    if self.abort_backup:
-                        #抛出自定义异常
-                        raise BackupAbortedException("用户终止了备份")
-                    arcname = os.path.relpath(full_path, self.config.server_dir)
-                    zipf.write(full_path, arcname)
-                    self.processed_files += 1
+            else:
+                self.server.logger.info(f"§b开始{'增量' if manifest.backup_type == BACKUP_INCREMENTAL else '差异'}压缩，"
+                                        f"变更 {len(manifest.changed)} 个文件，删除 {len(manifest.deleted)} 个文件")
+            self.backup = True
+            workers = resolve_workers(self.config.compress_workers)
+            with self.metrics.phase('compress'):
+                try:
+                    if self.config.archive_format.lower() == ARCHIVE_TAR_ZST:
+                        # 创建 tar.zst 压缩包，由 zstd 在内部多线程压缩
+                        with TarZstWriter(target, self.config.zstd_level, workers) as archive:
+                            self.__write_regions(lambda f, member, data, full: archive.writestr(member, data),
+                                                 regions, manifest, region_state, reference_state)
+                            self.__write_tar(archive, files)
+                            archive.writestr(MANIFEST_NAME, manifest.dumps().encode('utf-8'))
+                    else:
+                        # 创建 ZIP 压缩包
+                        with zipfile.ZipFile(target, 'w', zipfile.ZIP_DEFLATED,
+                                             compresslevel=self.config.compress_level) as zipf:
+                            self.__write_regions(lambda f, member, data, full: self.__write_zip_member(
+                                zipf, f, member, data, full), regions, manifest, region_state, reference_state)
+                            if reuse.members:
+                                self.__copy_reused(zipf, reuse, scanned)
+                            if workers > 1:
+                                self.server.logger.info(f"§b已启用并行压缩，线程数: {workers}")
+                                self.__compress_parallel(zipf, files, workers)
+                            else:
+                                self.__compress_serial(zipf, files)
+                            zipf.writestr(MANIFEST_NAME, manifest.dumps())
+                finally:
+                    if local_file is not None:
+                        local_file.close()
+            if stream_upload is not None and not stream_upload.finish():
+                raise IOError("流式上传失败")
+            manifest.save(manifest_path(output_path))
+            if hashing is not None:
+                hashing.result().save(checksum_path(output_path))
+            if region_state is not None:
+                region_state.save(region_state_path(output_path))
+            if os.path.exists(output_path):
+                self.metrics.archive_bytes = os.path.getsize(output_path)
+                if self.config.archive_format.lower() != ARCHIVE_TAR_ZST:
+                    # 记录成员偏移与校验值，恢复时按需读取
+                    build_member_index(output_path, manifest)
+            elif stream_upload is not None:
+                self.metrics.archive_bytes = stream_upload.bytes_written
+            self.__record_catalog(lambda: self.catalog.record_backup(
+                manifest.name, manifest.backup_type, manifest.files, manifest.changed, manifest.deleted,
+                self.metrics.archive_bytes, hashing.result() if hashing is not None else None,
+                manifest.base, manifest.parent, os.path.exists(output_path)))
 
             # 完成提示
             cost_time = time.time() - start_time
             self.server.logger.info(f"\n§a压缩完成，耗时 {cost_time:.1f} 秒")
-            self.server.logger.info(f"§a备份文件已保存至: §e{output_path}")
+            if stream_upload is None or self.config.stream_keep_local:
+                self.server.logger.info(f"§a备份文件已保存至: §e{output_path}")
+            else:
+                self.server.logger.info(f"§a备份已流式上传: §e{filename}")
 
             return output_path
         #捕获自定义异常
         except BackupAbortedException as e:
             self.server.logger.error(f"\n§c备份已终止: {str(e)}")
-            if os.path.exists(output_path):
-                os.remove(output_path)
+            if stream_upload is not None:
+                stream_upload.abort(e)
+            self.__remove_backup_files(output_path)
             return None
         except Exception as e:
             self.server.logger.error(f"\n§c压缩失败: {str(e)}")
+            if stream_upload is not None:
+                stream_upload.abort(e)
             # 删除未完成的备份文件
-            if os.path.exists(output_path):
-                os.remove(output_path)
+            if output_path is not None:
+                self.__remove_backup_files(output_path)
             return None
         finally:
+            reuse.close()
             self.backup = False
 
-    def cleanup_backups(self):
-        backups = sorted(
-            [f for f in os.listdir(self.backup_dir) if f.endswith('.zip')],
-            key=lambda f: os.path.getctime(os.path.join(self.backup_dir, f)))
-        while len(backups) > self.config.keep_local_backups:
-            old_file = backups.pop(0)
-            os.remove(os.path.join(self.backup_dir, old_file))
+    def __plan_reuse(self, manifest: BackupManifest, files: List[ScannedFile]) -> ReusePlan:
+        try:
+            reuse = plan_reuse(self.backup_dir, manifest.files, [f.rel_path for f in files])
+            reuse.open_sources()
+        except Exception as e:
+            self.server.logger.warning(f"§6查找可复用的备份数据失败，本次重新压缩全部文件: {str(e)}")
+            return ReusePlan()
+        if reuse.members:
+            self.server.logger.info(f"§b合成全量备份：复用 {len(reuse.members)} 个未变化文件的压缩数据 "
+                                    f"({reuse.reused_bytes / 1024 / 1024:.1f} MB)，"
+                                    f"重新压缩 {len(files) - len(reuse.members)} 个文件")
+        return reuse
+
+    def __copy_reused(self, zipf: zipfile.ZipFile, reuse: ReusePlan, scanned: Dict[str, ScannedFile]):
+        def on_written(zinfo):
+            self.processed_files += 1
+            self.processed_bytes += zinfo.file_size
+
+        if not reuse.copy_to(zipf, scanned, self.read_limiter, on_written, lambda: self.abort_backup):
+            raise BackupAbortedException("用户终止了备份")
+
+    def stage_snapshot(self) -> str:
+        # 将服务器目录同步到暂存目录作为时间点副本，返回暂存目录路径
+        start_time = time.time()
+        staging = StagingArea(os.path.join(self.backup_dir, STAGING_DIR), self.config.snapshot_method,
+                              self.config.snapshot_workers)
+        files = scan_directory(self.config.server_dir, self.exclude_matcher).files
+        self.backup = True
+        try:
+            result = staging.sync(files)
+        except Exception:
+            self.backup = False
+            raise
+        self.server.logger.info(f"§b暂存副本创建完成，耗时 {time.time() - start_time:.1f} 秒：克隆 {result.cloned} 个，"
+                                f"复制 {result.copied} 个 ({result.copied_bytes / 1024 / 1024:.1f} MB)，"
+                                f"未变化 {result.unchanged} 个，删除 {result.removed} 个")
+        return staging.root
+
+    def __create_chunk_backup(self) -> Optional[str]:
+        store = self.get_chunk_store()
+        snapshot = Snapshot(f"backup_{self.__next_timestamp()}")
+        try:
+            self.abort_backup = False
+            with self.metrics.phase('scan'):
+                entries, scanned = self.__scan_entries()
+                previous = store.latest_snapshot()
+            self.total_files = len(entries)
+            self.total_bytes = sum(entry.size for entry in entries.values())
+            self.processed_files = 0
+            self.processed_bytes = 0
+            start_time = time.time()
+            self.metrics.name = snapshot.name
+            self.metrics.backup_type = 'chunk'
+
+            # 大小与修改时间未变的文件直接沿用上一快照的数据块列表，无需读取
+            changed = []
+            for path, entry in entries.items():
+                old = previous.files.get(path) if previous is not None else None
+                if old is not None and old.size == entry.size and old.mtime_ns == entry.mtime_ns:
+                    snapshot.files[path] = old
+                    self.processed_files += 1
+                    self.processed_bytes += entry.size
+                else:
+                    changed.append(path)
+            self.server.logger.info(f"§b开始写入去重存储，共发现 {len(entries)} 个文件，其中 {len(changed)} 个需要切块")
+            self.backup = True
+
+            def store_file(path):
+                if self.abort_backup:
+                    raise BackupAbortedException("用户终止了备份")
+                return path, store.store_file(scanned[path].path, self.read_limiter)
+
+            written = 0
+            workers = resolve_workers(self.config.compress_workers)
+            with self.metrics.phase('compress'), \
+                    ThreadPoolExecutor(max_workers=workers, thread_name_prefix='ftp_backup_chunk') as executor:
+                for path, (chunks, size) in executor.map(store_file, changed):
+                    entry = entries[path]
+                    snapshot.files[path] = SnapshotFile(entry.size, entry.mtime_ns, chunks)
+                    written += size
+                    self.processed_files += 1
+                    self.processed_bytes += entry.size
+            snapshot_path = store.save_snapshot(snapshot)
+            deleted = [path for path in previous.files if path not in entries] if previous is not None else []
+            self.__record_catalog(lambda: self.catalog.record_backup(
+                snapshot.name, 'chunk', entries, changed, deleted, written))
+            self.metrics.files = len(changed)
+            self.metrics.source_bytes = sum(entries[path].size for path in changed)
+            self.metrics.archive_bytes = written
+
+            cost_time = time.time() - start_time
+            self.server.logger.info(f"\n§a快照创建完成，耗时 {cost_time:.1f} 秒，新增数据 {written / 1024 / 1024:.2f} MB")
+            self.server.logger.info(f"§a快照索引已保存至: §e{snapshot_path}")
+            return snapshot_path
+        except BackupAbortedException as e:
+            self.server.logger.error(f"\n§c备份已终止: {str(e)}")
+            return None
+        except Exception as e:
+            self.server.logger.error(f"\n§c快照创建失败: {str(e)}")
+            return None
+        finally:
+            self.backup = False
+
+    def __compress_serial(self, zipf: zipfile.ZipFile, files: List[ScannedFile]):
+        # 遍历并压缩文件
+        for f in files:
+            if self.abort_backup:
+                #抛出自定义异常
+                raise BackupAbortedException("用户终止了备份")
+            compress_type, level = self.codec_policy.resolve(f.path, f.rel_path, f.size)
+            if self.read_limiter is None:
+                zipf.write(f.path, f.rel_path, compress_type, level)
+            else:
+                self.__write_throttled(zipf, f, compress_type, level)
+            self.processed_files += 1
+            self.processed_bytes += f.size
+
+    def __write_regions(self, write_member, regions: List[ScannedFile], manifest: BackupManifest,
+                        state: Optional[RegionState], reference_state: Optional[RegionState]):
+        # 区域文件整体读入后按区块对比指纹，只写入时间戳或内容变化的区块；写入的正是计算指纹的数据，两者始终一致
+        if not regions:
+            return
+        saved = 0
+        for f in regions:
+            if self.abort_backup:
+                raise BackupAbortedException("用户终止了备份")
+            data = read_file(f.path, self.read_limiter)
+            previous = reference_state.files.get(f.rel_path) if reference_state is not None else None
+            delta = None
+            try:
+                if previous is not None:
+                    delta, state.files[f.rel_path] = make_delta(data, previous)
+                else:
+                    state.files[f.rel_path] = fingerprint(*parse_region(data))
+            except RegionFormatError as e:
+                self.server.logger.warning(f"§6区域文件 {f.rel_path} 格式异常，按完整文件备份: {str(e)}")
+                state.files.pop(f.rel_path, None)
+            if delta is not None:
+                write_member(f, f.rel_path.replace(os.sep, '/') + DELTA_SUFFIX, delta, False)
+                manifest.deltas.append(f.rel_path)
+                saved += len(data) - len(delta)
+            else:
+                write_member(f, f.rel_path.replace(os.sep, '/'), data, True)
+            self.processed_files += 1
+            self.processed_bytes += f.size
+        if manifest.deltas:
+            self.server.logger.info(f"§b{len(manifest.deltas)} / {len(regions)} 个区域文件只保存了变化的区块，"
+                                    f"减少 {saved / 1024 / 1024:.1f} MB")
+
+    def __write_zip_member(self, zipf: zipfile.ZipFile, f: ScannedFile, member: str, data: bytes, full: bool):
+        # 差量中的区块数据已由游戏压缩，直接存储
+        zinfo = zipfile.ZipInfo.from_file(f.path, member)
+        if full:
+            compress_type, level = self.codec_policy.resolve(f.path, f.rel_path, f.size)
+        else:
+            compress_type, level = zipfile.ZIP_STORED, 0
+        zipf.writestr(zinfo, data, compress_type, level)
+
+    def __write_tar(self, archive: TarZstWriter, files: List[ScannedFile]):
+        for f in files:
+            if self.abort_backup:
+                raise BackupAbortedException("用户终止了备份")
+            archive.add(f.path, f.rel_path, self.read_limiter)
+            self.processed_files += 1
+            self.processed_bytes += f.size
+
+    def __write_throttled(self, zipf: zipfile.ZipFile, f: ScannedFile, compress_type: int, level: int):
+        # 与 ZipFile.write 相同，但按限速读取源文件
+        zinfo = zipfile.ZipInfo.from_file(f.path, f.rel_path)
+        zinfo.compress_type = compress_type
+        zinfo._compresslevel = level
+        with open(f.path, 'rb') as src, zipf.open(zinfo, 'w') as dst:
+            shutil.copyfileobj(ThrottledReader(src, self.read_limiter), dst, READ_BLOCK_SIZE)
+
+    def __compress_parallel(self, zipf: zipfile.ZipFile, files: List[ScannedFile], workers: int):
+        def on_written(zinfo):
+            self.processed_files += 1
+            self.processed_bytes += zinfo.file_size
+
+        members = ((f.path, f.rel_path) for f in files)
+        compressor = ParallelCompressor(workers, self.config.compress_level, self.codec_policy, self.read_limiter)
+        finished = compressor.write_all(
+            zipf, members, on_written, lambda: self.abort_backup)
+        if not finished:
+            raise BackupAbortedException("用户终止了备份")
+
+    def __record_catalog(self, record):
+        # 目录只用于查询，写入失败不影响备份本身
+        try:
+            record()
+        except Exception as e:
+            self.server.logger.error(f"写入备份目录失败: {str(e)}")
+
+    def __remove_backup_files(self, backup_path: str):
+        for path in (backup_path, manifest_path(backup_path), index_path(backup_path),
+                     region_state_path(backup_path), checksum_path(backup_path)):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def __list_backups(self) -> set:
+        # 流式上传未保留本地副本的备份只有清单文件，也计入保留数量
+        names = {f for f in os.listdir(self.backup_dir) if f.endswith(ARCHIVE_SUFFIXES)}
+        names |= {f[:-len(MANIFEST_SUFFIX)] for f in os.listdir(self.backup_dir) if f.endswith(MANIFEST_SUFFIX)}
+        # 恢复远程备份时缓存的成员索引同样按保留策略清理
+        names |= {f[:-len(INDEX_SUFFIX)] for f in os.listdir(self.backup_dir) if f.endswith(INDEX_SUFFIX)}
+        return names
+
+    def cleanup_backups(self, protected: Iterable[str] = ()):
+        # 按分层保留策略清理，被保留的增量/差异备份所依赖的备份不会被删除
+        # protected 为尚在上传队列中的压缩包（或快照索引）路径，无论保留策略如何都不删除
+        policy = RetentionPolicy.from_config(self.config, self.config.keep_local_backups)
+        protected = {os.path.basename(path) for path in protected}
+        if self.use_chunk_store():
+            store = self.get_chunk_store()
+            protected = {name[:-len(SNAPSHOT_SUFFIX)] if name.endswith(SNAPSHOT_SUFFIX) else name
+                         for name in protected}
+            removed_snapshots, removed_chunks = store.prune(policy.select(store.list_snapshots()) | protected)
+            for name in removed_snapshots:
+                self.__record_catalog(lambda: self.catalog.remove_backup(name))
+                self.server.logger.info(f"§6已清理旧快照: {name}")
+            if removed_chunks:
+                self.server.logger.info(f"§6已回收 {len(removed_chunks)} 个未引用的数据块")
+            return
+        for old_file in policy.prunable(self.__list_backups()):
+            if old_file in protected:
+                continue
+            self.__remove_backup_files(os.path.join(self.backup_dir, old_file))
+            self.__record_catalog(lambda: self.catalog.remove_location(old_file, LOCATION_LOCAL))
             self.server.logger.info(f"§6已清理旧备份: {old_file}")
 
     def inquire_backup(self):
         if self.backup:
+            self.server.logger.info(f"§6当前阶段：{self.metrics.phase_name()}")
             self.server.logger.info(f"§6总文件数：{self.total_files}")
             self.server.logger.info(f"§6已备份文件数：{self.processed_files}")
+            if self.total_bytes:
+                percent = self.processed_bytes / self.total_bytes * 100
+                self.server.logger.info(f"§6已备份数据量：{self.processed_bytes / 1024 / 1024:.1f} / "
+                                        f"{self.total_bytes / 1024 / 1024:.1f} MB ({percent:.1f}%)")
+            elapsed = self.metrics.phase_elapsed()
+            if self.metrics.current_phase == 'compress' and elapsed > 0 and self.processed_bytes:
+                speed = self.processed_bytes / elapsed
+                eta = (self.total_bytes - self.processed_bytes) / speed
+                self.server.logger.info(f"§6压缩速度：{speed / 1024 / 1024:.1f} MB/s，预计剩余 {format_eta(eta)}")
         else:
             self.server.logger.info("§6没有在进行的备份任务")
 
@@ -0,0 +1,253 @@
+import os
+import time
+import sqlite3
+import threading
+from typing import Dict, Iterable, List, Optional, Tuple
+from .checksum import ArchiveChecksum, checksum_path
+from .manifest import BackupManifest, MANIFEST_SUFFIX
+
+CATALOG_NAME = 'backup_catalog.db'
+LOCATION_LOCAL = 'local'
+SCHEMA_VERSION = 2
+# 按路径前缀查询目录时的上界，'/' 之后的第一个字符
+_DIR_UPPER = chr(ord('/') + 1)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS backups (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE,
+    type TEXT NOT NULL,
+    base TEXT,
+    parent TEXT,
+    created REAL NOT NULL,
+    files INTEGER NOT NULL,
+    source_bytes INTEGER NOT NULL,
+    archive_bytes INTEGER,
+    checksum_algorithm TEXT,
+    checksum TEXT,
+    status TEXT,
+    duration REAL
+);
+CREATE TABLE IF NOT EXISTS locations (
+    backup_id INTEGER NOT NULL,
+    location TEXT NOT NULL,
+    size INTEGER,
+    added REAL NOT NULL,
+    PRIMARY KEY (backup_id, location)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS paths (
+    id INTEGER PRIMARY KEY,
+    path TEXT NOT NULL UNIQUE
+);
+CREATE TABLE IF NOT EXISTS members (
+    path_id INTEGER NOT NULL,
+    backup_id INTEGER NOT NULL,
+    size INTEGER,
+    mtime_ns INTEGER,
+    PRIMARY KEY (path_id, backup_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS members_backup ON members (backup_id);
+"""
+
+
+class CatalogEntry:
+    def __init__(self, name: str, backup_type: str, created: float, files: int, source_bytes: int,
+                 archive_bytes: Optional[int], checksum_algorithm: Optional[str], checksum: Optional[str],
+                 status: Optional[str], duration: Optional[float], locations: List[str]):
+        self.name = name
+        self.backup_type = backup_type
+        self.created = created
+        self.files = files
+        self.source_bytes = source_bytes
+        self.archive_bytes = archive_bytes
+        self.checksum_algorithm = checksum_algorithm
+        self.checksum = checksum
+        self.status = status
+        self.duration = duration
+        self.locations = locations
+
+
+class FileVersion:
+    # 某个文件在一次备份中写入的版本，size 为 None 表示该备份中文件已被删除
+    def __init__(self, path: str, backup: str, backup_type: str, created: float,
+                 size: Optional[int], mtime_ns: Optional[int], locations: List[str]):
+        self.path = path
+        self.backup = backup
+        self.backup_type = backup_type
+        self.created = created
+        self.size = size
+        self.mtime_ns = mtime_ns
+        self.locations = locations
+
+    @property
+    def deleted(self) -> bool:
+        return self.size is None
+
+
+class BackupCatalog:
+    """
+    记录所有备份的 SQLite 目录：备份类型、大小、校验值、耗时、所在位置（本地或各上传目标），
+    以及每个备份实际写入的文件版本（大小与修改时间），列出备份与查询文件历史时无需打开压缩包或连接远程服务器
+    数据库首次建立时从本地清单导入已有的备份
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.path_ids: Optional[Dict[str, int]] = None
+        with self.lock, self.conn:
+            self.conn.execute('PRAGMA journal_mode=WAL')
+            self.conn.execute('PRAGMA synchronous=NORMAL')
+            version = self.conn.execute('PRAGMA user_version').fetchone()[0]
+            self.conn.executescript(_SCHEMA)
+            if 0 < version < 2 and os.sep != '/':
+                # 版本 1 按扫描结果原样保存路径，Windows 下以反斜杠分隔，统一转换为 '/' 后才能被 find 查到
+                self.conn.execute("UPDATE paths SET path = REPLACE(path, ?, '/')", (os.sep,))
+            self.conn.execute(f'PRAGMA user_version={SCHEMA_VERSION}')
+        if version == 0:
+            self.import_manifests(os.path.dirname(path))
+
+    def __path_ids(self, paths: Iterable[str]) -> List[int]:
+        # 路径表很小，首次使用时整体读入内存，之后只插入新出现的路径；统一以 '/' 分隔保存，与 find 的查询一致
+        if self.path_ids is None:
+            self.path_ids = {path: pid for pid, path in self.conn.execute('SELECT id, path FROM paths')}
+        ids = []
+        for path in paths:
+            path = path.replace(os.sep, '/')
+            pid = self.path_ids.get(path)
+            if pid is None:
+                pid = self.conn.execute('INSERT INTO paths (path) VALUES (?)', (path,)).lastrowid
+                self.path_ids[path] = pid
+            ids.append(pid)
+        return ids
+
+    def __backup_id(self, name: str) -> Optional[int]:
+        row = self.conn.execute('SELECT id FROM backups WHERE name = ?', (name,)).fetchone()
+        return row[0] if row is not None else None
+
+    def record_backup(self, name: str, backup_type: str, files: dict, changed: List[str], deleted: List[str],
+                      archive_bytes: Optional[int] = None, checksum: Optional[ArchiveChecksum] = None,
+                      base: Optional[str] = None, parent: Optional[str] = None, local: bool = True,
+                      created: Optional[float] = None):
+        # files 为备份时刻的完整文件状态（需有 size 与 mtime_ns），只记录本次实际写入的 changed 与删除的 deleted
+        changed = [path for path in changed if path in files]
+        self.remove_backup(name)
+        with self.lock:
+            try:
+                self.__insert_backup(name, backup_type, files, changed, deleted, archive_bytes, checksum,
+                                     base, parent, local, created)
+            except Exception:
+                # 事务已回滚，缓存中新插入的路径可能不存在
+                self.path_ids = None
+                raise
+
+    def __insert_backup(self, name: str, backup_type: str, files: dict, changed: List[str], deleted: List[str],
+                        archive_bytes: Optional[int], checksum: Optional[ArchiveChecksum], base: Optional[str],
+                        parent: Optional[str], local: bool, created: Optional[float]):
+        with self.conn:
+            backup_id = self.conn.execute(
+                'INSERT INTO backups (name, type, base, parent, created, files, source_bytes, archive_bytes, '
+                'checksum_algorithm, checksum) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (name, backup_type, base, parent, created if created is not None else time.time(), len(changed),
+                 sum(files[path].size for path in changed), archive_bytes,
+                 checksum.algorithm if checksum is not None else None,
+                 checksum.digest if checksum is not None else None)).lastrowid
+            rows = [(pid, backup_id, files[path].size, files[path].mtime_ns)
+                    for pid, path in zip(self.__path_ids(changed), changed)]
+            rows += [(pid, backup_id, None, None) for pid in self.__path_ids(deleted)]
+            self.conn.executemany('INSERT INTO members VALUES (?, ?, ?, ?)', rows)
+            if local:
+                self.conn.execute('INSERT OR REPLACE INTO locations VALUES (?, ?, ?, ?)',
+                                  (backup_id, LOCATION_LOCAL, archive_bytes, time.time()))
+
+    def record_manifest(self, manifest: BackupManifest, backup_path: Optional[str] = None,
+                        created: Optional[float] = None):
+        local = backup_path is not None and os.path.exists(backup_path)
+        self.record_backup(manifest.name, manifest.backup_type, manifest.files, manifest.changed, manifest.deleted,
+                           os.path.getsize(backup_path) if local else None,
+                           ArchiveChecksum.load(checksum_path(backup_path)) if backup_path is not None else None,
+                           manifest.base, manifest.parent, local, created)
+
+    def import_manifests(self, backup_dir: str):
+        for filename in sorted(os.listdir(backup_dir)):
+            if not filename.endswith(MANIFEST_SUFFIX):
+                continue
+            path = os.path.join(backup_dir, filename)
+            try:
+                manifest = BackupManifest.load(path)
+            except (OSError, ValueError, KeyError):
+                continue
+            self.record_manifest(manifest, path[:-len(MANIFEST_SUFFIX)], os.path.getmtime(path))
+
+    def remove_backup(self, name: str):
+        with self.lock, self.conn:
+            backup_id = self.__backup_id(name)
+            if backup_id is not None:
+                self.conn.execute('DELETE FROM members WHERE backup_id = ?', (backup_id,))
+                self.conn.execute('DELETE FROM locations WHERE backup_id = ?', (backup_id,))
+                self.conn.execute('DELETE FROM backups WHERE id = ?', (backup_id,))
+
+    def finish(self, name: str, status: str, duration: float):
+        with self.lock, self.conn:
+            self.conn.execute('UPDATE backups SET status = ?, duration = ? WHERE name = ?', (status, duration, name))
+
+    def add_location(self, name: str, location: str, size: Optional[int] = None):
+        with self.lock, self.conn:
+            backup_id = self.__backup_id(name)
+            if backup_id is not None:
+                self.conn.execute('INSERT OR REPLACE INTO locations VALUES (?, ?, ?, ?)',
+                                  (backup_id, location, size, time.time()))
+
+    def remove_location(self, name: str, location: str):
+        # 备份在所有位置都已删除时从目录中移除
+        with self.lock, self.conn:
+            backup_id = self.__backup_id(name)
+            if backup_id is None:
+                return
+            self.conn.execute('DELETE FROM locations WHERE backup_id = ? AND location = ?', (backup_id, location))
+            if self.conn.execute('SELECT 1 FROM locations WHERE backup_id = ?', (backup_id,)).fetchone() is None:
+                self.conn.execute('DELETE FROM members WHERE backup_id = ?', (backup_id,))
+                self.conn.execute('DELETE FROM backups WHERE id = ?', (backup_id,))
+
+    def __locations(self, backup_ids: Iterable[int]) -> Dict[int, List[str]]:
+        result = {}
+        for backup_id in set(backup_ids):
+            result[backup_id] = [row[0] for row in self.conn.execute(
+                'SELECT location FROM locations WHERE backup_id = ? ORDER BY location != ?, location',
+                (backup_id, LOCATION_LOCAL))]
+        return result
+
+    def list_backups(self, limit: int) -> Tuple[int, List[CatalogEntry]]:
+        # 返回 (备份总数, 最近的 limit 个备份)，按创建时间从旧到新排列
+        with self.lock:
+            total = self.conn.execute('SELECT COUNT(*) FROM backups').fetchone()[0]
+            rows = self.conn.execute(
+                'SELECT id, name, type, created, files, source_bytes, archive_bytes, checksum_algorithm, checksum, '
+                'status, duration FROM backups ORDER BY created DESC, name DESC LIMIT ?', (limit,)).fetchall()
+            locations = self.__locations(row[0] for row in rows)
+        return total, [CatalogEntry(*row[1:], locations[row[0]]) for row in reversed(rows)]
+
+    def find(self, path: str, limit: int) -> List[FileVersion]:
+        """
+        查询文件的历史版本，按备份时间从新到旧排列
+        path 含通配符(*?[)时按 GLOB 匹配，否则先按完整路径匹配，没有结果时视为目录，列出其下所有文件
+        """
+        path = path.replace('\\', '/').strip('/')
+        query = ('SELECT p.path, b.id, b.name, b.type, b.created, m.size, m.mtime_ns FROM paths p '
+                 'JOIN members m ON m.path_id = p.id JOIN backups b ON b.id = m.backup_id WHERE {} '
+                 'ORDER BY b.created DESC, b.name DESC, p.path LIMIT ?')
+        with self.lock:
+            if any(c in path for c in '*?['):
+                rows = self.conn.execute(query.format('p.path GLOB ?'), (path, limit)).fetchall()
+            else:
+                rows = self.conn.execute(query.format('p.path = ?'), (path, limit)).fetchall()
+                if not rows:
+                    rows = self.conn.execute(query.format('p.path > ? AND p.path < ?'),
+                                             (path + '/', path + _DIR_UPPER, limit)).fetchall()
+            locations = self.__locations(row[1] for row in rows)
+        return [FileVersion(row[0], *row[2:], locations[row[1]]) for row in rows]
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
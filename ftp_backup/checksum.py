@@ -0,0 +1,190 @@
+import io
+import json
+import zlib
+import random
+import hashlib
+from typing import Callable, List, Optional, Tuple
+
+# 压缩包校验值的本地文件后缀，与清单文件一同保存在备份目录中
+CHECKSUM_SUFFIX = '.checksum.json'
+# 分块 CRC-32 的块大小，远程服务器不支持校验命令时按块抽样读取比较
+SAMPLE_BLOCK_SIZE = 4 * 1024 * 1024
+ALGORITHM_CRC32 = 'crc32'
+
+
+def checksum_path(backup_path: str) -> str:
+    return backup_path + CHECKSUM_SUFFIX
+
+
+def new_hasher(algorithm: str):
+    # 支持 hashlib 中的算法（如 sha256、blake2b、md5），xxh64 / xxh3_64 / xxh3_128 需安装 xxhash
+    algorithm = algorithm.lower()
+    if algorithm.startswith('xxh'):
+        try:
+            import xxhash
+        except ImportError:
+            raise ValueError("使用 xxhash 校验需要安装 xxhash: pip install xxhash")
+        if not hasattr(xxhash, algorithm):
+            raise ValueError(f"不支持的校验算法: {algorithm}")
+        return getattr(xxhash, algorithm)()
+    try:
+        return hashlib.new(algorithm)
+    except ValueError:
+        raise ValueError(f"不支持的校验算法: {algorithm}")
+
+
+class ArchiveChecksum:
+    def __init__(self, size: int, algorithm: str, digest: str, crc32: int, blocks: List[int]):
+        self.size = size
+        self.algorithm = algorithm
+        self.digest = digest
+        self.crc32 = crc32
+        # 每 SAMPLE_BLOCK_SIZE 字节的 CRC-32，最后一块可能不足一块
+        self.blocks = blocks
+
+    @property
+    def algorithms(self) -> List[str]:
+        # 可与远程校验结果比较的算法，按优先级排列
+        return [self.algorithm, ALGORITHM_CRC32] if self.algorithm != ALGORITHM_CRC32 else [ALGORITHM_CRC32]
+
+    def matches(self, algorithm: str, value: str) -> Optional[bool]:
+        # 比较远程返回的校验值，算法不是本地计算过的算法时返回 None
+        try:
+            if algorithm == ALGORITHM_CRC32:
+                return int(value, 16) == self.crc32
+            if algorithm == self.algorithm:
+                return value.lower() == self.digest
+        except ValueError:
+            return False
+        return None
+
+    def to_dict(self) -> dict:
+        return {'size': self.size, 'algorithm': self.algorithm, 'digest': self.digest, 'crc32': self.crc32,
+                'block_size': SAMPLE_BLOCK_SIZE, 'blocks': self.blocks}
+
+    def save(self, path: str):
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.to_dict(), f, separators=(',', ':'))
+
+    @classmethod
+    def load(cls, path: str) -> Optional['ArchiveChecksum']:
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if data.get('block_size') != SAMPLE_BLOCK_SIZE:
+            data['blocks'] = []
+        return cls(data['size'], data['algorithm'], data['digest'], data['crc32'], data.get('blocks', []))
+
+
+class HashingWriter:
+    """
+    写入时同步计算整体校验值、CRC-32 与分块 CRC-32 的只写文件对象，压缩包只需写出一次
+    不提供 seek/tell，zipfile 会按顺序写出（使用数据描述符），写出的字节即为最终的文件内容
+    """
+
+    def __init__(self, target, algorithm: str):
+        self.target = target
+        self.algorithm = algorithm.lower()
+        self.hasher = new_hasher(self.algorithm)
+        self.size = 0
+        self.crc32 = 0
+        self.blocks: List[int] = []
+        self.block_crc = 0
+        self.block_fill = 0
+
+    def write(self, data) -> int:
+        self.target.write(data)
+        self.hasher.update(data)
+        self.crc32 = zlib.crc32(data, self.crc32)
+        view = memoryview(data).cast('B')
+        while len(view):
+            n = min(len(view), SAMPLE_BLOCK_SIZE - self.block_fill)
+            self.block_crc = zlib.crc32(view[:n], self.block_crc)
+            self.block_fill += n
+            view = view[n:]
+            if self.block_fill == SAMPLE_BLOCK_SIZE:
+                self.blocks.append(self.block_crc)
+                self.block_crc, self.block_fill = 0, 0
+        self.size += len(data)
+        return len(data)
+
+    def flush(self):
+        self.target.flush()
+
+    def result(self) -> ArchiveChecksum:
+        blocks = self.blocks + ([self.block_crc] if self.block_fill else [])
+        return ArchiveChecksum(self.size, self.algorithm, self.hasher.hexdigest(), self.crc32, blocks)
+
+
+def sample_blocks(checksum: ArchiveChecksum, count: int) -> Optional[List[int]]:
+    # 总是包含首尾两块（文件头与 ZIP 中央目录），其余随机抽取；没有分块 CRC 时返回 None，无法抽样校验
+    total = len(checksum.blocks)
+    if total == 0:
+        return None
+    if total <= count:
+        return list(range(total))
+    chosen = {0, total - 1}
+    chosen.update(random.sample(range(1, total - 1), max(count - 2, 0)))
+    return sorted(chosen)
+
+
+def verify_remote(manager, filename: str, checksum: ArchiveChecksum, config,
+                  samples: int) -> Tuple[Optional[bool], str]:
+    """
+    校验远程文件，返回 (结果, 校验方式)，无法完成校验时结果为 None
+    优先使用服务器端的校验命令，不支持时比较大小并抽样读取部分数据块，不会重新读取整个文件
+    """
+    size = manager.file_size(filename, config)
+    if size is not None and size != checksum.size:
+        return False, f"大小不一致 ({size} / {checksum.size})"
+    remote = manager.remote_checksum(filename, checksum.algorithms, config)
+    if remote is not None:
+        algorithm, value = remote
+        matched = checksum.matches(algorithm, value)
+        if matched is not None:
+            return matched, algorithm.upper()
+    if size is None:
+        return None, "无法获取远程文件大小"
+    return _verify_samples(checksum, samples,
+                           lambda offset, length, out: manager.download_range(filename, offset, length, out, config))
+
+
+def verify_remote_parts(manager, parts: List[Tuple[str, int, int]], checksum: ArchiveChecksum, config,
+                        samples: int) -> Tuple[Optional[bool], str]:
+    """
+    校验分段上传的远程文件，parts 为 (分段名, 在压缩包中的偏移, 大小)，返回值与 verify_remote 相同
+    比较各分段的大小，再按偏移从对应分段中抽样读取数据块，抽样的数据块可以跨越两个分段
+    """
+    for name, _, size in parts:
+        remote_size = manager.file_size(name, config)
+        if remote_size is None:
+            return None, f"无法获取远程分段大小: {name}"
+        if remote_size != size:
+            return False, f"分段大小不一致: {name} ({remote_size} / {size})"
+
+    def read(offset: int, length: int, out) -> bool:
+        for name, part_offset, size in parts:
+            start, end = max(offset, part_offset), min(offset + length, part_offset + size)
+            if start < end and not manager.download_range(name, start - part_offset, end - start, out, config):
+                return False
+        return True
+
+    result, method = _verify_samples(checksum, samples, read)
+    return result, (f"{len(parts)} 个分段的{method}" if result else method)
+
+
+def _verify_samples(checksum: ArchiveChecksum, samples: int,
+                    read: Callable[[int, int, io.BytesIO], bool]) -> Tuple[Optional[bool], str]:
+    blocks = sample_blocks(checksum, samples)
+    if blocks is None:
+        return None, "没有可抽样比较的数据块"
+    for i in blocks:
+        offset = i * SAMPLE_BLOCK_SIZE
+        buffer = io.BytesIO()
+        if not read(offset, min(SAMPLE_BLOCK_SIZE, checksum.size - offset), buffer):
+            return None, "抽样读取失败"
+        if zlib.crc32(buffer.getvalue()) != checksum.blocks[i]:
+            return False, f"第 {i + 1} 块数据不一致"
+    return True, f"大小与 {len(blocks)} 个抽样数据块"
@@ -0,0 +1,289 @@
+import os
+import json
+import time
+import zlib
+import random
+import hashlib
+import tempfile
+from typing import Dict, Iterator, List, Optional, Set, Tuple
+from .throttle import TokenBucket, throttled
+
+CHUNKS_DIR = 'chunks'
+SNAPSHOTS_DIR = 'snapshots'
+SNAPSHOT_SUFFIX = '.json'
+REMOTE_INDEX_NAME = 'remote_index.json'
+READ_BLOCK_SIZE = 4 * 1024 * 1024
+
+
+def _build_anchor_table() -> bytes:
+    # 每个字节随机映射为 0/1，连续 k 个 1 处作为切分点，切分点只取决于局部内容
+    # 0x00 与 0xFF 固定映射为 0，避免填充数据中产生大量切分点
+    values = [1] * 128 + [0] * 126
+    random.Random(0x6674626b).shuffle(values)
+    return bytes([0] + values + [0])
+
+
+ANCHOR_TABLE = _build_anchor_table()
+
+
+class Chunker:
+    def __init__(self, avg_size: int):
+        avg_size = max(avg_size, 64 * 1024)
+        self.min_size = avg_size // 4
+        self.max_size = avg_size * 4
+        # 连续 k 个 1 的期望间隔约为 2^(k+1)
+        self.anchor = b'\x01' * max(avg_size.bit_length() - 2, 8)
+
+    def __find_cut(self, mapped: bytes, start: int, end: int) -> int:
+        if end - start <= self.min_size:
+            return end
+        limit = min(end, start + self.max_size)
+        idx = mapped.find(self.anchor, start + self.min_size - len(self.anchor), limit)
+        return limit if idx < 0 else idx + len(self.anchor)
+
+    def iter_chunks(self, f) -> Iterator[bytes]:
+        buffer = b''
+        eof = False
+        while True:
+            while not eof and len(buffer) < self.max_size * 2:
+                data = f.read(READ_BLOCK_SIZE)
+                if not data:
+                    eof = True
+                    break
+                buffer += data
+            if not buffer:
+                return
+            mapped = buffer.translate(ANCHOR_TABLE)
+            start = 0
+            # 未读到文件末尾时，保留不足最大块长度的尾部等待后续数据
+            while len(buffer) - start >= (1 if eof else self.max_size):
+                cut = self.__find_cut(mapped, start, len(buffer))
+                yield buffer[start:cut]
+                start = cut
+            buffer = buffer[start:]
+
+
+class SnapshotFile:
+    def __init__(self, size: int, mtime_ns: int, chunks: List[str]):
+        self.size = size
+        self.mtime_ns = mtime_ns
+        self.chunks = chunks
+
+
+class Snapshot:
+    def __init__(self, name: str, created: Optional[float] = None):
+        self.name = name
+        self.created = created if created is not None else time.time()
+        self.files: Dict[str, SnapshotFile] = {}
+
+    def chunk_set(self) -> Set[str]:
+        return {h for entry in self.files.values() for h in entry.chunks}
+
+    def to_dict(self) -> dict:
+        return {
+            'name': self.name,
+            'created': self.created,
+            'files': {path: [e.size, e.mtime_ns, e.chunks] for path, e in self.files.items()},
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> 'Snapshot':
+        snapshot = cls(data['name'], data.get('created'))
+        snapshot.files = {path: SnapshotFile(*entry) for path, entry in data.get('files', {}).items()}
+        return snapshot
+
+
+class ChunkStore:
+    """
+    按内容切块、以 sha256 寻址的去重存储，每个数据块只保存一次
+    每次备份只生成一个快照索引，保留策略即删除多余快照后回收未被引用的数据块
+    """
+
+    def __init__(self, root: str, avg_chunk_size: int = 1024 * 1024, level: int = 6):
+        self.root = root
+        self.chunks_dir = os.path.join(root, CHUNKS_DIR)
+        self.snapshots_dir = os.path.join(root, SNAPSHOTS_DIR)
+        self.chunker = Chunker(avg_chunk_size)
+        self.level = level
+        os.makedirs(self.chunks_dir, exist_ok=True)
+        os.makedirs(self.snapshots_dir, exist_ok=True)
+
+    @staticmethod
+    def chunk_rel_path(digest: str) -> str:
+        return f"{CHUNKS_DIR}/{digest[:2]}/{digest}"
+
+    def chunk_path(self, digest: str) -> str:
+        return os.path.join(self.chunks_dir, digest[:2], digest)
+
+    def snapshot_path(self, name: str) -> str:
+        return os.path.join(self.snapshots_dir, name + SNAPSHOT_SUFFIX)
+
+    def has_chunk(self, digest: str) -> bool:
+        return os.path.exists(self.chunk_path(digest))
+
+    def put_chunk(self, data: bytes) -> Tuple[str, int]:
+        # 返回数据块哈希及本次新写入的字节数（已存在则为 0）
+        digest = hashlib.sha256(data).hexdigest()
+        path = self.chunk_path(digest)
+        if os.path.exists(path):
+            return digest, 0
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        compressed = zlib.compress(data, self.level)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(compressed)
+            os.replace(tmp_path, path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        return digest, len(compressed)
+
+    def read_chunk(self, digest: str) -> bytes:
+        with open(self.chunk_path(digest), 'rb') as f:
+            return zlib.decompress(f.read())
+
+    def store_file(self, full_path: str, limiter: Optional[TokenBucket] = None) -> Tuple[List[str], int]:
+        chunks = []
+        written = 0
+        with open(full_path, 'rb') as f:
+            for data in self.chunker.iter_chunks(throttled(f, limiter)):
+                digest, size = self.put_chunk(data)
+                chunks.append(digest)
+                written += size
+        return chunks, written
+
+    def save_snapshot(self, snapshot: Snapshot) -> str:
+        path = self.snapshot_path(snapshot.name)
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(snapshot.to_dict(), f, ensure_ascii=False, separators=(',', ':'))
+        os.replace(tmp_path, path)
+        return path
+
+    def load_snapshot(self, name: str) -> Snapshot:
+        with open(self.snapshot_path(name), 'r', encoding='utf-8') as f:
+            return Snapshot.from_dict(json.load(f))
+
+    def list_snapshots(self) -> List[str]:
+        # 快照名以时间戳开头，按名称排序即按时间排序
+        return sorted(f[:-len(SNAPSHOT_SUFFIX)] for f in os.listdir(self.snapshots_dir)
+                      if f.endswith(SNAPSHOT_SUFFIX))
+
+    def latest_snapshot(self) -> Optional[Snapshot]:
+        names = self.list_snapshots()
+        return self.load_snapshot(names[-1]) if names else None
+
+    def referenced_chunks(self) -> Set[str]:
+        referenced = set()
+        for name in self.list_snapshots():
+            referenced |= self.load_snapshot(name).chunk_set()
+        return referenced
+
+    def iter_chunks(self) -> Iterator[str]:
+        for prefix in os.listdir(self.chunks_dir):
+            prefix_dir = os.path.join(self.chunks_dir, prefix)
+            if not os.path.isdir(prefix_dir):
+                continue
+            for name in os.listdir(prefix_dir):
+                if not name.endswith('.tmp'):
+                    yield name
+
+    def prune(self, keep: Set[str]) -> Tuple[List[str], List[str]]:
+        # 删除未被保留的快照并回收不再被引用的数据块，返回 (删除的快照, 删除的数据块)
+        removed_snapshots = [name for name in self.list_snapshots() if name not in keep]
+        for name in removed_snapshots:
+            os.remove(self.snapshot_path(name))
+        referenced = self.referenced_chunks()
+        removed_chunks = [h for h in self.iter_chunks() if h not in referenced]
+        for digest in removed_chunks:
+            os.remove(self.chunk_path(digest))
+        return removed_snapshots, removed_chunks
+
+    def restore_snapshot(self, name: str, target_dir: str):
+        snapshot = self.load_snapshot(name)
+        for rel_path, entry in snapshot.files.items():
+            full_path = os.path.join(target_dir, rel_path)
+            os.makedirs(os.path.dirname(full_path), exist_ok=True)
+            with open(full_path, 'wb') as f:
+                for digest in entry.chunks:
+                    f.write(self.read_chunk(digest))
+            os.utime(full_path, ns=(entry.mtime_ns, entry.mtime_ns))
+
+    def __load_remote_index(self, target: str, ttl: int) -> Tuple[Optional[Set[str]], float]:
+        # 返回 (远程已有的数据块, 列出远程的时间)；超过有效期后重新列出远程，远程被删除的数据块可以重新上传
+        path = os.path.join(self.root, REMOTE_INDEX_NAME)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return None, 0.0
+        listed = data.get('listed', 0)
+        if data.get('target') != target or time.time() - listed > ttl:
+            return None, 0.0
+        return set(data.get('chunks', [])), listed
+
+    def __save_remote_index(self, target: str, chunks: Set[str], listed: float):
+        path = os.path.join(self.root, REMOTE_INDEX_NAME)
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'target': target, 'listed': listed, 'chunks': sorted(chunks)}, f, separators=(',', ':'))
+        os.replace(tmp_path, path)
+
+    def __invalidate_remote_index(self):
+        try:
+            os.remove(os.path.join(self.root, REMOTE_INDEX_NAME))
+        except OSError:
+            pass
+
+    def __list_remote_chunks(self, transfer_manager, config) -> Set[str]:
+        remote = set()
+        for prefix in transfer_manager.list_names(CHUNKS_DIR, config):
+            remote.update(n for n in transfer_manager.list_names(f"{CHUNKS_DIR}/{prefix}", config)
+                          if not n.endswith('.tmp'))
+        return remote
+
+    def sync_remote(self, transfer_manager, config, logger) -> bool:
+        """
+        将本地快照与数据块同步到远程，只上传远程尚不存在的数据块，并删除远程多余的快照与数据块
+        远程已有数据块记录在本地索引中，索引缺失、目标变化或超过 remote_index_ttl 时通过远程列表重建；
+        同步失败时删除索引，下次同步重新列出远程
+        """
+        target = f"{config.host}:{config.port}{config.remote_path}"
+        remote_chunks, listed = self.__load_remote_index(target, config.remote_index_ttl)
+        if remote_chunks is None:
+            logger.info("§6正在重建远程数据块索引...")
+            listed = time.time()
+            remote_chunks = self.__list_remote_chunks(transfer_manager, config)
+        succeeded = False
+        snapshots = self.list_snapshots()
+        referenced = self.referenced_chunks()
+        missing = sorted(referenced - remote_chunks)
+        logger.info(f"§b远程缺少 {len(missing)} 个数据块，共引用 {len(referenced)} 个")
+        try:
+            for digest in missing:
+                if not transfer_manager.upload_to(self.chunk_path(digest), self.chunk_rel_path(digest), config):
+                    return False
+                remote_chunks.add(digest)
+            # 快照索引最后上传，保证远程快照引用的数据块都已存在
+            remote_snapshots = {n[:-len(SNAPSHOT_SUFFIX)] for n in transfer_manager.list_names(SNAPSHOTS_DIR, config)
+                                if n.endswith(SNAPSHOT_SUFFIX)}
+            for name in snapshots:
+                if name in remote_snapshots:
+                    continue
+                rel_path = f"{SNAPSHOTS_DIR}/{name}{SNAPSHOT_SUFFIX}"
+                if not transfer_manager.upload_to(self.snapshot_path(name), rel_path, config):
+                    return False
+            for name in sorted(remote_snapshots - set(snapshots)):
+                transfer_manager.delete_file(f"{SNAPSHOTS_DIR}/{name}{SNAPSHOT_SUFFIX}", config)
+            for digest in sorted(remote_chunks - referenced):
+                if transfer_manager.delete_file(self.chunk_rel_path(digest), config):
+                    remote_chunks.discard(digest)
+            succeeded = True
+            return True
+        finally:
+            if succeeded:
+                self.__save_remote_index(target, remote_chunks, listed)
+            else:
+                self.__invalidate_remote_index()
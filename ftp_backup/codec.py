@@ -0,0 +1,127 @@
+import io
+import re
+import time
+import zlib
+import tarfile
+import zipfile
+from typing import Dict, Optional, Tuple
+from .scanner import translate_glob
+from .throttle import TokenBucket, throttled
+
+ARCHIVE_ZIP = 'zip'
+ARCHIVE_TAR_ZST = 'tar.zst'
+ARCHIVE_SUFFIXES = ('.zip', '.tar.zst')
+
+# 抽样检测可压缩性：取文件开头一段数据快速压缩，压缩率低于阈值则直接存储
+SAMPLE_SIZE = 64 * 1024
+SAMPLE_MIN_FILE_SIZE = 16 * 1024
+INCOMPRESSIBLE_RATIO = 0.95
+
+
+def archive_suffix(archive_format: str) -> str:
+    return '.tar.zst' if archive_format.lower() == ARCHIVE_TAR_ZST else '.zip'
+
+
+def parse_codec(codec: str, default_level: int) -> Tuple[int, int]:
+    # 支持 store、deflate、deflate:<等级>
+    name, _, level = codec.strip().lower().partition(':')
+    if name == 'store':
+        return zipfile.ZIP_STORED, 0
+    if name == 'deflate':
+        return zipfile.ZIP_DEFLATED, int(level) if level else default_level
+    raise ValueError(f"未知的压缩方式: {codec}")
+
+
+class CodecPolicy:
+    """
+    按文件类型选择 ZIP 成员的压缩方式，规则键为 .gitignore 风格的通配符，先出现的规则优先
+    未命中规则的文件按默认等级压缩，启用检测时对不可压缩的内容改为直接存储
+    """
+
+    def __init__(self, rules: Dict[str, str], level: int = 6, detect_incompressible: bool = True):
+        self.level = level
+        self.detect_incompressible = detect_incompressible
+        self.rules = []
+        for pattern, codec in rules.items():
+            pattern = pattern.strip().rstrip('/')
+            if '/' in pattern:
+                regex = translate_glob(pattern.lstrip('/'))
+            else:
+                regex = '(?:.*/)?' + translate_glob(pattern)
+            self.rules.append((re.compile(regex, re.DOTALL), parse_codec(codec, level)))
+
+    @staticmethod
+    def is_incompressible(full_path: str) -> bool:
+        with open(full_path, 'rb') as f:
+            sample = f.read(SAMPLE_SIZE)
+        if not sample:
+            return False
+        return len(zlib.compress(sample, 1)) >= len(sample) * INCOMPRESSIBLE_RATIO
+
+    def resolve(self, full_path: str, rel_path: str, size: Optional[int] = None) -> Tuple[int, int]:
+        # 返回 (压缩方式, 压缩等级)
+        match_path = rel_path.replace('\\', '/')
+        for regex, codec in self.rules:
+            if regex.fullmatch(match_path):
+                return codec
+        if self.detect_incompressible and (size is None or size >= SAMPLE_MIN_FILE_SIZE):
+            if self.is_incompressible(full_path):
+                return zipfile.ZIP_STORED, 0
+        return zipfile.ZIP_DEFLATED, self.level
+
+
+def import_zstandard():
+    try:
+        import zstandard
+    except ImportError:
+        raise RuntimeError("使用 tar.zst 格式需要安装 zstandard: pip install zstandard")
+    return zstandard
+
+
+class TarZstWriter:
+    """
+    以流的方式写出 tar 包并交给 zstd 压缩，threads 大于 1 时 zstd 使用多线程压缩
+    目标可以是文件路径或只写的文件对象（如流式上传的管道）
+    """
+
+    def __init__(self, target, level: int = 3, threads: int = 0):
+        zstandard = import_zstandard()
+        self.own_file = isinstance(target, str)
+        self.raw = open(target, 'wb') if self.own_file else target
+        try:
+            cctx = zstandard.ZstdCompressor(level=level, threads=threads if threads > 1 else 0)
+            self.writer = cctx.stream_writer(self.raw, closefd=False)
+            self.tar = tarfile.open(fileobj=self.writer, mode='w|', format=tarfile.PAX_FORMAT)
+        except Exception:
+            if self.own_file:
+                self.raw.close()
+            raise
+
+    def add(self, full_path: str, arcname: str, limiter: Optional[TokenBucket] = None):
+        arcname = arcname.replace('\\', '/')
+        if limiter is None:
+            self.tar.add(full_path, arcname=arcname, recursive=False)
+            return
+        info = self.tar.gettarinfo(full_path, arcname)
+        with open(full_path, 'rb') as f:
+            self.tar.addfile(info, throttled(f, limiter))
+
+    def writestr(self, arcname: str, data: bytes):
+        info = tarfile.TarInfo(arcname)
+        info.size = len(data)
+        info.mtime = int(time.time())
+        self.tar.addfile(info, io.BytesIO(data))
+
+    def close(self):
+        try:
+            self.tar.close()
+            self.writer.close()
+        finally:
+            if self.own_file:
+                self.raw.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
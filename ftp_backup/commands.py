@@ -1,42 +1,126 @@
 import os
-import re
+import time
+import posixpath
 import threading
-from apscheduler.schedulers.background import BackgroundScheduler
-from apscheduler.triggers.cron import CronTrigger
+from contextlib import nullcontext
+from typing import Dict, Iterable, List, Optional, Tuple
 from mcdreforged.api.all import *
-from .config import Config
+from .config import Config, changed_fields
 from .ftp_manager import FTPManager
 from .backup_util import BackupManager
-from .server_controller import ServerController
+from .server_controller import SaveWatcher, ServerController
 from .sftp_manager import SFTPManager
 from .backup_util import BackupAbortedException
+from .stream_pipe import StreamUpload
+from .segmented_upload import SegmentedUploader
+from .connection_pool import ConnectionPool
+from .throttle import ResourceGovernor, ThrottleProfile, THROTTLE_KEYS
+from .retention import RemoteIndex, REMOTE_INDEX_NAME, prune_remote
+from .restore import Restorer, RestorePlan, RestoreAbortedException
+from .checksum import ArchiveChecksum, checksum_path, verify_remote, verify_remote_parts
+from .catalog import FileVersion, LOCATION_LOCAL
+from .fanout import ArchiveFanout, Destination, destination_config, destination_name
+from .job_queue import BackupJob, JobQueue, QUEUE_NAME, STAGE_COMPRESS, STAGE_UPLOAD, STAGE_NAMES
+from .orchestrator import (BackupInstance, BackupOrchestrator, update_instances, INSTANCE_IDLE, INSTANCE_UPLOAD,
+                           INSTANCE_DONE, INSTANCE_FAILED, INSTANCE_STATE_NAMES)
+from .metrics import (BackupMetrics, MetricsRecorder, format_eta, PHASE_NAMES, HISTORY_NAME,
+                      STATUS_SUCCESS, STATUS_ABORTED, STATUS_UPLOAD_FAILED)
+
+
+RESTORE_CONFIRM_TIMEOUT = 60
+RESTORE_LIST_SIZE = 10
+CATALOG_LIST_SIZE = 10
+CATALOG_FIND_LIMIT = 20
+BACKUP_TYPE_NAMES = {'full': '全量', 'incremental': '增量', 'differential': '差异', 'chunk': '去重快照'}
+# 工作线程等待新任务时检查插件是否卸载的间隔
+WORKER_POLL_INTERVAL = 1
+# 卸载插件时等待工作线程退出的最长时间(秒)
+WORKER_STOP_TIMEOUT = 30
+# 多实例查询进度时显示的各实例阶段耗时
+INSTANCE_TIMING_PHASES = ('scan', 'compress', 'upload')
+# 重载时这些设置变化才断开现有会话并重建连接池，其他设置变化时沿用已登录的会话
+CONNECTION_KEYS = {'protocol', 'host', 'port', 'timeout', 'username', 'password', 'private_key_path',
+                   'keepalive_interval', 'sftp_window_mb', 'sftp_max_packet_kb', 'sftp_block_kb', 'sftp_ciphers',
+                   'sftp_compression', 'destinations'}
+# 这些设置变化时重新应用限速，其他设置由 ResourceGovernor 运行时读取
+GOVERNOR_KEYS = set(THROTTLE_KEYS) | {'overload_regex', 'mspt_regex'}
 
 
 class CommandHandler:
     def __init__(self, server: PluginServerInterface, config: Config,
-                 ftp_manager: FTPManager, backup_manager: BackupManager,
+                 ftp_manager: FTPManager, instances: List[BackupInstance],
                  server_controller: ServerController):
         self.server = server
         self.config = config
         self.ftp_manager = ftp_manager
-        self.backup_manager = backup_manager
+        self.instances = instances
         self.server_controller = server_controller
+        self.governor = ResourceGovernor(server, config)
+        self.connection_pool = self.__create_connection_pool()
+        self.orchestrator = BackupOrchestrator(server, config)
+        self.upload_metrics: Optional[BackupMetrics] = None
+        self.upload_instance: Optional[BackupInstance] = None
+        # 队列文件位于全局备份目录，多实例时由所有实例共用
+        self.job_queue = JobQueue(os.path.join(os.path.abspath(config.local_path), QUEUE_NAME))
+        # 去重存储清理时会回收未被引用的数据块，不能与正在写入的快照同时进行
+        self.store_lock = threading.Lock()
+        self.workers: List[threading.Thread] = []
+        self.destination_pools: List[ConnectionPool] = []
+        self.__setup_instances()
+        self.restorer = self.__create_restorer()
+        self.pending_restore: Optional[Tuple[RestorePlan, float]] = None
+        self.restoring = False
         self.scheduler = None
-        self.save_completed = False
-        self.save_wait_event = threading.Event()
+        self.save_watcher = SaveWatcher(config.saved_game_regex)
         self.save_timeout = 30
 
+    @property
+    def multi_instance(self) -> bool:
+        # server_dir 为列表时各实例都有名称
+        return bool(self.instances[0].name)
+
+    @property
+    def backup_manager(self) -> BackupManager:
+        # 恢复、list、find 与手动上传针对第一个实例
+        return self.instances[0].backup_manager
+
+    @property
+    def destinations(self) -> List[Destination]:
+        return self.instances[0].destinations
+
+    @property
+    def remote_index(self) -> RemoteIndex:
+        return self.instances[0].remote_index
+
     def register_commands(self):
         self.server.register_command(
             Literal(self.config.prefix)
                 .runs(self.show_help)
                 .then(Literal('test').runs(self.test_connection))
                 .then(Literal('make').runs(self.make_backup))
-                .then(Literal('inquire').runs(self.backup_manager.inquire_backup))
+                .then(Literal('inquire').runs(self.inquire_backup))
                 .then(Literal('reload').runs(self.reload_config))
                 .then(Literal('abort').runs(self.abort_backup))
+                .then(Literal('queue').runs(self.show_queue))
+                .then(
+                    Literal('list')
+                        .runs(self.list_backups)
+                        .then(Integer('count').at_min(1).runs(self.list_backups))
+                )
+                .then(Literal('find').then(GreedyText('path').runs(self.find_file)))
+                .then(
+                    Literal('restore')
+                        .runs(self.list_restore_points)
+                        .then(Literal('confirm').runs(self.confirm_restore))
+                        .then(
+                            Text('backup')
+                                .runs(self.prepare_restore)
+                                .then(GreedyText('paths').runs(self.prepare_restore))
+                        )
+                )
             )
         self.server.register_event_listener('mcdr.general_info', self.on_info)
+        self.server_controller.register_events()
 
     def show_help(self, source: CommandSource):
         help_msg = RTextList(
@@ -45,62 +129,322 @@ class CommandHandler:
             RText(f"{self.config.prefix} test").set_color(RColor.blue) + " - 测试FTP连接\n",
             RText(f"{self.config.prefix} make").set_color(RColor.blue) + " - 创建并上传备份\n",
             RText(f"{self.config.prefix} inquire").set_color(RColor.blue) + " - 查询备份进度\n",
+            RText(f"{self.config.prefix} queue").set_color(RColor.blue) + " - 查看备份队列\n",
+            RText(f"{self.config.prefix} list [数量]").set_color(RColor.blue) + " - 列出最近的备份及其位置\n",
+            RText(f"{self.config.prefix} find <路径>").set_color(RColor.blue) + " - 查询文件在各备份中的版本\n",
             RText(f"{self.config.prefix} reload").set_color(RColor.blue) + " - 热重载配置\n",
-            RText(f"{self.config.prefix} abort").set_color(RColor.blue) + " - 终止进行中的备份\n"
+            RText(f"{self.config.prefix} abort").set_color(RColor.blue) + " - 终止进行中的备份或恢复\n",
+            RText(f"{self.config.prefix} restore").set_color(RColor.blue) + " - 列出可恢复的备份\n",
+            RText(f"{self.config.prefix} restore <备份> [路径...]").set_color(RColor.blue) +
+            " - 恢复整个备份或指定的文件/目录\n",
+            RText(f"{self.config.prefix} restore confirm").set_color(RColor.blue) + " - 确认执行恢复\n"
         )
         source.reply(help_msg)
 
     def test_connection(self, source: CommandSource):
-        if self.ftp_manager.connect(self.config):
-            source.reply(RText("✓ 连接成功", color=RColor.green))
-        else:
-            source.reply(RText("✗ 连接失败", color=RColor.red))
-        self.ftp_manager.disconnect()
+        for dest in self.destinations:
+            # 只有一个目标时保持原有的提示
+            label = f" {dest.name}" if len(self.destinations) > 1 else ''
+            with dest.connection_pool.session() as manager:
+                if manager is not None:
+                    source.reply(RText(f"✓ 连接成功{label}", color=RColor.green))
+                else:
+                    source.reply(RText(f"✗ 连接失败{label}", color=RColor.red))
 
     def make_backup(self, source: CommandSource):
         if not source.has_permission(self.config.required_permission):
             source.reply(RText("权限不足!", color=RColor.red))
             return
 
-        if self.backup_manager.backup:
-            source.reply(RText("§c已有备份任务在进行中", color=RColor.red))
+        self.__start_backup(source)
+
+    def __start_backup(self, source: CommandSource, schedule: Optional[dict] = None, trigger: str = 'manual'):
+        if self.restoring:
+            source.reply(RText("§c正在恢复备份，请稍后再试", color=RColor.red))
             return
 
-        source.reply(RText("§6正在准备备份，请稍候..."))
-        self.__execute_make_backup(source)
+        # 加入队列，由压缩阶段的工作线程依次执行；已有相同的任务在排队时合并
+        job = BackupJob(trigger, schedule)
+        job.source = source
+        job, coalesced = self.job_queue.submit(job)
+        if coalesced:
+            source.reply(RText(f"§6相同的备份任务 #{job.id} 已在排队，本次触发已合并"))
+            return
+        ahead = self.job_queue.position(job)
+        if ahead:
+            source.reply(RText(f"§6备份任务 #{job.id} 已加入队列，前面还有 {ahead} 个任务"))
+        else:
+            source.reply(RText(f"§6备份任务 #{job.id} 已加入队列，即将开始"))
+
+    def start_workers(self):
+        for stage, target in ((STAGE_COMPRESS, self.__compress_worker), (STAGE_UPLOAD, self.__upload_worker)):
+            worker = threading.Thread(target=target, name=f'ftp_backup_{stage}', daemon=True)
+            worker.start()
+            self.workers.append(worker)
+
+    def stop_workers(self):
+        # 未完成的任务保留在队列文件中，下次加载插件时继续；中断进行中的压缩与上传并等待工作线程退出，
+        # 避免重载后新旧工作线程同时执行同一个任务
+        self.job_queue.close()
+        self.orchestrator.abort(self.instances)
+        self.governor.cancel()
+        for worker in self.workers:
+            worker.join(WORKER_STOP_TIMEOUT)
+            if worker.is_alive():
+                self.server.logger.warning(f"§6工作线程 {worker.name} 未能在 {WORKER_STOP_TIMEOUT} 秒内退出")
+        self.workers.clear()
+        self.job_queue.release()
+
+    def __compress_worker(self):
+        while not self.job_queue.closed:
+            # 恢复备份期间排队的备份暂不执行
+            if self.restoring:
+                time.sleep(WORKER_POLL_INTERVAL)
+                continue
+            job = self.job_queue.take(STAGE_COMPRESS, WORKER_POLL_INTERVAL)
+            if job is None:
+                continue
+            source = job.source or self.server.get_plugin_command_source()
+            archives = {}
+            try:
+                source.reply(RText(f"§6正在准备备份 #{job.id}，请稍候..."))
+                # 定时计划可覆盖限速设置，手动备份使用全局配置
+                self.governor.apply_profile(ThrottleProfile.from_config(self.config, job.schedule))
+                self.orchestrator.aborted = False
+                job.metrics = {instance.name: BackupMetrics(job.trigger) for instance in self.instances}
+                for instance in self.instances:
+                    instance.metrics = job.metrics[instance.name]
+                chunk_store = any(instance.backup_manager.use_chunk_store() for instance in self.instances)
+                with self.store_lock if chunk_store else nullcontext():
+                    archives = self.__execute_make_backup(source, job)
+            except Exception as e:
+                self.server.logger.error(f"备份任务 #{job.id} 出错: {str(e)}")
+            if archives:
+                # 转入上传队列，压缩阶段随即可以处理下一个任务
+                self.job_queue.advance(job, archives)
+            elif not self.job_queue.closed:
+                # 被插件卸载中断的任务保留在队列中，下次加载时重新开始
+                self.job_queue.finish(job)
+
+    def __upload_worker(self):
+        while not self.job_queue.closed:
+            job = self.job_queue.take(STAGE_UPLOAD, WORKER_POLL_INTERVAL)
+            if job is None:
+                continue
+            source = job.source or self.server.get_plugin_command_source()
+            instances = {instance.name: instance for instance in self.instances}
+            interrupted = False
+            # 多实例时按实例顺序依次上传，共用全局上传令牌桶
+            for name, archive in job.archives.items():
+                if self.job_queue.closed:
+                    interrupted = True
+                    break
+                instance = instances.get(name)
+                if instance is None:
+                    self.server.logger.warning(f"§6实例 {name} 已不在配置中，跳过上传 {archive}")
+                    continue
+                metrics = job.metrics.get(name)
+                if metrics is None:
+                    # 插件重载前已压缩完成、尚未上传的备份
+                    metrics = BackupMetrics(job.trigger)
+                    metrics.name = os.path.basename(archive)
+                    metrics.archive_bytes = os.path.getsize(archive)
+                    instance.metrics = metrics
+                instance.state = INSTANCE_UPLOAD
+                self.upload_metrics, self.upload_instance = metrics, instance
+                try:
+                    self.__upload_background(source, instance, archive, metrics)
+                except Exception as e:
+                    self.server.logger.error(f"上传任务 #{job.id} 出错: {str(e)}")
+                finally:
+                    self.upload_metrics, self.upload_instance = None, None
+                instance.state = INSTANCE_DONE if metrics.status == STATUS_SUCCESS else INSTANCE_FAILED
+                interrupted = interrupted or (self.job_queue.closed and metrics.status != STATUS_SUCCESS)
+            if not interrupted:
+                # 被插件卸载中断的上传保留在队列中，下次加载时重新上传
+                self.job_queue.finish(job)
+
+    def show_queue(self, source: CommandSource):
+        now = time.time()
+        source.reply(RText("§6=== 备份队列 ==="))
+        for stage in (STAGE_COMPRESS, STAGE_UPLOAD):
+            stage_name = STAGE_NAMES[stage]
+            running = self.job_queue.running(stage)
+            waiting = self.job_queue.waiting(stage)
+            summary = f"§b{stage_name}阶段：{'执行中' if running is not None else '空闲'}，等待 {len(waiting)} 个"
+            average = self.job_queue.average_wait(stage)
+            if average is not None:
+                summary += f"，最近平均等待 {format_eta(average)}"
+            source.reply(RText(summary))
+            if running is not None:
+                archive = ''.join(f" {os.path.basename(path)}" for path in running.archives.values())
+                source.reply(RText(f"§e  #{running.id} {running.describe()}{archive} "
+                                   f"{stage_name}中，已执行 {format_eta(now - running.started)}"))
+            for job in waiting:
+                line = f"§7  #{job.id} {job.describe()} 已等待 {format_eta(now - job.enqueued)}"
+                if job.coalesced:
+                    line += f"，合并了 {job.coalesced} 次重复触发"
+                source.reply(RText(line))
+
+    def inquire_backup(self, source: CommandSource):
+        # 压缩阶段由 BackupManager 报告进度，后台上传阶段根据上传令牌桶的累计字节数计算
+        if self.restoring and self.pending_restore is not None:
+            plan = self.pending_restore[0]
+            self.server.logger.info(f"§6正在恢复 {plan.name}：已解出 {self.restorer.restored_files} / "
+                                    f"{len(plan.files)} 个文件，{self.restorer.restored_bytes / 1024 / 1024:.1f} / "
+                                    f"{plan.total_bytes / 1024 / 1024:.1f} MB")
+            return
+        # 上一个备份上传时下一个备份可能已在压缩，两者分别报告
+        metrics = self.upload_metrics
+        uploading = metrics is not None and metrics.current_phase == 'upload'
+        if self.multi_instance:
+            self.__inquire_instances(metrics if uploading else None)
+        elif self.backup_manager.backup or not uploading:
+            self.backup_manager.inquire_backup()
+        waiting = len(self.job_queue.waiting(STAGE_COMPRESS)) + len(self.job_queue.waiting(STAGE_UPLOAD))
+        if waiting:
+            self.server.logger.info(f"§6队列中还有 {waiting} 个任务等待，使用 {self.config.prefix} queue 查看")
+        if uploading and not self.multi_instance:
+            self.__inquire_upload(metrics)
+
+    def __inquire_instances(self, upload_metrics: Optional[BackupMetrics]):
+        # 逐个报告实例的状态与最近一次备份各阶段的耗时，进行中的实例附带实时进度
+        for instance in self.instances:
+            line = f"§b{instance.label}{INSTANCE_STATE_NAMES[instance.state]}"
+            if instance.metrics is not None and instance.state != INSTANCE_IDLE:
+                line += ''.join(f"，{PHASE_NAMES[name]} {instance.metrics.phases[name]:.1f} 秒"
+                                for name in INSTANCE_TIMING_PHASES if name in instance.metrics.phases)
+            self.server.logger.info(line)
+            if instance.backup_manager.backup:
+                instance.backup_manager.inquire_backup()
+            elif instance is self.upload_instance and upload_metrics is not None:
+                self.__inquire_upload(upload_metrics)
+
+    def __inquire_upload(self, metrics: BackupMetrics):
+        # 多目标上传时按每个目标的平均进度计算
+        uploaded = (self.governor.upload_limiter.consumed - metrics.upload_baseline) / max(metrics.upload_targets, 1)
+        elapsed = metrics.phase_elapsed()
+        self.server.logger.info(f"§6当前阶段：{metrics.phase_name()} ({metrics.name})")
+        if metrics.archive_bytes:
+            percent = min(uploaded / metrics.archive_bytes * 100, 100)
+            self.server.logger.info(f"§6已上传数据量：{uploaded / 1024 / 1024:.1f} / "
+                                    f"{metrics.archive_bytes / 1024 / 1024:.1f} MB ({percent:.1f}%)")
+        if uploaded and elapsed > 0:
+            speed = uploaded / elapsed
+            eta = max(metrics.archive_bytes - uploaded, 0) / speed
+            self.server.logger.info(f"§6上传速度：{speed / 1024 / 1024:.1f} MB/s，预计剩余 {format_eta(eta)}")
+
+    def __finish_metrics(self, instance: BackupInstance, metrics: BackupMetrics):
+        try:
+            instance.metrics_recorder.finish(metrics)
+        except Exception as e:
+            self.server.logger.error(f"记录备份指标失败: {str(e)}")
+        if metrics.name:
+            self.__record_catalog(lambda: instance.backup_manager.catalog.finish(
+                metrics.name, metrics.status, time.time() - metrics.started))
+
+    def __record_catalog(self, record):
+        # 目录只用于查询，写入失败不影响备份与上传结果
+        try:
+            record()
+        except Exception as e:
+            self.server.logger.error(f"写入备份目录失败: {str(e)}")
+
+    def __execute_make_backup(self, source: CommandSource, job: BackupJob) -> Dict[str, str]:
+        # 在压缩阶段的工作线程中执行，返回需要转入上传队列的各实例备份路径
+        instances = self.instances
+        paused_at = time.time()
+        resumed = False
+        archives: Dict[str, str] = {}
+        done = threading.Event()
+
+        def add_phase(name: str, seconds: float):
+            # 停服、保存与暂存阶段由所有实例共同经历
+            for metrics in job.metrics.values():
+                metrics.add_phase(name, seconds)
+
+        def resume_server():
+            # 重启服务器或恢复自动保存，并报告停机/暂停保存的时长，只执行一次
+            nonlocal resumed
+            if resumed:
+                return
+            resumed = True
+            if self.config.stop_server:
+                try:
+                    self.server_controller.restart_server(lambda seconds: add_phase('startup', seconds))
+                    source.reply(RText("§a服务器已重启", color=RColor.green))
+                except Exception as e:
+                    self.server.logger.critical(f"服务器重启失败: {str(e)}")
+            else:
+                source.get_server().execute("save-on")
+            label = "停机" if self.config.stop_server else "暂停保存"
+            pause_time = time.time() - paused_at
+            for metrics in job.metrics.values():
+                metrics.pause_seconds = pause_time
+            self.server.logger.info(f"§6本次备份{label}时长: {pause_time:.1f} 秒")
+            source.reply(RText(f"§6本次备份{label}时长: §e{pause_time:.1f} 秒"))
 
-    @new_thread
-    def __execute_make_backup(self, source: CommandSource):
         def shutdown_callback():
+            nonlocal paused_at
+            stream_upload, stream_manager = None, None
+            self.governor.lower_thread_priority()
             try:
-                if not self.config.stop_server:
+                if self.config.stop_server:
+                    add_phase('stop_wait', self.server_controller.stop_latency)
+                else:
+                    paused_at = time.time()
                     source.get_server().execute("save-off")
+                    self.save_watcher.begin()
                     source.get_server().execute("save-all")
-                    self.save_wait_event.clear()
-                    self.save_completed = False
-                    if not self.save_wait_event.wait(self.save_timeout):
+                    save_latency = self.save_watcher.wait(self.save_timeout)
+                    add_phase('save_wait', time.time() - paused_at)
+                    if save_latency is None:
                         raise TimeoutError("等待保存超时")
-                    if not self.save_completed:
-                        raise RuntimeError("未检测到保存完成信号")
-                    
+                    self.server.logger.info(f"§7世界保存完成，耗时 {save_latency:.1f} 秒")
+
+                # 暂存模式：先复制出时间点副本并立即恢复服务器，再从副本压缩上传
+                source_dirs = {}
+                if self.config.snapshot_staging:
+                    source.reply(RText("§6正在创建暂存副本...", color=RColor.gold))
+                    staging_started = time.time()
+                    if self.multi_instance:
+                        source_dirs = self.orchestrator.stage(instances)
+                    else:
+                        source_dirs = {'': self.backup_manager.stage_snapshot()}
+                    add_phase('staging', time.time() - staging_started)
+                    resume_server()
+
                 source.reply(RText("§6正在创建备份文件...", color=RColor.gold))
-                backup_path = self.backup_manager.create_backup()
+                if self.multi_instance:
+                    archives.update(self.__create_instance_backups(source, instances, source_dirs))
+                    summary = f"（{len(archives)} / {len(instances)} 个实例）"
+                else:
+                    stream_upload, stream_manager = self.__create_stream_upload()
+                    backup_path = self.backup_manager.create_backup(stream_upload, self.governor.read_limiter,
+                                                                    source_dirs.get(''), job.metrics[''])
 
-                if backup_path is None:
-                    raise BackupAbortedException("用户终止备份")
-                if not isinstance(backup_path, str):
-                    raise ValueError("无效的备份路径")
-                if self.config.stop_server:
-                    source.reply(RText("§a备份文件创建完成，正在重启服务器...", color=RColor.green))
-                    self.server_controller.restart_server()
+                    if backup_path is None:
+                        raise BackupAbortedException("用户终止备份")
+                    if not isinstance(backup_path, str):
+                        raise ValueError("无效的备份路径")
+                    if stream_upload is None:
+                        archives[''] = backup_path
+                    summary = ''
+                if self.config.stop_server and not resumed:
+                    source.reply(RText(f"§a备份文件创建完成{summary}，正在重启服务器...", color=RColor.green))
                 else:
-                    source.reply(RText("§a备份文件创建完成", color=RColor.green))
-                self.__upload_background(source, str(backup_path))
+                    source.reply(RText(f"§a备份文件创建完成{summary}", color=RColor.green))
+                resume_server()
+                if stream_upload is not None:
+                    self.__report_stream_upload(source, backup_path, stream_upload, stream_manager,
+                                                job.metrics[''])
             except (TimeoutError, RuntimeError) as e:
                 source.reply(RText(f"§c备份失败: {str(e)}", color=RColor.red))
                 self.server.logger.error(str(e))
                 return
             except BackupAbortedException as e:
+                for metrics in job.metrics.values():
+                    metrics.status = STATUS_ABORTED
                 self.server.logger.error("备份被用户终止")
                 source.reply(RText("§c备份已终止", color=RColor.red))
                 return
@@ -108,42 +452,275 @@ class CommandHandler:
                 self.server.logger.error(f"备份流程错误: {str(e)}")
                 source.reply(RText("§c备份流程出现异常", color=RColor.red))
             finally:
-                if self.config.stop_server:
-                    try:
-                            self.server_controller.restart_server()
-                            source.reply(RText("§a服务器已强制重启", color=RColor.green))
-                    except Exception as e:
-                        self.server.logger.critical(f"服务器重启失败: {str(e)}")
-
-                else:
-                    source.get_server().execute("save-on")
+                self.connection_pool.release(stream_manager)
+                resume_server()
+                # 转入上传队列的备份在上传完成后记录指标
+                for instance in instances:
+                    if instance.name not in archives:
+                        self.__finish_metrics(instance, job.metrics[instance.name])
+                done.set()
         if self.config.stop_server:
-            self.server_controller.safe_shutdown(shutdown_callback)
+            self.server_controller.safe_shutdown(shutdown_callback, done.set)
         else:
             shutdown_callback()
+        done.wait()
+        return archives
 
-    @new_thread
-    def __upload_background(self, source: CommandSource, backup_path: str):
+    def __create_instance_backups(self, source: CommandSource, instances: List[BackupInstance],
+                                  source_dirs: Dict[str, str]) -> Dict[str, str]:
+        # 各实例在共用的线程池中错开开始，平分读取限速；部分实例失败时其余实例照常上传
+        # 只有从暂存副本压缩（服务器已恢复）时才错开开始，否则停服或暂停保存的时间会被拉长
+        results = self.orchestrator.run(instances, self.governor.read_limiter, source_dirs,
+                                        stagger=self.config.snapshot_staging)
+        failed = [name for name, path in results.items() if path is None]
+        if len(failed) == len(results):
+            if self.orchestrator.aborted:
+                raise BackupAbortedException("用户终止备份")
+            raise RuntimeError("所有实例的备份均失败")
+        if failed:
+            if self.orchestrator.aborted:
+                for instance in instances:
+                    if instance.name in failed:
+                        instance.metrics.status = STATUS_ABORTED
+            source.reply(RText(f"§c以下实例备份失败: {'、'.join(failed)}", color=RColor.red))
+        return {name: path for name, path in results.items() if path is not None}
+
+    def __create_stream_upload(self):
+        # 流式上传：边压缩边上传，不在本地暂存完整压缩包
+        # 配置了多个上传目标时不使用流式上传，由上传阶段读取一次压缩包同时发送到所有目标；多实例时同样不使用
+        if not self.config.stream_upload or self.backup_manager.use_chunk_store() or self.config.destinations or \
+                self.multi_instance:
+            return None, None
+        if self.config.stop_server and not self.config.snapshot_staging:
+            # 流式上传在停服期间进行，服务器要等上传结束才能重启；改为先压缩到本地，重启服务器后再上传
+            self.server.logger.warning("§6stop_server 开启且未启用 snapshot_staging 时不使用流式上传，以免停服持续到上传结束")
+            return None, None
+        manager = self.connection_pool.acquire()
+        if manager is None:
+            raise RuntimeError("无法连接远程服务器，流式上传已取消")
+        return StreamUpload(
+            lambda stream, filename: manager.upload_stream(stream, filename, self.config),
+            self.config.stream_buffer_mb * 1024 * 1024,
+            lambda filename: manager.delete_file(filename, self.config)
+        ), manager
+
+    def __report_stream_upload(self, source: CommandSource, backup_path: str, stream_upload: StreamUpload,
+                               manager, metrics: BackupMetrics):
+        # 流式上传与压缩同时进行，上传阶段耗时与压缩阶段重叠
+        metrics.add_phase('upload', stream_upload.elapsed)
+        metrics.uploaded_bytes = stream_upload.bytes_written
+        file_size = stream_upload.bytes_written / 1024 / 1024
+        self.remote_index.add([(os.path.basename(backup_path), stream_upload.bytes_written)])
+        self.__record_catalog(lambda: self.backup_manager.catalog.add_location(
+            os.path.basename(backup_path), self.destinations[0].name, stream_upload.bytes_written))
+        verified = self.__verify_upload(self.destinations[0], manager, backup_path)
+        if verified:
+            metrics.status = STATUS_SUCCESS
+            source.reply(
+                RTextList(
+                    RText("§a备份上传成功！", color=RColor.green),
+                    RText(f"\n文件名: §e{os.path.basename(backup_path)}"),
+                    RText(f"\n大小: §e{file_size:.2f} MB")
+                )
+            )
+        else:
+            metrics.status = STATUS_UPLOAD_FAILED
+            source.reply(RText("§c远程文件校验失败，请检查日志", color=RColor.red))
+        with metrics.phase('cleanup'):
+            self.__cleanup_backups(self.instances[0], succeeded=[self.destinations[0].name] if verified else [])
+
+    def __upload_background(self, source: CommandSource, instance: BackupInstance, backup_path: str,
+                            metrics: BackupMetrics):
+        self.governor.lower_thread_priority()
+        metrics.status = STATUS_UPLOAD_FAILED
+        metrics.upload_baseline = self.governor.upload_limiter.consumed
+        label = instance.label
+        if instance.backup_manager.use_chunk_store():
+            with metrics.phase('upload'), self.store_lock:
+                if self.__sync_chunk_store(source, instance):
+                    metrics.status = STATUS_SUCCESS
+            metrics.uploaded_bytes = self.governor.upload_limiter.consumed - metrics.upload_baseline
+            self.__finish_metrics(instance, metrics)
+            return
+        if len(instance.destinations) > 1:
+            metrics.upload_targets = len(instance.destinations)
+            results = {}
+            try:
+                with metrics.phase('upload'):
+                    results = self.__upload_fanout(instance, backup_path)
+                metrics.uploaded_bytes = self.governor.upload_limiter.consumed - metrics.upload_baseline
+                file_size = os.path.getsize(backup_path) / 1024 / 1024
+                for name, uploaded in results.items():
+                    if uploaded:
+                        source.reply(RText(f"§a{label}[{name}] 备份上传成功！文件名: §e{os.path.basename(backup_path)}"
+                                           f" §a大小: §e{file_size:.2f} MB", color=RColor.green))
+                    else:
+                        source.reply(RText(f"§c{label}[{name}] 备份上传失败，请检查日志", color=RColor.red))
+                if all(results.values()):
+                    metrics.status = STATUS_SUCCESS
+            except Exception as e:
+                self.server.logger.error(f"上传错误: {str(e)}")
+                source.reply(RText(f"§c{label}上传过程中发生意外错误", color=RColor.red))
+            finally:
+                with metrics.phase('cleanup'):
+                    self.__cleanup_backups(instance, backup_path,
+                                           [name for name, uploaded in results.items() if uploaded])
+                self.__finish_metrics(instance, metrics)
+            return
+        manager = None
+        uploaded = False
         try:
-            if self.ftp_manager.connect(self.config):
+            manager = self.connection_pool.acquire()
+            if manager is not None:
                 file_size = os.path.getsize(backup_path) / 1024 / 1024
-                if self.ftp_manager.upload_file(backup_path, self.config):
+                with metrics.phase('upload'):
+                    uploaded = self.__upload_archive(instance, instance.destinations[0], manager, backup_path)
+                metrics.uploaded_bytes = self.governor.upload_limiter.consumed - metrics.upload_baseline
+                if uploaded:
+                    metrics.status = STATUS_SUCCESS
                     source.reply(
                         RTextList(
-                            RText("§a备份上传成功！", color=RColor.green),
+                            RText(f"§a{label}备份上传成功！", color=RColor.green),
                             RText(f"\n文件名: §e{os.path.basename(backup_path)}"),
                             RText(f"\n大小: §e{file_size:.2f} MB"),
                             RText(f"\n路径: §e{backup_path}")
                         )
                     )
                 else:
-                    source.reply(RText("§c备份上传失败，请检查日志", color=RColor.red))
+                    source.reply(RText(f"§c{label}备份上传失败，请检查日志", color=RColor.red))
         except Exception as e:
             self.server.logger.error(f"上传错误: {str(e)}")
-            source.reply(RText("§c上传过程中发生意外错误", color=RColor.red))
+            source.reply(RText(f"§c{label}上传过程中发生意外错误", color=RColor.red))
         finally:
-            self.ftp_manager.disconnect()
-            self.backup_manager.cleanup_backups()
+            self.connection_pool.release(manager)
+            with metrics.phase('cleanup'):
+                self.__cleanup_backups(instance, backup_path,
+                                       [instance.destinations[0].name] if uploaded else [])
+            self.__finish_metrics(instance, metrics)
+
+    def __cleanup_backups(self, instance: BackupInstance, uploaded: Optional[str] = None,
+                          succeeded: Iterable[str] = ()):
+        # 仍在上传队列中的压缩包不参与本地清理，各上传目标按各自的保留设置清理
+        # 只清理本次上传成功的目标，上传失败时远程的旧备份可能是最新的可用备份
+        catalog = instance.backup_manager.catalog
+        instance.backup_manager.cleanup_backups([path for path in self.job_queue.archives() if path != uploaded])
+        for dest in instance.destinations:
+            if not dest.config.remote_retention or dest.name not in succeeded:
+                continue
+            try:
+                for name in prune_remote(dest.remote_index, dest.connection_pool, dest.config, self.server.logger):
+                    self.__record_catalog(lambda: catalog.remove_location(name, dest.name))
+            except Exception as e:
+                self.server.logger.error(f"远程清理错误 ({dest.name}): {str(e)}")
+
+    def __upload_fanout(self, instance: BackupInstance, backup_path: str) -> Dict[str, bool]:
+        # 读取一次压缩包，通过各目标自己的连接同时上传；流式发送中断的目标改为从本地文件断点续传
+        filename = os.path.basename(backup_path)
+        size = os.path.getsize(backup_path)
+        fanout = ArchiveFanout(backup_path, len(instance.destinations), self.config.fanout_buffer_mb * 1024 * 1024)
+        results = {dest.name: False for dest in instance.destinations}
+
+        def upload(dest: Destination, branch):
+            manager = dest.connection_pool.acquire()
+            try:
+                if manager is None:
+                    self.server.logger.error(f"无法连接上传目标: {dest.name}")
+                    return
+                # 流式发送失败时 upload_stream 已删除该目标上不完整的远程文件
+                if manager.upload_stream(branch, filename, dest.config):
+                    dest.remote_index.add([(filename, size)])
+                    self.__record_catalog(lambda: instance.backup_manager.catalog.add_location(
+                        filename, dest.name, size))
+                    results[dest.name] = self.__verify_upload(dest, manager, backup_path)
+                    return
+                if dest.config.resume_upload:
+                    self.server.logger.warning(f"§6{dest.name} 流式上传中断，改为从本地文件续传")
+                    results[dest.name] = self.__upload_archive(instance, dest, manager, backup_path)
+            finally:
+                branch.close()
+                dest.connection_pool.release(manager)
+
+        threads = [threading.Thread(target=upload, args=(dest, branch), name=f'ftp_backup_fanout_{i}', daemon=True)
+                   for i, (dest, branch) in enumerate(zip(instance.destinations, fanout.branches))]
+        for t in threads:
+            t.start()
+        try:
+            fanout.run()
+        except Exception as e:
+            self.server.logger.error(f"读取压缩包失败: {str(e)}")
+        for t in threads:
+            t.join()
+        if fanout.detached_count:
+            self.server.logger.info(f"§6{fanout.detached_count} 个上传目标落后超过缓冲区大小，已改为单独读取压缩包")
+        return results
+
+    def __sync_chunk_store(self, source: CommandSource, instance: BackupInstance) -> bool:
+        manager = None
+        try:
+            # 先执行保留策略，远程同步时一并删除多余的快照与数据块
+            instance.backup_manager.cleanup_backups(self.job_queue.archives())
+            manager = self.connection_pool.acquire()
+            if manager is not None:
+                store = instance.backup_manager.get_chunk_store()
+                if store.sync_remote(manager, instance.config, self.server.logger):
+                    # 远程是本地去重存储的镜像，同步后本地现有的快照在远程均可用
+                    for name in store.list_snapshots():
+                        self.__record_catalog(lambda: instance.backup_manager.catalog.add_location(
+                            name, instance.destinations[0].name))
+                    source.reply(RText(f"§a{instance.label}去重存储同步成功！", color=RColor.green))
+                    return True
+                source.reply(RText(f"§c{instance.label}去重存储同步失败，请检查日志", color=RColor.red))
+        except Exception as e:
+            self.server.logger.error(f"同步错误: {str(e)}")
+            source.reply(RText(f"§c{instance.label}同步过程中发生意外错误", color=RColor.red))
+        finally:
+            self.connection_pool.release(manager)
+        return False
+
+    def __upload_archive(self, instance: BackupInstance, dest: Destination, manager, backup_path: str) -> bool:
+        # 并行连接数大于 1 时按分段并行上传
+        if dest.config.upload_connections > 1:
+            uploader = SegmentedUploader(self.server, dest.connection_pool, dest.config)
+            if not uploader.upload(manager, backup_path):
+                return False
+            dest.remote_index.add(uploader.uploaded)
+            self.__record_catalog(lambda: instance.backup_manager.catalog.add_location(
+                os.path.basename(backup_path), dest.name, os.path.getsize(backup_path)))
+            return self.__verify_upload(dest, manager, backup_path,
+                                        [(p.name, p.offset, p.size) for p in uploader.parts])
+        if not manager.upload_file(backup_path, dest.config):
+            return False
+        dest.remote_index.add([(os.path.basename(backup_path), os.path.getsize(backup_path))])
+        self.__record_catalog(lambda: instance.backup_manager.catalog.add_location(
+            os.path.basename(backup_path), dest.name, os.path.getsize(backup_path)))
+        return self.__verify_upload(dest, manager, backup_path)
+
+    def __verify_upload(self, dest: Destination, manager, backup_path: str,
+                        parts: Optional[List[Tuple[str, int, int]]] = None) -> bool:
+        # 与压缩时计算的校验值比较，不一致时视为上传失败；没有校验值或无法校验时不影响上传结果
+        # 分段上传时 parts 为 (分段名, 偏移, 大小)，逐个比较分段大小并跨分段抽样
+        if not dest.config.verify_upload:
+            return True
+        checksum = ArchiveChecksum.load(checksum_path(backup_path))
+        if checksum is None:
+            return True
+        try:
+            if parts is None:
+                result, method = verify_remote(manager, os.path.basename(backup_path), checksum, dest.config,
+                                               dest.config.verify_samples)
+            else:
+                result, method = verify_remote_parts(manager, parts, checksum, dest.config,
+                                                     dest.config.verify_samples)
+        except Exception as e:
+            result, method = None, str(e)
+        if result is None:
+            self.server.logger.warning(f"§6未能校验远程文件 ({dest.name}): {method}")
+            return True
+        if result:
+            self.server.logger.info(f"§7远程文件校验通过 ({dest.name}): {method}")
+        else:
+            self.server.logger.error(f"§c远程文件校验失败 ({dest.name}): {method}")
+        return result
 
     def upload_file(self, source: CommandSource, ctx: dict):
         file_path = ctx['file_path']
@@ -155,14 +732,13 @@ class CommandHandler:
 
     @new_thread
     def __do_upload(self, source: CommandSource, file_path: str):
-        if self.ftp_manager.connect(self.config):
-            try:
-                if self.ftp_manager.upload_file(file_path, self.config):
-                    source.reply(RText(f"§a已上传 {file_path}", color=RColor.green))
-                else:
-                    source.reply(RText("§c上传失败", color=RColor.red))
-            finally:
-                self.ftp_manager.disconnect()
+        with self.connection_pool.session() as manager:
+            if manager is None:
+                return
+            if self.__upload_archive(self.instances[0], self.destinations[0], manager, file_path):
+                source.reply(RText(f"§a已上传 {file_path}", color=RColor.green))
+            else:
+                source.reply(RText("§c上传失败", color=RColor.red))
 
     def reload_config(self, source: CommandSource):
         if not source.has_permission(self.config.required_permission):
@@ -170,24 +746,40 @@ class CommandHandler:
             return
 
         try:
-            # 断开当前连接
-            self.ftp_manager.disconnect()
-
             # 重新加载配置
             new_config = self.server.load_config_simple(
                 file_name='config.json',
                 target_class=Config,
                 default_config={'prefix': '!!fb'}
             )
+            changed = changed_fields(self.config, new_config)
+            if not changed:
+                source.reply(RText("§a配置未变化", color=RColor.green))
+                return
 
-            # 更新配置引用
+            # 更新配置引用，只重建设置发生变化的部分
             old_config = self.config
             self.config = new_config
-            self.__update_transfer_manager()
-            self.backup_manager.update_config(new_config)
+            if changed & GOVERNOR_KEYS:
+                self.governor.update_config(new_config)
+            else:
+                self.governor.config = new_config
+            reconnect = bool(changed & CONNECTION_KEYS)
+            if reconnect:
+                # 断开当前连接
+                self.close_connections()
+                self.__update_transfer_manager()
+            self.instances = update_instances(self.server, self.instances, new_config)
+            self.orchestrator.config = new_config
+            self.__setup_instances(reconnect)
+            self.restorer = self.__create_restorer()
+            if 'saved_game_regex' in changed:
+                self.save_watcher.set_pattern(new_config.saved_game_regex)
             self.__update_timed_tasks(old_config)
+            if 'prefix' in changed:
+                self.server.logger.warning("命令前缀需重新加载插件后生效")
 
-            source.reply(RText("§a配置已重载", color=RColor.green))
+            source.reply(RText(f"§a配置已重载，变化的设置: {', '.join(sorted(changed))}", color=RColor.green))
         except Exception as e:
             self.server.logger.error(f"配置重载失败: {str(e)}")
             source.reply(RText(f"§c配置重载失败: {str(e)}", color=RColor.red))
@@ -202,19 +794,262 @@ class CommandHandler:
         else:
             self.ftp_manager = FTPManager(self.server)
             self.server.logger.error("未知的协议，已选择默认FTP协议")
+        self.connection_pool = self.__create_connection_pool()
+
+    def __create_connection_pool(self) -> ConnectionPool:
+        manager_class = type(self.ftp_manager)
+        return ConnectionPool(self.server, lambda: manager_class(self.server), self.config,
+                              self.governor.upload_limiter)
+
+    def __setup_instances(self, reconnect: bool = True):
+        # 各实例使用自己的远程路径、远程文件索引与指标记录；同一上传目标的连接池在实例间共用
+        if reconnect:
+            self.destination_pools = []
+            for overrides in self.config.destinations:
+                config = destination_config(self.config, overrides)
+                manager_class = SFTPManager if config.protocol.lower() == 'sftp' else FTPManager
+                self.destination_pools.append(ConnectionPool(self.server, lambda cls=manager_class: cls(self.server),
+                                                             config, self.governor.upload_limiter))
+        else:
+            # 连接设置未变化，沿用连接池中已登录的会话，只更新保活、空闲超时等运行时读取的设置
+            self.connection_pool.config = self.config
+            for overrides, pool in zip(self.config.destinations, self.destination_pools):
+                pool.config = destination_config(self.config, overrides)
+        for instance in self.instances:
+            instance.remote_index = self.__create_remote_index(instance)
+            instance.destinations = self.__create_destinations(instance, self.destination_pools)
+            instance.metrics_recorder = self.__create_metrics_recorder(instance)
+
+    def __create_remote_index(self, instance: BackupInstance) -> RemoteIndex:
+        config = instance.config
+        target = f"{config.host}:{config.port}{config.remote_path}"
+        return self.__reuse_remote_index(instance, os.path.join(instance.backup_manager.backup_dir, REMOTE_INDEX_NAME),
+                                         target, config.remote_index_ttl)
+
+    def __reuse_remote_index(self, instance: BackupInstance, path: str, target: str, ttl: int) -> RemoteIndex:
+        # 重载时索引文件与远程目标都未变化的索引沿用已加载的内容，不重新读取
+        for dest in instance.destinations:
+            if dest.remote_index.path == path and dest.remote_index.target == target:
+                dest.remote_index.ttl = ttl
+                return dest.remote_index
+        return RemoteIndex(path, target, ttl)
+
+    def __create_metrics_recorder(self, instance: BackupInstance) -> MetricsRecorder:
+        # 历史文件未变化时沿用已恢复的计数器，不重新读取整个历史文件
+        recorder = instance.metrics_recorder
+        if recorder is not None and recorder.history_path == os.path.join(instance.backup_manager.backup_dir,
+                                                                          HISTORY_NAME):
+            recorder.config = instance.config
+            return recorder
+        return MetricsRecorder(self.server, instance.config, instance.backup_manager.backup_dir)
+
+    def __create_destinations(self, instance: BackupInstance, pools: List[ConnectionPool]) -> List[Destination]:
+        # 主目标使用全局配置；destinations 中的每一项在全局配置的基础上覆盖各自的协议、凭据、路径与保留设置
+        destinations = [Destination(destination_name(instance.config), instance.config, self.connection_pool,
+                                    instance.remote_index)]
+        for i, (overrides, pool) in enumerate(zip(self.config.destinations, pools), 1):
+            config = destination_config(instance.config, overrides)
+            if instance.name and 'remote_path' in overrides:
+                # 多实例时每个实例上传到目标远程路径下以实例名命名的子目录
+                config.remote_path = posixpath.join(config.remote_path, instance.name)
+            name, ext = os.path.splitext(REMOTE_INDEX_NAME)
+            index_file = os.path.join(instance.backup_manager.backup_dir, f"{name}_{i}{ext}")
+            index = self.__reuse_remote_index(instance, index_file, f"{config.host}:{config.port}{config.remote_path}",
+                                              config.remote_index_ttl)
+            destinations.append(Destination(overrides.get('name') or destination_name(config), config, pool, index))
+        return destinations
+
+    def __create_restorer(self) -> Restorer:
+        return Restorer(self.server, self.instances[0].config, self.backup_manager, self.connection_pool,
+                        self.remote_index)
+
+    def list_restore_points(self, source: CommandSource):
+        if not source.has_permission(self.config.required_permission):
+            source.reply(RText("权限不足!", color=RColor.red))
+            return
+        self.__list_restore_points(source)
+
+    @new_thread
+    def __list_restore_points(self, source: CommandSource):
+        names = self.restorer.list_backups()
+        if not names:
+            source.reply(RText("§c没有可恢复的备份", color=RColor.red))
+            return
+        source.reply(RText(f"§6最近的备份（共 {len(names)} 个）:"))
+        for name in names[-RESTORE_LIST_SIZE:]:
+            local = os.path.exists(os.path.join(self.backup_manager.backup_dir, name)) or \
+                    self.backup_manager.use_chunk_store()
+            source.reply(RText(f"§e{name} §7({'本地' if local else '远程'})"))
+        source.reply(RText(f"§7使用 {self.config.prefix} restore <备份名|时间戳|latest> [路径...] 恢复"))
+
+    def __location_names(self, locations: List[str]) -> str:
+        return '、'.join('本地' if location == LOCATION_LOCAL else location for location in locations) or '无'
+
+    def list_backups(self, source: CommandSource, ctx: dict):
+        # 只查询本地备份目录数据库，不读取压缩包也不连接远程服务器
+        if not source.has_permission(self.config.required_permission):
+            source.reply(RText("权限不足!", color=RColor.red))
+            return
+        total, entries = self.backup_manager.catalog.list_backups(ctx.get('count', CATALOG_LIST_SIZE))
+        if not entries:
+            source.reply(RText("§c没有备份记录", color=RColor.red))
+            return
+        source.reply(RText(f"§6最近的备份（共 {total} 个）:"))
+        for entry in entries:
+            size = f"{entry.archive_bytes / 1024 / 1024:.1f} MB" if entry.archive_bytes is not None else "大小未知"
+            details = f"{BACKUP_TYPE_NAMES.get(entry.backup_type, entry.backup_type)}，{entry.files} 个文件，{size}"
+            if entry.duration is not None:
+                details += f"，耗时 {format_eta(entry.duration)}"
+            if entry.status not in (None, STATUS_SUCCESS):
+                details += f"，§c{entry.status}§7"
+            source.reply(RText(f"§e{entry.name} §7{details} §b[{self.__location_names(entry.locations)}]"))
+
+    def find_file(self, source: CommandSource, ctx: dict):
+        if not source.has_permission(self.config.required_permission):
+            source.reply(RText("权限不足!", color=RColor.red))
+            return
+        path = ctx['path'].strip()
+        versions = self.backup_manager.catalog.find(path, CATALOG_FIND_LIMIT)
+        if not versions:
+            source.reply(RText(f"§c没有找到 {path} 的备份记录", color=RColor.red))
+            return
+        source.reply(RText(f"§6{path} 的备份版本（最新 {len(versions)} 条）:"))
+        multiple = len({version.path for version in versions}) > 1
+        for version in versions:
+            source.reply(RText(self.__describe_version(version, multiple)))
+        source.reply(RText(f"§7使用 {self.config.prefix} restore <备份名> {path} 恢复指定版本"))
+
+    def __describe_version(self, version: FileVersion, show_path: bool) -> str:
+        name = f"§f{version.path} " if show_path else ''
+        if version.deleted:
+            return f"§e{version.backup} {name}§c已删除"
+        modified = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(version.mtime_ns / 1e9))
+        size = f"{version.size / 1024 / 1024:.1f} MB" if version.size >= 1024 * 1024 else f"{version.size / 1024:.1f} KB"
+        return (f"§e{version.backup} {name}§7修改于 {modified}，{size} "
+                f"§b[{self.__location_names(version.locations)}]")
+
+    def prepare_restore(self, source: CommandSource, ctx: dict):
+        if not source.has_permission(self.config.required_permission):
+            source.reply(RText("权限不足!", color=RColor.red))
+            return
+        if self.restoring or self.backup_manager.backup or self.job_queue.running(STAGE_COMPRESS) is not None:
+            source.reply(RText("§c已有备份或恢复任务在进行中", color=RColor.red))
+            return
+        self.__plan_restore(source, ctx['backup'], ctx.get('paths', '').split())
+
+    @new_thread
+    def __plan_restore(self, source: CommandSource, key: str, patterns: list):
+        try:
+            name = self.restorer.resolve_backup(key)
+            if name is None:
+                source.reply(RText(f"§c找不到备份: {key}", color=RColor.red))
+                return
+            plan = self.restorer.plan(name, patterns)
+        except Exception as e:
+            self.server.logger.error(f"生成恢复计划失败: {str(e)}")
+            source.reply(RText(f"§c无法恢复: {str(e)}", color=RColor.red))
+            return
+        self.pending_restore = (plan, time.time())
+        source.reply(RText(f"§6将从 §e{name} §6恢复 {len(plan.files)} 个文件 "
+                           f"({plan.total_bytes / 1024 / 1024:.1f} MB)，涉及 {len(plan.sources)} 个备份"))
+        if plan.removed:
+            source.reply(RText(f"§6将删除 {len(plan.removed)} 个备份之后新增的文件"))
+        source.reply(RText(f"§c恢复将覆盖服务器文件，期间服务器会短暂停止。"
+                           f"请在 {RESTORE_CONFIRM_TIMEOUT} 秒内输入 {self.config.prefix} restore confirm 确认",
+                           color=RColor.red))
+
+    def confirm_restore(self, source: CommandSource):
+        if not source.has_permission(self.config.required_permission):
+            source.reply(RText("权限不足!", color=RColor.red))
+            return
+        if self.pending_restore is None or time.time() - self.pending_restore[1] > RESTORE_CONFIRM_TIMEOUT:
+            self.pending_restore = None
+            source.reply(RText("§c没有待确认的恢复，或确认已超时", color=RColor.red))
+            return
+        if self.restoring or self.backup_manager.backup or self.job_queue.running(STAGE_COMPRESS) is not None:
+            source.reply(RText("§c已有备份或恢复任务在进行中", color=RColor.red))
+            return
+        self.restoring = True
+        self.__execute_restore(source, self.pending_restore[0])
+
+    @new_thread
+    def __execute_restore(self, source: CommandSource, plan: RestorePlan):
+        # 先在服务器运行时把文件解出到暂存目录，再停服移动文件，停服时间只包含移动文件的时间
+        start_time = time.time()
+        try:
+            source.reply(RText("§6正在读取备份数据...", color=RColor.gold))
+            self.restorer.fetch(plan)
+        except RestoreAbortedException:
+            self.restorer.clear_staging()
+            self.__finish_restore()
+            source.reply(RText("§c恢复已终止，服务器文件未被修改", color=RColor.red))
+            return
+        except Exception as e:
+            self.restorer.clear_staging()
+            self.__finish_restore()
+            self.server.logger.error(f"读取备份数据失败: {str(e)}")
+            source.reply(RText(f"§c恢复失败，服务器文件未被修改: {str(e)}", color=RColor.red))
+            return
+        fetch_time = time.time() - start_time
+        source.reply(RText(f"§a备份数据读取完成，耗时 {fetch_time:.1f} 秒", color=RColor.green))
+        was_running = self.server_controller.is_server_running()
+
+        def apply_callback():
+            stopped_at = time.time()
+            try:
+                self.restorer.apply(plan)
+                self.server.logger.info(f"§a已从 {plan.name} 恢复 {len(plan.files)} 个文件，"
+                                        f"删除 {len(plan.removed)} 个文件")
+                source.reply(RText(f"§a恢复完成，停服时长 {time.time() - stopped_at:.1f} 秒", color=RColor.green))
+            except Exception as e:
+                self.server.logger.error(f"恢复文件失败: {str(e)}")
+                source.reply(RText(f"§c恢复文件失败，服务器保持停止状态以便检查: {str(e)}", color=RColor.red))
+                was_running_flag[0] = False
+            finally:
+                self.__finish_restore()
+                if was_running_flag[0]:
+                    self.server_controller.restart_server()
+
+        def shutdown_failed():
+            # 停服超时或失败时放弃本次恢复，清理暂存目录，之后排队的备份可以继续执行
+            self.restorer.clear_staging()
+            self.__finish_restore()
+            source.reply(RText("§c关闭服务器失败，恢复已取消，服务器文件未被修改", color=RColor.red))
+
+        was_running_flag = [was_running]
+        if was_running:
+            self.server_controller.safe_shutdown(apply_callback, shutdown_failed)
+        else:
+            apply_callback()
+
+    def __finish_restore(self):
+        self.restoring = False
+        self.pending_restore = None
+
+    def close_connections(self):
+        # 各实例共用主目标与额外目标的连接池
+        for dest in self.destinations:
+            dest.connection_pool.close_all()
 
     def abort_backup(self, source: CommandSource):
-        if self.backup_manager.backup:
+        if self.restoring:
+            # 只能在读取备份数据阶段终止，移动文件阶段不可中断
+            self.restorer.abort = True
+            source.reply(RText("§6已发送终止信号，正在停止恢复...", color=RColor.gold))
+        elif self.multi_instance and self.job_queue.running(STAGE_COMPRESS) is not None:
+            self.orchestrator.abort(self.instances)
+            source.reply(RText("§6已发送终止信号，正在停止所有实例的备份...", color=RColor.gold))
+        elif self.backup_manager.backup:
             self.backup_manager.abort_backup_process()
             source.reply(RText("§6已发送终止信号，正在停止备份...", color=RColor.gold))
         else:
             source.reply(RText("§c当前没有进行中的备份", color=RColor.red))
 
-    def auto_backup(self):
+    def auto_backup(self, schedule: Optional[dict] = None):
         try:
             source = self.server.get_plugin_command_source()
             source.reply(RText("§6触发定时备份任务"))
-            self.make_backup(source)
+            self.__start_backup(source, schedule, 'schedule')
         except Exception as e:
             self.server.logger.error(f"定时备份过程中出错: {str(e)}")
             source.reply(RText(f"§c定时备份过程中出错: {str(e)}", color=RColor.red))
@@ -222,9 +1057,15 @@ class CommandHandler:
     def start_timed_tasks(self):
         try:
             self.server.logger.info("§6正在初始化定时备份任务")
+            # APScheduler 只在启用定时备份时导入
+            from apscheduler.schedulers.background import BackgroundScheduler
+            from apscheduler.triggers.cron import CronTrigger
             self.scheduler = BackgroundScheduler()
             trigger = CronTrigger.from_crontab(self.config.cron_expression)
             self.scheduler.add_job(self.auto_backup, trigger)
+            # 额外的定时计划各自携带限速设置，如夜间全速、白天低速
+            for schedule in self.config.schedules:
+                self.scheduler.add_job(self.auto_backup, CronTrigger.from_crontab(schedule['cron']), args=[schedule])
             self.scheduler.start()
             self.server.logger.info("§6定时任务初始化完成")
         except Exception as e:
@@ -248,11 +1089,13 @@ class CommandHandler:
             self.start_timed_tasks()
         elif old_config.auto_backup and self.config.auto_backup == False:
             self.stop_timed_tasks()
-        if old_config.cron_expression != self.config.cron_expression and self.config.auto_backup:
+        if (old_config.cron_expression != self.config.cron_expression or old_config.schedules != self.config.schedules) \
+                and self.config.auto_backup:
             self.stop_timed_tasks()
             self.start_timed_tasks()
 
     def on_info(self, server: PluginServerInterface, info: Info):
-        if not info.is_user and re.fullmatch(self.config.saved_game_regex, info.content):
-            self.save_completed = True
-            self.save_wait_event.set()
\ No newline at end of file
+        if info.is_user:
+            return
+        self.save_watcher.feed(info.content)
+        self.governor.on_server_info(info.content)
\ No newline at end of file
@@ -0,0 +1,134 @@
+import os
+import zlib
+import zipfile
+import tempfile
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Iterable, Optional, Tuple
+from .codec import CodecPolicy
+from .throttle import TokenBucket, throttled
+
+READ_BLOCK_SIZE = 1024 * 1024
+# 单个成员压缩结果超过该大小时溢写到临时文件，限制内存占用
+SPOOL_MAX_SIZE = 32 * 1024 * 1024
+
+
+class CompressedMember:
+    def __init__(self, zinfo: zipfile.ZipInfo, data):
+        self.zinfo = zinfo
+        self.data = data
+
+    def close(self):
+        self.data.close()
+
+
+def resolve_workers(workers: int) -> int:
+    if workers is None or workers <= 0:
+        return os.cpu_count() or 1
+    return workers
+
+
+def compress_member(full_path: str, arcname: str, level: int = zlib.Z_DEFAULT_COMPRESSION,
+                    policy: Optional[CodecPolicy] = None,
+                    limiter: Optional[TokenBucket] = None) -> CompressedMember:
+    zinfo = zipfile.ZipInfo.from_file(full_path, arcname)
+    if policy is not None:
+        zinfo.compress_type, level = policy.resolve(full_path, arcname, zinfo.file_size)
+    else:
+        zinfo.compress_type = zipfile.ZIP_DEFLATED
+    spool = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE)
+    try:
+        # 负的 wbits 生成 ZIP 所需的原始 deflate 流，存储方式则原样写入
+        compressor = None
+        if zinfo.compress_type == zipfile.ZIP_DEFLATED:
+            compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+        crc = 0
+        file_size = 0
+        with open(full_path, 'rb') as raw:
+            f = throttled(raw, limiter)
+            while True:
+                chunk = f.read(READ_BLOCK_SIZE)
+                if not chunk:
+                    break
+                crc = zlib.crc32(chunk, crc)
+                file_size += len(chunk)
+                spool.write(compressor.compress(chunk) if compressor is not None else chunk)
+        if compressor is not None:
+            spool.write(compressor.flush())
+        zinfo.file_size = file_size
+        zinfo.CRC = crc
+        zinfo.compress_size = spool.tell()
+        spool.seek(0)
+        return CompressedMember(zinfo, spool)
+    except Exception:
+        spool.close()
+        raise
+
+
+def write_raw_member(zipf: zipfile.ZipFile, zinfo: zipfile.ZipInfo, data):
+    # 将已压缩好的数据直接写入 ZIP，CRC 与大小已知，无需数据描述符
+    zip64 = (zinfo.file_size > zipfile.ZIP64_LIMIT
+             or zinfo.compress_size > zipfile.ZIP64_LIMIT)
+    zipf._writecheck(zinfo)
+    zipf._didModify = True
+    zinfo.header_offset = zipf.fp.tell()
+    zipf.fp.write(zinfo.FileHeader(zip64))
+    remaining = zinfo.compress_size
+    while remaining > 0:
+        chunk = data.read(min(READ_BLOCK_SIZE, remaining))
+        if not chunk:
+            raise IOError(f"压缩数据长度不足: {zinfo.filename}")
+        zipf.fp.write(chunk)
+        remaining -= len(chunk)
+    zipf.filelist.append(zinfo)
+    zipf.NameToInfo[zinfo.filename] = zinfo
+    zipf.start_dir = zipf.fp.tell()
+
+
+class ParallelCompressor:
+    def __init__(self, workers: int, level: int = zlib.Z_DEFAULT_COMPRESSION,
+                 policy: Optional[CodecPolicy] = None, limiter: Optional[TokenBucket] = None):
+        self.workers = resolve_workers(workers)
+        self.level = level
+        self.policy = policy
+        self.limiter = limiter
+
+    def write_all(self, zipf: zipfile.ZipFile, files: Iterable[Tuple[str, str]],
+                  on_written: Optional[Callable[[zipfile.ZipInfo], None]] = None,
+                  should_abort: Optional[Callable[[], bool]] = None):
+        # 多个线程并发压缩（zlib 压缩时释放 GIL），由当前线程按提交顺序写入
+        max_pending = self.workers * 2
+        pending = deque()
+        executor = ThreadPoolExecutor(max_workers=self.workers,
+                                      thread_name_prefix='ftp_backup_compress')
+        try:
+            files = iter(files)
+            exhausted = False
+            while True:
+                while not exhausted and len(pending) < max_pending:
+                    try:
+                        full_path, arcname = next(files)
+                    except StopIteration:
+                        exhausted = True
+                        break
+                    pending.append(executor.submit(compress_member, full_path, arcname,
+                                                   self.level, self.policy, self.limiter))
+                if not pending:
+                    break
+                if should_abort is not None and should_abort():
+                    return False
+                member = pending.popleft().result()
+                try:
+                    write_raw_member(zipf, member.zinfo, member.data)
+                finally:
+                    member.close()
+                if on_written is not None:
+                    on_written(member.zinfo)
+            return True
+        finally:
+            for future in pending:
+                future.cancel()
+            executor.shutdown(wait=True)
+            for future in pending:
+                if future.done() and not future.cancelled() and future.exception() is None:
+                    future.result().close()
@@ -1,3 +1,5 @@
+import os
+from typing import Set, Union
 from mcdreforged.api.utils.serializer import Serializable
 
 class Config(Serializable):
@@ -10,7 +12,7 @@ class Config(Serializable):
     private_key_path: str = ''
     password: str = ''
     prefix: str = '!!fb'
-    server_dir: str = './server'
+    server_dir: Union[str, list] = './server' #服务器目录，为列表时同时备份多个世界或实例，每项为路径或 {"path": ..., "name": ...}
     keep_local_backups: int = 3
     required_permission: int = 3
     exclude_patterns: list = ["logs",
@@ -20,4 +22,72 @@ class Config(Serializable):
     local_path: str = './backups'
     auto_backup: bool = False
     cron_expression: str = '0 0 * * *'
-    saved_game_regex: str = r'Saved the game.*' #保存世界完成信息正则表达式
\ No newline at end of file
+    compress_workers: int = 1 #压缩线程数，1 为单线程，0 为自动使用全部 CPU 核心
+    backup_mode: str = 'full' #备份模式: full 全量, incremental 增量, differential 差异
+    full_backup_interval: int = 24 #每隔多少次增量/差异备份强制执行一次全量备份，0 为不强制
+    manifest_hash: bool = False #清单中是否记录文件哈希，可避免仅修改时间变化的文件被重复备份
+    storage_backend: str = 'zip' #存储方式: zip 为压缩包, chunk 为按内容切块的去重存储
+    chunk_size_kb: int = 1024 #去重存储的平均数据块大小(KB)
+    stream_upload: bool = False #是否边压缩边上传，不在本地暂存完整压缩包(stop_server 开启时需同时开启 snapshot_staging)
+    stream_keep_local: bool = True #流式上传时是否同时保留本地副本
+    stream_buffer_mb: int = 64 #流式上传时压缩与上传之间的内存缓冲区大小(MB)
+    archive_format: str = 'zip' #压缩包格式: zip 或 tar.zst（tar.zst 需安装 zstandard）
+    compress_level: int = 6 #ZIP 默认 deflate 压缩等级(0-9)
+    zstd_level: int = 3 #tar.zst 格式的 zstd 压缩等级
+    codec_rules: dict = {"*.mca": "store", "*.jar": "store", "*.zip": "store", "*.png": "store", "*.gz": "store"} #按文件类型指定压缩方式: store 或 deflate:<等级>
+    detect_incompressible: bool = True #抽样检测不可压缩的文件并直接存储
+    resume_upload: bool = True #上传中断后是否自动重连并断点续传
+    upload_retries: int = 5 #上传中断后的最大重试次数
+    retry_backoff: int = 2 #首次重试等待秒数，之后每次翻倍(最长 60 秒)
+    upload_connections: int = 1 #上传并行连接数，大于 1 时将压缩包分段并行上传
+    upload_part_size_mb: int = 64 #分段上传时每个分段的大小(MB)
+    pool_idle_timeout: int = 300 #空闲连接保留秒数，期间的上传等操作复用已登录的会话，0 为不复用
+    keepalive_interval: int = 30 #空闲连接保活间隔(秒)
+    sftp_window_mb: int = 64 #SFTP 通道窗口大小(MB)
+    sftp_max_packet_kb: int = 32 #SFTP 最大数据包大小(KB)
+    sftp_block_kb: int = 1024 #SFTP 读写缓冲区大小(KB)
+    sftp_ciphers: list = [] #优先使用的 SFTP 加密算法，如 ["aes128-gcm@openssh.com", "aes128-ctr"]
+    sftp_compression: bool = False #是否启用 SSH 压缩，带宽受限且数据可压缩时使用
+    read_limit_mb: int = 0 #备份读取磁盘的限速(MB/s)，0 为不限速
+    upload_limit_mb: int = 0 #上传限速(MB/s)，多个并行连接合计，0 为不限速
+    backup_niceness: int = 0 #备份线程的 nice 值(0-19)，越大占用 CPU 越少，仅 Linux 生效
+    backup_io_priority: str = '' #备份线程的 I/O 优先级: best-effort 或 idle，留空不调整，仅 Linux 生效
+    adaptive_throttle: bool = False #服务器卡顿时自动降低备份速率，负载恢复后逐步还原
+    target_mspt: int = 40 #自适应限速的 MSPT 阈值(毫秒)，超过时降低备份速率
+    tick_query_interval: int = 0 #自适应限速时每隔多少秒执行 tick query 采样 MSPT(需 1.20.3+)，0 为仅依据过载警告
+    overload_regex: str = r"Can't keep up!.*" #服务器过载警告正则表达式
+    mspt_regex: str = r'.*Average time per tick: ([\d.]+)ms.*' #tick query 输出中 MSPT 的正则表达式
+    schedules: list = [] #额外的定时备份计划，可单独设置限速，如 [{"cron": "0 4 * * *", "read_limit_mb": 0}]
+    snapshot_staging: bool = False #是否先将服务器目录复制为暂存副本，随即重启服务器或恢复保存，再从副本压缩上传
+    snapshot_method: str = 'auto' #暂存副本的复制方式: auto 优先 reflink 克隆, reflink 仅克隆, copy 普通复制
+    snapshot_workers: int = 4 #复制暂存副本的并行线程数
+    retention_hourly: int = 0 #除最近的备份外，按小时保留的时段数，每个时段保留最新的一个备份
+    retention_daily: int = 0 #按天保留的时段数
+    retention_weekly: int = 0 #按周保留的时段数
+    retention_monthly: int = 0 #按月保留的时段数
+    remote_retention: bool = False #是否按保留策略清理远程的旧备份
+    keep_remote_backups: int = 10 #远程保留最近的备份数量，分层保留的时段设置与本地相同
+    remote_index_ttl: int = 86400 #远程文件列表缓存的有效期(秒)，过期后重新列出
+    prune_batch_size: int = 20 #远程清理时每批删除的文件数，每批完成后保存索引
+    metrics_history: bool = True #是否在备份目录的 backup_metrics.jsonl 中记录每次备份的各阶段耗时与压缩率
+    prometheus_textfile: str = '' #Prometheus 文本格式指标文件路径，供 node_exporter 的 textfile collector 采集，留空不输出
+    restore_workers: int = 4 #恢复时并行下载与解压的线程数(远程恢复时即并行连接数)
+    region_delta: bool = False #增量/差异备份时 .mca 区域文件只保存时间戳或内容变化的区块，恢复时重建完整文件
+    destinations: list = [] #额外的上传目标，每项为覆盖全局设置的字典(如 protocol/host/port/username/password/private_key_path/remote_path/keep_remote_backups/remote_retention，可选 name)，备份同时上传到所有目标
+    fanout_buffer_mb: int = 32 #多目标上传时每个目标的读取缓冲区大小(MB)，落后超过该大小的目标改为单独读取压缩包
+    checksum_algorithm: str = '' #压缩时同步计算并保存到 .checksum.json 的校验算法，如 sha256/blake2b/md5/xxh64(需安装 xxhash)，默认留空不计算
+    verify_upload: bool = False #上传后校验远程文件(需设置 checksum_algorithm)：服务器支持 HASH/XCRC/XMD5 时比较校验值，否则比较大小并抽样读取部分数据块
+    verify_samples: int = 4 #远程服务器不支持校验命令时抽样比较的数据块数(每块 4 MB，总是包含首尾两块)
+    synthetic_full: bool = False #全量备份时直接复制之前本地 ZIP 备份中未变化文件的压缩数据，只重新压缩变化的文件(仅 zip 格式)
+    instance_concurrency: int = 2 #server_dir 为列表时同时备份的实例数，0 为全部同时进行
+    instance_stagger: int = 5 #多实例时相邻两个实例开始备份的最小间隔(秒)，避免同时开始争抢磁盘，仅在 snapshot_staging 开启时生效
+    saved_game_regex: str = r'Saved the game.*' #保存世界完成信息正则表达式
+
+
+def changed_fields(old: Config, new: Config) -> Set[str]:
+    # 重载时比较新旧配置，只重建发生变化的部分；单实例时 server_dir 在加载后已被转换为绝对路径
+    old_values, new_values = old.serialize(), new.serialize()
+    if isinstance(old.server_dir, str) and isinstance(new.server_dir, str):
+        old_values['server_dir'] = os.path.abspath(old.server_dir)
+        new_values['server_dir'] = os.path.abspath(new.server_dir)
+    return {key for key in new_values.keys() | old_values.keys() if old_values.get(key) != new_values.get(key)}
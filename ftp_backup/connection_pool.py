@@ -0,0 +1,98 @@
+import time
+import threading
+from contextlib import contextmanager
+from typing import Callable, List, Optional, Tuple
+from .throttle import TokenBucket
+from mcdreforged.api.all import PluginServerInterface
+
+
+class ConnectionPool:
+    """
+    复用已登录的 FTP/SFTP 会话，避免每次上传、列目录与清理都重新握手
+    取出会话时先做健康检查，空闲会话由后台线程定期发送保活命令，空闲超时后关闭
+    """
+
+    def __init__(self, server: PluginServerInterface, manager_factory: Callable[[], object], config,
+                 upload_limiter: Optional[TokenBucket] = None):
+        self.server = server
+        self.manager_factory = manager_factory
+        self.config = config
+        self.upload_limiter = upload_limiter
+        self.idle: List[Tuple[object, float]] = []
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.keepalive_thread: Optional[threading.Thread] = None
+
+    def acquire(self):
+        # 返回可用的会话，无法连接时返回 None
+        while True:
+            with self.lock:
+                if not self.idle:
+                    break
+                manager, _ = self.idle.pop()
+            if manager.is_alive():
+                manager.upload_limiter = self.upload_limiter
+                return manager
+            manager.disconnect()
+        manager = self.manager_factory()
+        if manager.connect(self.config):
+            manager.upload_limiter = self.upload_limiter
+            return manager
+        manager.disconnect()
+        return None
+
+    def release(self, manager):
+        if manager is None:
+            return
+        if self.config.pool_idle_timeout <= 0 or not manager.is_connected():
+            manager.disconnect()
+            return
+        with self.lock:
+            if len(self.idle) < max(self.config.upload_connections, 1):
+                self.idle.append((manager, time.time()))
+                manager = None
+        if manager is not None:
+            manager.disconnect()
+            return
+        self.__ensure_keepalive()
+
+    @contextmanager
+    def session(self):
+        manager = self.acquire()
+        try:
+            yield manager
+        finally:
+            self.release(manager)
+
+    def __ensure_keepalive(self):
+        if self.keepalive_thread is not None and self.keepalive_thread.is_alive():
+            return
+        self.keepalive_thread = threading.Thread(target=self.__keepalive_loop, args=(self.stop_event,),
+                                                 name='ftp_backup_keepalive', daemon=True)
+        self.keepalive_thread.start()
+
+    def __keepalive_loop(self, stop_event: threading.Event):
+        while not stop_event.wait(max(self.config.keepalive_interval, 1)):
+            with self.lock:
+                sessions, self.idle = self.idle, []
+            alive = []
+            now = time.time()
+            for manager, released_at in sessions:
+                if now - released_at > self.config.pool_idle_timeout or not manager.is_alive():
+                    manager.disconnect()
+                else:
+                    alive.append((manager, released_at))
+            with self.lock:
+                self.idle.extend(alive)
+                if not self.idle:
+                    self.keepalive_thread = None
+                    return
+
+    def close_all(self):
+        self.stop_event.set()
+        self.stop_event = threading.Event()
+        self.keepalive_thread = None
+        with self.lock:
+            sessions, self.idle = self.idle, []
+        for manager, _ in sessions:
+            manager.disconnect()
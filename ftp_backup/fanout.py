@@ -0,0 +1,153 @@
+import copy
+import threading
+from collections import deque
+from typing import List, Optional
+
+BLOCK_SIZE = 1024 * 1024
+# 上传目标的设置在全局配置的基础上覆盖，以下两项不能在目标中设置
+RESERVED_KEYS = ('destinations', 'name')
+
+
+def destination_config(base, overrides: dict):
+    # 复制全局配置并覆盖目标自己的协议、凭据、远程路径与保留设置
+    config = copy.copy(base)
+    for key, value in overrides.items():
+        if key in RESERVED_KEYS:
+            continue
+        if not hasattr(base, key):
+            raise ValueError(f"未知的上传目标设置: {key}")
+        setattr(config, key, value)
+    return config
+
+
+def destination_name(config) -> str:
+    return f"{config.protocol.lower()}://{config.host}:{config.port}{config.remote_path}"
+
+
+class Destination:
+    # 一个上传目标及其独立的连接池与远程文件索引
+    def __init__(self, name: str, config, connection_pool, remote_index):
+        self.name = name
+        self.config = config
+        self.connection_pool = connection_pool
+        self.remote_index = remote_index
+
+
+class FanoutBranch:
+    """
+    一个上传目标的读取端，提供 read() 供上传方法使用
+    跟得上共享读取时从缓冲区取数据；被分离后先读完缓冲区，再自行打开文件从当前位置继续读取
+    """
+
+    def __init__(self, fanout: 'ArchiveFanout'):
+        self.fanout = fanout
+        self.blocks = deque()
+        self.buffered = 0
+        self.position = 0
+        self.eof = False
+        self.detached = False
+        self.closed = False
+        self.file = None
+
+    @property
+    def attached(self) -> bool:
+        return not self.detached and not self.closed
+
+    def read(self, size: int = -1) -> bytes:
+        if size is None or size < 0:
+            size = BLOCK_SIZE
+        condition = self.fanout.condition
+        with condition:
+            while not self.blocks and not self.eof and not self.detached:
+                condition.wait()
+            if not self.blocks and not self.detached and self.fanout.error is not None:
+                raise IOError(f"读取压缩包失败: {self.fanout.error}")
+            if self.blocks:
+                data = self.blocks.popleft()
+                if len(data) > size:
+                    self.blocks.appendleft(data[size:])
+                    data = data[:size]
+                self.buffered -= len(data)
+                self.position += len(data)
+                condition.notify_all()
+                return data
+            if not self.detached:
+                return b''
+        if self.file is None:
+            self.file = open(self.fanout.path, 'rb')
+            self.file.seek(self.position)
+        data = self.file.read(size)
+        self.position += len(data)
+        return data
+
+    def close(self):
+        # 上传结束（成功或失败）后调用，共享读取不再为该目标缓冲数据
+        with self.fanout.condition:
+            self.closed = True
+            self.blocks.clear()
+            self.buffered = 0
+            self.fanout.condition.notify_all()
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+class ArchiveFanout:
+    """
+    只读取一次压缩包，同时供给多个上传目标，每个目标有独立的有界缓冲区
+    所有目标的缓冲区都满时读取等待最快的目标；某个目标比其他目标落后超过缓冲区大小时与共享读取分离，
+    改为自行从文件读取，慢速目标不会拖慢其他目标，内存占用不超过 目标数 × 缓冲区大小
+    """
+
+    def __init__(self, path: str, count: int, buffer_size: int):
+        self.path = path
+        self.buffer_size = max(buffer_size, BLOCK_SIZE)
+        self.condition = threading.Condition()
+        self.branches: List[FanoutBranch] = [FanoutBranch(self) for _ in range(count)]
+        self.error: Optional[BaseException] = None
+        self.bytes_read = 0
+
+    def __wait_for_space(self, size: int) -> List[FanoutBranch]:
+        # 返回可以写入的目标，期间分离落后的目标
+        with self.condition:
+            while True:
+                active = [b for b in self.branches if b.attached]
+                if not active:
+                    return []
+                full = [b for b in active if b.buffered + size > self.buffer_size]
+                if len(full) < len(active):
+                    for branch in full:
+                        branch.detached = True
+                    if full:
+                        self.condition.notify_all()
+                    return [b for b in active if not b.detached]
+                self.condition.wait()
+
+    def run(self):
+        try:
+            with open(self.path, 'rb') as f:
+                while True:
+                    data = f.read(BLOCK_SIZE)
+                    if not data:
+                        break
+                    targets = self.__wait_for_space(len(data))
+                    if not targets:
+                        break
+                    with self.condition:
+                        for branch in targets:
+                            branch.blocks.append(data)
+                            branch.buffered += len(data)
+                        self.condition.notify_all()
+                    self.bytes_read += len(data)
+        except Exception as e:
+            self.error = e
+            raise
+        finally:
+            with self.condition:
+                for branch in self.branches:
+                    branch.eof = True
+                self.condition.notify_all()
+
+    @property
+    def detached_count(self) -> int:
+        return sum(1 for b in self.branches if b.detached)
@@ -1,54 +1,324 @@
 import ftplib
 import socket
-import chardet
 import os
-from typing import Optional
+import time
+import posixpath
+from typing import Dict, Optional, Tuple
 from mcdreforged.api.all import PluginServerInterface
+from .stream_pipe import RangeReader
+from .throttle import TokenBucket, TransferCancelled, throttled
+
+STREAM_BLOCK_SIZE = 1024 * 1024
+# HASH 命令 (draft-bryan-ftp-hash) 使用的算法名
+FTP_HASH_NAMES = {'sha256': 'SHA-256', 'sha512': 'SHA-512', 'sha1': 'SHA-1', 'md5': 'MD5', 'crc32': 'CRC32'}
+# 断点续传只重试临时错误（4xx 响应、连接中断、大小不一致）
+TRANSIENT_ERRORS = (ftplib.error_temp, OSError, EOFError)
 
 class FTPManager:
+    # 按 (host, port) 缓存检测到的服务器编码，只在首次连接时额外建立一次探测连接
+    # 只缓存检测成功的结果，探测失败时本次使用 utf-8，下次连接重新检测
+    encoding_cache: Dict[Tuple[str, int], str] = {}
+
     def __init__(self, server: PluginServerInterface):
         self.server = server
         self.ftp_client: Optional[ftplib.FTP] = None
         self.encoding = 'utf-8'
+        self.known_dirs = set()
+        self.features: Optional[Dict[str, str]] = None
+        self.upload_limiter: Optional[TokenBucket] = None
 
-    def detect_encoding(self, host: str, port: int, timeout: int) -> str:
+    def detect_encoding(self, host: str, port: int, timeout: int) -> Optional[str]:
+        # 探测失败时返回 None
         try:
             with socket.create_connection((host, port), timeout=timeout) as sock:
                 welcome_bytes = sock.recv(1024)
+                if not welcome_bytes:
+                    raise ConnectionError("服务器未发送欢迎信息")
+                # 只在首次连接某个服务器时检测编码，用到时才导入 chardet
+                import chardet
                 result = chardet.detect(welcome_bytes)
                 return result['encoding'] if result['confidence'] > 0.5 else 'latin-1'
         except Exception as e:
             self.server.logger.error(f"编码检测失败: {e}")
-            return 'utf-8'
+            return None
 
     def connect(self, config) -> bool:
         try:
-            self.encoding = self.detect_encoding(config.host, config.port, config.timeout)
+            key = (config.host, config.port)
+            encoding = FTPManager.encoding_cache.get(key)
+            if encoding is None:
+                encoding = self.detect_encoding(config.host, config.port, config.timeout)
+                if encoding is not None:
+                    FTPManager.encoding_cache[key] = encoding
+            self.encoding = encoding or 'utf-8'
             self.ftp_client = ftplib.FTP()
             self.ftp_client.encoding = self.encoding
             self.ftp_client.connect(config.host, config.port, timeout=config.timeout)
             self.ftp_client.login(config.username, config.password)
+            self.known_dirs.clear()
+            self.features = None
             self.server.logger.info("FTP连接成功")
             return True
         except Exception as e:
             self.server.logger.error(f"连接失败: {str(e)}")
+            self.disconnect()
+            return False
+
+    def is_connected(self) -> bool:
+        return self.ftp_client is not None
+
+    def is_alive(self) -> bool:
+        # 健康检查与保活均使用 NOOP
+        if self.ftp_client is None:
+            return False
+        try:
+            self.ftp_client.voidcmd('NOOP')
+            return True
+        except ftplib.all_errors:
             return False
 
     def upload_file(self, file_path: str, config) -> bool:
         if self.ftp_client is None:
             return False
 
+        remote_filename = os.path.basename(file_path)
+        remote_path = f"{config.remote_path}/{remote_filename}".replace('//', '/')
         try:
-            remote_filename = os.path.basename(file_path)
-            remote_path = f"{config.remote_path}/{remote_filename}".replace('//', '/')
-            with open(file_path, 'rb') as f:
-                self.ftp_client.storbinary(f'STOR {remote_path}', f)
+            self.__ensure_dir(config.remote_path)
+        except ftplib.all_errors as e:
+            self.server.logger.error(f"上传失败: {str(e)}")
+            return False
+        return self.__upload_resumable(file_path, remote_path, config)
+
+    def __remote_size(self, remote_path: str) -> Optional[int]:
+        try:
+            self.ftp_client.voidcmd('TYPE I')
+            return self.ftp_client.size(remote_path)
+        except ftplib.all_errors:
+            return None
+
+    def __upload_resumable(self, file_path: str, remote_path: str, config) -> bool:
+        # 连接中断后重连并通过 SIZE/REST 从远程已有的字节处继续上传
+        local_size = os.path.getsize(file_path)
+        offset = 0
+        attempts = 0
+        rest_supported = True
+        while True:
+            try:
+                if self.ftp_client is None:
+                    raise ConnectionError("重连失败，未连接到服务器")
+                with open(file_path, 'rb') as f:
+                    f.seek(offset)
+                    self.ftp_client.storbinary(f'STOR {remote_path}', throttled(f, self.upload_limiter),
+                                               rest=offset or None)
+                remote_size = self.__remote_size(remote_path)
+                if remote_size is not None and remote_size != local_size:
+                    raise IOError(f"远程文件大小不一致: {remote_size} / {local_size}")
+                self.server.logger.info(f"已上传至 {remote_path}")
+                return True
+            except Exception as e:
+                if offset and isinstance(e, ftplib.error_perm):
+                    rest_supported = False  # 服务器不支持断点续传，之后从头上传
+                elif not isinstance(e, TRANSIENT_ERRORS) or isinstance(e, TransferCancelled):
+                    # 权限不足、路径无效等永久错误重试也不会成功
+                    self.server.logger.error(f"上传失败: {str(e)}")
+                    return False
+                attempts += 1
+                if not config.resume_upload or attempts > config.upload_retries:
+                    self.server.logger.error(f"上传失败: {str(e)}")
+                    return False
+                delay = min(config.retry_backoff * 2 ** (attempts - 1), 60)
+                self.server.logger.warning(f"上传中断: {str(e)}，{delay} 秒后进行第 {attempts} 次重试")
+                time.sleep(delay)
+                self.disconnect()
+                if not self.connect(config):
+                    continue
+                offset = (self.__remote_size(remote_path) or 0) if rest_supported else 0
+                if offset > local_size:
+                    offset = 0
+                if offset:
+                    self.server.logger.info(f"§6从第 {offset} 字节处继续上传")
+
+    def upload_stream(self, stream, filename: str, config) -> bool:
+        if self.ftp_client is None:
+            return False
+
+        remote_path = f"{config.remote_path}/{filename}".replace('//', '/')
+        try:
+            self.__ensure_dir(config.remote_path)
+            self.ftp_client.storbinary(f'STOR {remote_path}', throttled(stream, self.upload_limiter),
+                                       blocksize=STREAM_BLOCK_SIZE)
             self.server.logger.info(f"已上传至 {remote_path}")
             return True
+        except Exception as e:
+            self.server.logger.error(f"流式上传失败: {str(e)}")
+            self.__discard_partial(remote_path, config)
+            return False
+
+    def __discard_partial(self, remote_path: str, config):
+        # 尽力删除中断的流式上传留下的不完整文件，否则刷新索引后会被当作完整备份占用保留名额
+        # 传输中断后控制连接上可能还有未读取的响应，重新连接后再删除
+        self.disconnect()
+        if not self.connect(config):
+            return
+        try:
+            self.ftp_client.delete(remote_path)
+            self.server.logger.info(f"§7已删除不完整的远程文件: {remote_path}")
+        except ftplib.all_errors:
+            pass
+
+    def __remote_path(self, rel_path: str, config) -> str:
+        return f"{config.remote_path}/{rel_path}".replace('//', '/')
+
+    def __ensure_dir(self, remote_dir: str):
+        path = '/' if remote_dir.startswith('/') else ''
+        for part in [p for p in remote_dir.split('/') if p]:
+            path = posixpath.join(path, part)
+            if path in self.known_dirs:
+                continue
+            try:
+                self.ftp_client.mkd(path)
+            except ftplib.error_perm:
+                pass  # 目录已存在
+            self.known_dirs.add(path)
+
+    def upload_to(self, file_path: str, rel_path: str, config) -> bool:
+        if self.ftp_client is None:
+            return False
+
+        try:
+            remote_path = self.__remote_path(rel_path, config)
+            self.__ensure_dir(posixpath.dirname(remote_path))
+            with open(file_path, 'rb') as f:
+                self.ftp_client.storbinary(f'STOR {remote_path}', throttled(f, self.upload_limiter))
+            return True
         except Exception as e:
             self.server.logger.error(f"上传失败: {str(e)}")
             return False
 
+    def upload_part(self, file_path: str, offset: int, size: int, rel_path: str, config, hasher=None) -> bool:
+        if self.ftp_client is None:
+            return False
+
+        try:
+            remote_path = self.__remote_path(rel_path, config)
+            self.__ensure_dir(posixpath.dirname(remote_path))
+            with open(file_path, 'rb') as f:
+                f.seek(offset)
+                reader = throttled(RangeReader(f, size, hasher), self.upload_limiter)
+                self.ftp_client.storbinary(f'STOR {remote_path}', reader, blocksize=STREAM_BLOCK_SIZE)
+            return True
+        except Exception as e:
+            self.server.logger.error(f"分段上传失败: {str(e)}")
+            return False
+
+    def list_names(self, rel_dir: str, config) -> list:
+        if self.ftp_client is None:
+            return []
+
+        try:
+            names = self.ftp_client.nlst(self.__remote_path(rel_dir, config))
+        except ftplib.error_perm:
+            return []  # 目录不存在或为空
+        return [posixpath.basename(n.rstrip('/')) for n in names]
+
+    def list_entries(self, rel_dir: str, config) -> Dict[str, Optional[int]]:
+        # 一次 MLSD 列出文件名与大小，服务器不支持时退回 NLST（大小未知）
+        if self.ftp_client is None:
+            return {}
+
+        try:
+            return {name: int(facts['size']) if 'size' in facts else None
+                    for name, facts in self.ftp_client.mlsd(self.__remote_path(rel_dir, config), facts=['type', 'size'])
+                    if facts.get('type', 'file') == 'file'}
+        except ftplib.error_perm:
+            return {name: None for name in self.list_names(rel_dir, config)}
+
+    def file_size(self, rel_path: str, config) -> Optional[int]:
+        if self.ftp_client is None:
+            return None
+        return self.__remote_size(self.__remote_path(rel_path, config))
+
+    def __get_features(self) -> Dict[str, str]:
+        # FEAT 结果按连接缓存，键为大写的扩展命令名
+        if self.features is None:
+            self.features = {}
+            try:
+                for line in self.ftp_client.sendcmd('FEAT').splitlines()[1:-1]:
+                    name, _, params = line.strip().partition(' ')
+                    self.features[name.upper()] = params
+            except ftplib.all_errors:
+                pass
+        return self.features
+
+    def remote_checksum(self, rel_path: str, algorithms: list, config) -> Optional[Tuple[str, str]]:
+        # 由服务器计算远程文件的校验值，返回 (算法, 十六进制校验值)，依次尝试 HASH、XMD5、XCRC，均不支持时返回 None
+        if self.ftp_client is None:
+            return None
+
+        features = self.__get_features()
+        remote_path = self.__remote_path(rel_path, config)
+        if 'HASH' in features:
+            offered = {name.rstrip('*').upper() for name in features['HASH'].split(';')}
+            for algorithm in algorithms:
+                name = FTP_HASH_NAMES.get(algorithm)
+                if name not in offered:
+                    continue
+                try:
+                    self.ftp_client.sendcmd(f'OPTS HASH {name}')
+                    # 213 SHA-256 0-49 <校验值> <文件名>
+                    return algorithm, self.ftp_client.sendcmd(f'HASH {remote_path}').split()[3]
+                except (ftplib.all_errors, IndexError):
+                    break
+        for algorithm, command in (('md5', 'XMD5'), ('crc32', 'XCRC')):
+            if algorithm in algorithms and command in features:
+                try:
+                    return algorithm, self.ftp_client.sendcmd(f'{command} {remote_path}').split()[-1]
+                except ftplib.all_errors:
+                    continue
+        return None
+
+    def download_range(self, rel_path: str, offset: int, size: Optional[int], out, config) -> bool:
+        # 通过 REST 从 offset 处开始 RETR，读满 size 字节后关闭数据连接，size 为 None 时读到文件末尾
+        if self.ftp_client is None:
+            return False
+
+        try:
+            self.ftp_client.voidcmd('TYPE I')
+            conn = self.ftp_client.transfercmd(f'RETR {self.__remote_path(rel_path, config)}', rest=offset or None)
+            remaining = size
+            with conn:
+                while remaining is None or remaining > 0:
+                    data = conn.recv(STREAM_BLOCK_SIZE if remaining is None else min(STREAM_BLOCK_SIZE, remaining))
+                    if not data:
+                        break
+                    out.write(data)
+                    if remaining is not None:
+                        remaining -= len(data)
+            if remaining:
+                raise IOError(f"远程文件长度不足，缺少 {remaining} 字节")
+            try:
+                self.ftp_client.voidresp()
+            except (ftplib.error_temp, ftplib.error_reply):
+                # 提前关闭数据连接时服务器通常回复 426，属于正常情况
+                if size is None:
+                    raise
+            return True
+        except Exception as e:
+            self.server.logger.error(f"下载失败: {str(e)}")
+            return False
+
+    def delete_file(self, rel_path: str, config) -> bool:
+        if self.ftp_client is None:
+            return False
+
+        try:
+            self.ftp_client.delete(self.__remote_path(rel_path, config))
+            return True
+        except Exception as e:
+            self.server.logger.error(f"删除远程文件失败: {str(e)}")
+            return False
+
     def disconnect(self):
         if self.ftp_client:
             try:
@@ -0,0 +1,192 @@
+import os
+import json
+import time
+import threading
+from collections import deque
+from typing import Dict, List, Optional, Tuple
+
+QUEUE_NAME = 'backup_queue.json'
+STAGE_COMPRESS = 'compress'
+STAGE_UPLOAD = 'upload'
+STAGE_NAMES = {STAGE_COMPRESS: '压缩', STAGE_UPLOAD: '上传'}
+# 数值越小越先执行，手动备份优先于定时备份
+PRIORITY_MANUAL = 0
+PRIORITY_SCHEDULE = 1
+TRIGGER_NAMES = {'manual': '手动', 'schedule': '定时'}
+# 统计等待时间时保留的最近任务数
+WAIT_HISTORY = 20
+
+
+class BackupJob:
+    def __init__(self, trigger: str = 'manual', schedule: Optional[dict] = None, priority: Optional[int] = None):
+        self.id = 0
+        self.trigger = trigger
+        self.schedule = schedule
+        self.priority = priority if priority is not None else \
+            (PRIORITY_MANUAL if trigger == 'manual' else PRIORITY_SCHEDULE)
+        self.stage = STAGE_COMPRESS
+        # 进入当前阶段队列的时间与开始执行的时间，未开始时 started 为 None
+        self.enqueued = time.time()
+        self.started: Optional[float] = None
+        # 压缩完成后等待上传的压缩包（去重存储为快照索引），键为实例名，单实例时为空字符串
+        self.archives: Dict[str, str] = {}
+        # 排队期间被合并的重复触发次数
+        self.coalesced = 0
+        # 以下仅在运行期间有效，不写入队列文件
+        self.source = None
+        self.metrics: Dict[str, object] = {}
+
+    @property
+    def key(self) -> str:
+        # 触发方式与定时计划都相同的任务视为重复触发
+        return self.trigger + json.dumps(self.schedule, sort_keys=True)
+
+    def describe(self) -> str:
+        name = TRIGGER_NAMES.get(self.trigger, self.trigger)
+        if self.schedule is not None and self.schedule.get('cron'):
+            name += f"({self.schedule['cron']})"
+        return name
+
+    def to_dict(self) -> dict:
+        return {'id': self.id, 'trigger': self.trigger, 'schedule': self.schedule, 'priority': self.priority,
+                'stage': self.stage, 'enqueued': self.enqueued, 'started': self.started,
+                'archives': self.archives, 'coalesced': self.coalesced}
+
+    @classmethod
+    def from_dict(cls, data: dict) -> 'BackupJob':
+        job = cls(data['trigger'], data.get('schedule'), data.get('priority'))
+        job.id = data['id']
+        job.stage = data.get('stage', STAGE_COMPRESS)
+        job.enqueued = data.get('enqueued', time.time())
+        # 队列文件中记录的 started 表示上次加载时正在执行，工作线程已在卸载时停止，该阶段重新开始
+        job.archives = data.get('archives') or ({'': data['archive']} if data.get('archive') else {})
+        job.coalesced = data.get('coalesced', 0)
+        return job
+
+
+class JobQueue:
+    """
+    持久化的备份任务队列，任务依次经过压缩与上传两个阶段，每个阶段由一个工作线程按 (优先级, 入队时间) 取出任务
+    上一个备份上传时下一个备份即可开始压缩；排队中的重复触发会合并为一个任务
+    插件重载或服务器重启后，未完成的任务从队列文件恢复，执行到一半的阶段重新开始
+    卸载时先关闭队列（不再取出任务）并等待工作线程退出，再保存状态并释放队列文件；
+    释放后不再写入，避免未能及时退出的工作线程覆盖重载后新队列写入的内容
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.condition = threading.Condition()
+        self.jobs: List[BackupJob] = []
+        self.next_id = 1
+        self.closed = False
+        self.released = False
+        self.waits: Dict[str, deque] = {stage: deque(maxlen=WAIT_HISTORY) for stage in STAGE_NAMES}
+        self.__load()
+
+    def __load(self):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            self.jobs = [BackupJob.from_dict(job) for job in data.get('jobs', [])]
+            self.next_id = data.get('next_id', 1)
+        except (OSError, ValueError, KeyError):
+            self.jobs = []
+        # 等待上传但压缩包已不存在的任务无法继续
+        for job in self.jobs:
+            job.archives = {name: path for name, path in job.archives.items() if os.path.exists(path)}
+        self.jobs = [job for job in self.jobs if job.stage != STAGE_UPLOAD or job.archives]
+
+    def __save(self):
+        if self.released:
+            return
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'next_id': self.next_id, 'jobs': [job.to_dict() for job in self.jobs]}, f,
+                      ensure_ascii=False, separators=(',', ':'))
+        os.replace(tmp_path, self.path)
+
+    def submit(self, job: BackupJob) -> Tuple[BackupJob, bool]:
+        # 返回 (实际排队的任务, 是否与已有任务合并)
+        with self.condition:
+            for existing in self.jobs:
+                if existing.stage == STAGE_COMPRESS and existing.started is None and existing.key == job.key:
+                    existing.coalesced += 1
+                    self.__save()
+                    return existing, True
+            job.id = self.next_id
+            self.next_id += 1
+            self.jobs.append(job)
+            self.__save()
+            self.condition.notify_all()
+            return job, False
+
+    def take(self, stage: str, timeout: Optional[float] = None) -> Optional[BackupJob]:
+        # 取出该阶段优先级最高的等待任务，超时或队列关闭时返回 None
+        with self.condition:
+            deadline = time.time() + timeout if timeout is not None else None
+            while not self.closed:
+                waiting = self.waiting(stage)
+                if waiting:
+                    job = waiting[0]
+                    job.started = time.time()
+                    self.waits[stage].append(job.started - job.enqueued)
+                    self.__save()
+                    return job
+                remaining = deadline - time.time() if deadline is not None else None
+                if remaining is not None and remaining <= 0:
+                    return None
+                self.condition.wait(remaining)
+            return None
+
+    def advance(self, job: BackupJob, archives: Dict[str, str]):
+        # 压缩完成，转入上传队列
+        with self.condition:
+            job.stage = STAGE_UPLOAD
+            job.archives = archives
+            job.enqueued = time.time()
+            job.started = None
+            self.__save()
+            self.condition.notify_all()
+
+    def finish(self, job: BackupJob):
+        with self.condition:
+            if job in self.jobs:
+                self.jobs.remove(job)
+                self.__save()
+
+    def waiting(self, stage: str) -> List[BackupJob]:
+        with self.condition:
+            return sorted((job for job in self.jobs if job.stage == stage and job.started is None),
+                          key=lambda job: (job.priority, job.enqueued, job.id))
+
+    def running(self, stage: str) -> Optional[BackupJob]:
+        with self.condition:
+            return next((job for job in self.jobs if job.stage == stage and job.started is not None), None)
+
+    def position(self, job: BackupJob) -> int:
+        # 压缩阶段排在该任务之前的任务数（含正在执行的任务）
+        with self.condition:
+            waiting = self.waiting(STAGE_COMPRESS)
+            ahead = waiting.index(job) if job in waiting else 0
+            return ahead + (1 if self.running(STAGE_COMPRESS) is not None else 0)
+
+    def archives(self) -> List[str]:
+        # 已压缩、尚未上传完成的压缩包，清理本地旧备份时需要保留
+        with self.condition:
+            return [path for job in self.jobs if job.stage == STAGE_UPLOAD for path in job.archives.values()]
+
+    def average_wait(self, stage: str) -> Optional[float]:
+        with self.condition:
+            waits = self.waits[stage]
+            return sum(waits) / len(waits) if waits else None
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+    def release(self):
+        # 保存当前状态（含执行中的任务）后停止写入队列文件
+        with self.condition:
+            self.__save()
+            self.released = True
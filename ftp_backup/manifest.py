@@ -0,0 +1,148 @@
+import os
+import json
+import hashlib
+from typing import Dict, List, Optional
+
+# 压缩包内的清单文件名，随备份一同上传，远程备份可自描述
+MANIFEST_NAME = '.ftp_backup_manifest.json'
+# 本地清单副本后缀，下次备份时直接读取，无需打开压缩包
+MANIFEST_SUFFIX = '.manifest.json'
+HASH_BLOCK_SIZE = 1024 * 1024
+
+BACKUP_FULL = 'full'
+BACKUP_INCREMENTAL = 'incremental'
+BACKUP_DIFFERENTIAL = 'differential'
+
+
+class FileEntry:
+    def __init__(self, size: int, mtime_ns: int, digest: Optional[str] = None):
+        self.size = size
+        self.mtime_ns = mtime_ns
+        self.digest = digest
+
+    def same_stat(self, other: 'FileEntry') -> bool:
+        return self.size == other.size and self.mtime_ns == other.mtime_ns
+
+    def to_list(self) -> list:
+        return [self.size, self.mtime_ns, self.digest]
+
+    @classmethod
+    def from_list(cls, data: list) -> 'FileEntry':
+        return cls(data[0], data[1], data[2] if len(data) > 2 else None)
+
+
+class BackupManifest:
+    def __init__(self, name: str, backup_type: str = BACKUP_FULL,
+                 base: Optional[str] = None, parent: Optional[str] = None,
+                 chain_length: int = 0):
+        self.name = name
+        self.backup_type = backup_type
+        # 所属全量备份与上一次备份的文件名，全量备份两者均为 None
+        self.base = base
+        self.parent = parent
+        self.chain_length = chain_length
+        # files 记录备份时刻服务器目录的完整状态，changed / deleted 为本次压缩包的实际内容
+        self.files: Dict[str, FileEntry] = {}
+        self.changed: List[str] = []
+        self.deleted: List[str] = []
+        # changed 中只保存了变化区块的区域文件，恢复时需与更早的版本合并
+        self.deltas: List[str] = []
+
+    @property
+    def root(self) -> str:
+        return self.base or self.name
+
+    def to_dict(self) -> dict:
+        return {
+            'name': self.name,
+            'type': self.backup_type,
+            'base': self.base,
+            'parent': self.parent,
+            'chain_length': self.chain_length,
+            'files': {path: entry.to_list() for path, entry in self.files.items()},
+            'changed': self.changed,
+            'deleted': self.deleted,
+            'deltas': self.deltas,
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> 'BackupManifest':
+        manifest = cls(data['name'], data.get('type', BACKUP_FULL), data.get('base'),
+                       data.get('parent'), data.get('chain_length', 0))
+        manifest.files = {path: FileEntry.from_list(entry) for path, entry in data.get('files', {}).items()}
+        manifest.changed = data.get('changed', [])
+        manifest.deleted = data.get('deleted', [])
+        manifest.deltas = data.get('deltas', [])
+        return manifest
+
+    def dumps(self) -> str:
+        return json.dumps(self.to_dict(), ensure_ascii=False, separators=(',', ':'))
+
+    def save(self, path: str):
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(self.dumps())
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> 'BackupManifest':
+        with open(path, 'r', encoding='utf-8') as f:
+            return cls.from_dict(json.load(f))
+
+
+def manifest_path(backup_path: str) -> str:
+    return backup_path + MANIFEST_SUFFIX
+
+
+def file_digest(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(HASH_BLOCK_SIZE)
+            if not chunk:
+                break
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def load_manifest(backup_dir: str, name: str) -> Optional[BackupManifest]:
+    # 流式上传且不保留本地副本时只有清单文件，同样可作为增量备份的参考
+    path = manifest_path(os.path.join(backup_dir, name))
+    if not os.path.isfile(path):
+        return None
+    try:
+        return BackupManifest.load(path)
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def load_latest_manifest(backup_dir: str) -> Optional[BackupManifest]:
+    # 备份文件名以时间戳开头，按名称倒序即为时间倒序
+    names = sorted((f[:-len(MANIFEST_SUFFIX)] for f in os.listdir(backup_dir)
+                    if f.endswith(MANIFEST_SUFFIX)), reverse=True)
+    for name in names:
+        manifest = load_manifest(backup_dir, name)
+        if manifest is not None:
+            return manifest
+    return None
+
+
+def diff_files(current: Dict[str, FileEntry], reference: Dict[str, FileEntry],
+               root: str, use_hash: bool = False):
+    """
+    对比当前文件状态与参考清单，返回 (变更文件列表, 删除文件列表)
+    启用哈希时，大小或修改时间变化但内容一致的文件不计为变更
+    """
+    changed = []
+    for path, entry in current.items():
+        old = reference.get(path)
+        if old is not None and entry.same_stat(old):
+            entry.digest = old.digest
+            continue
+        if use_hash:
+            entry.digest = file_digest(os.path.join(root, path))
+            if old is not None and old.digest is not None and old.digest == entry.digest:
+                continue
+        changed.append(path)
+    deleted = [path for path in reference if path not in current]
+    return changed, deleted
@@ -0,0 +1,188 @@
+import os
+import json
+import time
+import threading
+from contextlib import contextmanager
+from typing import Dict, Optional
+
+HISTORY_NAME = 'backup_metrics.jsonl'
+STATUS_SUCCESS = 'success'
+STATUS_FAILED = 'failed'
+STATUS_ABORTED = 'aborted'
+STATUS_UPLOAD_FAILED = 'upload_failed'
+PHASE_NAMES = {'stop_wait': '等待停服', 'save_wait': '等待保存', 'staging': '创建暂存副本', 'scan': '扫描文件',
+               'compress': '压缩', 'upload': '上传', 'cleanup': '清理旧备份', 'startup': '服务器启动'}
+
+
+def format_eta(seconds: float) -> str:
+    seconds = int(seconds)
+    if seconds >= 3600:
+        return f"{seconds // 3600} 小时 {seconds % 3600 // 60} 分"
+    if seconds >= 60:
+        return f"{seconds // 60} 分 {seconds % 60} 秒"
+    return f"{seconds} 秒"
+
+
+class BackupMetrics:
+    """
+    单次备份的各阶段耗时与字节计数，阶段包括 stop_wait、save_wait、staging、scan、compress、upload、cleanup、startup
+    同一阶段多次进入时耗时累加，当前阶段与开始时间用于查询实时进度
+    """
+
+    def __init__(self, trigger: str = 'manual'):
+        self.trigger = trigger
+        self.started = time.time()
+        self.phases: Dict[str, float] = {}
+        self.current_phase: Optional[str] = None
+        self.phase_started = 0.0
+        self.status = STATUS_FAILED
+        self.name = ''
+        self.backup_type = ''
+        self.files = 0
+        self.source_bytes = 0
+        self.archive_bytes = 0
+        self.uploaded_bytes = 0
+        self.pause_seconds = 0.0
+        # 上传开始时上传令牌桶的累计字节数，用于计算实时上传进度
+        self.upload_baseline = 0
+        # 同时上传的目标数，令牌桶统计的是所有目标的合计字节数
+        self.upload_targets = 1
+
+    @contextmanager
+    def phase(self, name: str):
+        # 嵌套阶段结束后恢复外层阶段的名称与开始时间
+        previous, previous_started = self.current_phase, self.phase_started
+        started = time.time()
+        self.current_phase, self.phase_started = name, started
+        try:
+            yield
+        finally:
+            self.add_phase(name, time.time() - started)
+            self.current_phase, self.phase_started = previous, previous_started
+
+    def add_phase(self, name: str, seconds: float):
+        self.phases[name] = self.phases.get(name, 0.0) + seconds
+
+    def phase_elapsed(self) -> float:
+        return time.time() - self.phase_started
+
+    def phase_name(self) -> str:
+        return PHASE_NAMES.get(self.current_phase, self.current_phase or '准备中')
+
+    def to_record(self) -> dict:
+        duration = time.time() - self.started
+        compress = self.phases.get('compress', 0.0)
+        upload = self.phases.get('upload', 0.0)
+        return {
+            'name': self.name,
+            'trigger': self.trigger,
+            'status': self.status,
+            'backup_type': self.backup_type,
+            'started': time.strftime('%Y-%m-%dT%H:%M:%S%z', time.localtime(self.started)),
+            'timestamp': round(self.started, 3),
+            'duration': round(duration, 3),
+            'pause_seconds': round(self.pause_seconds, 3),
+            'phases': {name: round(seconds, 3) for name, seconds in self.phases.items()},
+            'files': self.files,
+            'source_bytes': self.source_bytes,
+            'archive_bytes': self.archive_bytes,
+            'uploaded_bytes': self.uploaded_bytes,
+            'compression_ratio': round(self.archive_bytes / self.source_bytes, 4) if self.source_bytes else None,
+            'compress_bytes_per_second': round(self.source_bytes / compress) if compress else None,
+            'upload_bytes_per_second': round(self.uploaded_bytes / upload) if upload else None,
+        }
+
+
+class MetricsRecorder:
+    """
+    每次备份结束后向 JSON Lines 历史文件追加一条记录，并可写出 Prometheus 文本格式的指标文件，
+    供 node_exporter 的 textfile collector 采集；指标文件先写入临时文件再替换，避免采集到写了一半的内容
+    """
+
+    def __init__(self, server, config, backup_dir: str):
+        self.server = server
+        self.config = config
+        self.history_path = os.path.join(backup_dir, HISTORY_NAME)
+        self.lock = threading.Lock()
+        self.runs: Dict[str, int] = {}
+        self.last_success = 0.0
+        self.__load_counters()
+
+    def __load_counters(self):
+        # 计数器从历史文件恢复，插件重载后不会归零
+        if not os.path.exists(self.history_path):
+            return
+        try:
+            with open(self.history_path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue
+                    self.runs[record['status']] = self.runs.get(record['status'], 0) + 1
+                    if record['status'] == STATUS_SUCCESS:
+                        self.last_success = max(self.last_success, record.get('timestamp', 0))
+        except OSError:
+            pass
+
+    def finish(self, metrics: BackupMetrics):
+        record = metrics.to_record()
+        with self.lock:
+            self.runs[metrics.status] = self.runs.get(metrics.status, 0) + 1
+            if metrics.status == STATUS_SUCCESS:
+                self.last_success = metrics.started
+            try:
+                if self.config.metrics_history:
+                    with open(self.history_path, 'a', encoding='utf-8') as f:
+                        f.write(json.dumps(record, ensure_ascii=False, separators=(',', ':')) + '\n')
+                if self.config.prometheus_textfile:
+                    self.__write_textfile(record)
+            except OSError as e:
+                self.server.logger.error(f"写入备份指标失败: {str(e)}")
+        self.server.logger.info(
+            f"§7备份指标: 总耗时 {record['duration']:.1f} 秒，" +
+            "，".join(f"{PHASE_NAMES.get(name, name)} {seconds:.1f} 秒" for name, seconds in record['phases'].items()))
+
+    def __write_textfile(self, record: dict):
+        lines = []
+
+        def metric(name: str, metric_type: str, help_text: str, samples):
+            lines.append(f"# HELP ftp_backup_{name} {help_text}")
+            lines.append(f"# TYPE ftp_backup_{name} {metric_type}")
+            for labels, value in samples:
+                label_text = ','.join(f'{k}="{v}"' for k, v in labels.items())
+                lines.append(f"ftp_backup_{name}{{{label_text}}} {value}" if label_text else f"ftp_backup_{name} {value}")
+
+        metric('runs_total', 'counter', 'Number of finished backup runs by status.',
+               [({'status': status}, count) for status, count in sorted(self.runs.items())])
+        metric('last_run_timestamp_seconds', 'gauge', 'Start time of the last backup run.',
+               [({}, record['timestamp'])])
+        metric('last_success_timestamp_seconds', 'gauge', 'Start time of the last successful backup run.',
+               [({}, round(self.last_success, 3))])
+        metric('last_run_success', 'gauge', 'Whether the last backup run succeeded.',
+               [({}, int(record['status'] == STATUS_SUCCESS))])
+        metric('last_duration_seconds', 'gauge', 'Wall time of the last backup run.',
+               [({}, record['duration'])])
+        metric('last_pause_seconds', 'gauge', 'Server downtime or save-off time of the last backup run.',
+               [({}, record['pause_seconds'])])
+        metric('last_phase_duration_seconds', 'gauge', 'Time spent in each phase of the last backup run.',
+               [({'phase': name}, seconds) for name, seconds in sorted(record['phases'].items())])
+        metric('last_files', 'gauge', 'Files written by the last backup run.', [({}, record['files'])])
+        metric('last_bytes', 'gauge', 'Bytes processed by the last backup run.',
+               [({'kind': 'source'}, record['source_bytes']), ({'kind': 'archive'}, record['archive_bytes']),
+                ({'kind': 'uploaded'}, record['uploaded_bytes'])])
+        if record['compression_ratio'] is not None:
+            metric('last_compression_ratio', 'gauge', 'Archive size divided by source size.',
+                   [({}, record['compression_ratio'])])
+        throughput = [({'phase': phase}, record[key]) for phase, key in
+                      (('compress', 'compress_bytes_per_second'), ('upload', 'upload_bytes_per_second'))
+                      if record[key] is not None]
+        if throughput:
+            metric('last_throughput_bytes_per_second', 'gauge', 'Throughput of the last backup run by phase.',
+                   throughput)
+
+        path = self.config.prometheus_textfile
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8', newline='\n') as f:
+            f.write('\n'.join(lines) + '\n')
+        os.replace(tmp_path, path)
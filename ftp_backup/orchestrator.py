@@ -0,0 +1,190 @@
+import os
+import copy
+import time
+import posixpath
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+from mcdreforged.api.all import PluginServerInterface
+from .backup_util import BackupManager
+from .compressor import resolve_workers
+from .metrics import BackupMetrics
+from .throttle import FairShare, TokenBucket
+
+INSTANCE_IDLE = 'idle'
+INSTANCE_WAITING = 'waiting'
+INSTANCE_COMPRESS = 'compress'
+INSTANCE_COMPRESSED = 'compressed'
+INSTANCE_UPLOAD = 'upload'
+INSTANCE_DONE = 'done'
+INSTANCE_FAILED = 'failed'
+INSTANCE_STATE_NAMES = {INSTANCE_IDLE: '空闲', INSTANCE_WAITING: '等待开始', INSTANCE_COMPRESS: '压缩中',
+                        INSTANCE_COMPRESSED: '等待上传', INSTANCE_UPLOAD: '上传中', INSTANCE_DONE: '已完成',
+                        INSTANCE_FAILED: '失败'}
+# 实例设置中不能覆盖的字段，path 与 name 单独处理；各实例共用主目标的连接池，连接设置只能全局配置
+RESERVED_KEYS = ('server_dir', 'destinations', 'instance_concurrency', 'instance_stagger',
+                 'protocol', 'host', 'port', 'username', 'password', 'private_key_path')
+# 等待错开的开始时间时检查终止信号的间隔
+STAGGER_POLL_INTERVAL = 0.5
+
+
+def instance_concurrency(config, count: int) -> int:
+    return min(config.instance_concurrency, count) if config.instance_concurrency > 0 else count
+
+
+def instance_configs(config) -> List[Tuple[str, object]]:
+    """
+    server_dir 为字符串时只有一个实例（名称为空），直接使用全局配置
+    为列表时每项为目录路径，或 {"path": ..., "name": ...} 加上覆盖全局设置的其他字段；
+    各实例的本地备份目录与远程路径默认为全局设置下以实例名命名的子目录，压缩线程数在同时备份的实例间平分
+    """
+    if isinstance(config.server_dir, str):
+        return [('', config)]
+    entries = [{'path': entry} if isinstance(entry, str) else dict(entry) for entry in config.server_dir]
+    if not entries:
+        raise ValueError("server_dir 列表为空")
+    workers = max(resolve_workers(config.compress_workers) // instance_concurrency(config, len(entries)), 1)
+    result = []
+    for entry in entries:
+        if not entry.get('path'):
+            raise ValueError(f"server_dir 中的实例缺少 path: {entry}")
+        path = entry.pop('path')
+        name = entry.pop('name', None) or os.path.basename(os.path.normpath(path))
+        if name in (n for n, _ in result):
+            raise ValueError(f"实例名重复: {name}，请为实例设置不同的 name")
+        instance = copy.copy(config)
+        instance.server_dir = path
+        instance.compress_workers = workers
+        instance.local_path = os.path.join(config.local_path, name)
+        instance.remote_path = posixpath.join(config.remote_path, name)
+        if config.prometheus_textfile:
+            root, ext = os.path.splitext(config.prometheus_textfile)
+            instance.prometheus_textfile = f"{root}_{name}{ext}"
+        for key, value in entry.items():
+            if key in RESERVED_KEYS:
+                raise ValueError(f"实例不能单独设置: {key}")
+            if not hasattr(config, key):
+                raise ValueError(f"未知的实例设置: {key}")
+            setattr(instance, key, value)
+        result.append((name, instance))
+    return result
+
+
+class BackupInstance:
+    # 一个世界或服务器实例：独立的备份目录、清单链、备份目录数据库与上传目标，以及最近一次备份的进度与耗时
+    def __init__(self, name: str, config, backup_manager: BackupManager):
+        self.name = name
+        self.config = config
+        self.backup_manager = backup_manager
+        # 以下由 CommandHandler 根据实例配置创建
+        self.remote_index = None
+        self.destinations = []
+        self.metrics_recorder = None
+        self.metrics: Optional[BackupMetrics] = None
+        self.state = INSTANCE_IDLE
+        self.last_duration = 0.0
+
+    @property
+    def label(self) -> str:
+        return f"[{self.name}] " if self.name else ''
+
+
+def create_instances(server: PluginServerInterface, config) -> List[BackupInstance]:
+    return [BackupInstance(name, instance_config, BackupManager(server, instance_config))
+            for name, instance_config in instance_configs(config)]
+
+
+def update_instances(server: PluginServerInterface, instances: List[BackupInstance],
+                     config) -> List[BackupInstance]:
+    # 重载配置时同名实例沿用原有的 BackupManager，新增的实例新建，移除的实例关闭其备份目录数据库
+    existing = {instance.name: instance for instance in instances}
+    result = []
+    for name, instance_config in instance_configs(config):
+        instance = existing.pop(name, None)
+        if instance is None:
+            instance = BackupInstance(name, instance_config, BackupManager(server, instance_config))
+        else:
+            instance.config = instance_config
+            instance.backup_manager.update_config(instance_config)
+        result.append(instance)
+    for instance in existing.values():
+        instance.backup_manager.catalog.close()
+    return result
+
+
+class BackupOrchestrator:
+    """
+    多实例备份：所有实例共用一个大小为 instance_concurrency 的线程池，
+    按上次压缩耗时从长到短依次开始（缩短整体备份窗口），相邻两个实例的开始时间至少间隔 instance_stagger 秒
+    （服务器仍处于停服或暂停保存状态时不错开，避免延长停机时间）；
+    同时进行的实例平分读取限速，上传共用全局上传令牌桶，压缩线程数已在 instance_configs 中平分
+    """
+
+    def __init__(self, server: PluginServerInterface, config):
+        self.server = server
+        self.config = config
+        self.lock = threading.Lock()
+        self.next_start = 0.0
+        self.stagger = 0
+        self.aborted = False
+
+    def __ordered(self, instances: List[BackupInstance]) -> List[BackupInstance]:
+        return sorted(instances, key=lambda instance: -instance.last_duration)
+
+    def __pool(self, count: int) -> ThreadPoolExecutor:
+        return ThreadPoolExecutor(max_workers=instance_concurrency(self.config, count),
+                                  thread_name_prefix='ftp_backup_instance')
+
+    def stage(self, instances: List[BackupInstance]) -> Dict[str, str]:
+        # 停服或暂停保存期间并行创建各实例的暂存副本，不错开开始时间以尽快恢复服务器
+        with self.__pool(len(instances)) as executor:
+            paths = list(executor.map(lambda instance: instance.backup_manager.stage_snapshot(), instances))
+        return {instance.name: path for instance, path in zip(instances, paths)}
+
+    def __wait_turn(self) -> bool:
+        with self.lock:
+            now = time.monotonic()
+            start = max(now, self.next_start)
+            self.next_start = start + self.stagger
+        while not self.aborted and time.monotonic() < start:
+            time.sleep(min(start - time.monotonic(), STAGGER_POLL_INTERVAL))
+        return not self.aborted
+
+    def __backup(self, instance: BackupInstance, fair_share: Optional[FairShare],
+                 source_dir: Optional[str]) -> Optional[str]:
+        if not self.__wait_turn():
+            instance.state = INSTANCE_FAILED
+            return None
+        instance.state = INSTANCE_COMPRESS
+        limiter = fair_share.join() if fair_share is not None else None
+        started = time.time()
+        try:
+            path = instance.backup_manager.create_backup(None, limiter, source_dir, instance.metrics)
+        finally:
+            if limiter is not None:
+                limiter.leave()
+        instance.last_duration = time.time() - started
+        instance.state = INSTANCE_COMPRESSED if path is not None else INSTANCE_FAILED
+        if path is not None:
+            self.server.logger.info(f"§a{instance.label}压缩完成，耗时 {instance.last_duration:.1f} 秒")
+        return path
+
+    def run(self, instances: List[BackupInstance], read_limiter: Optional[TokenBucket],
+            source_dirs: Dict[str, str], stagger: bool = True) -> Dict[str, Optional[str]]:
+        # 返回各实例的备份路径，失败或被终止的实例为 None；终止标志由调用方在任务开始时清除
+        self.next_start = time.monotonic()
+        self.stagger = self.config.instance_stagger if stagger else 0
+        fair_share = FairShare(read_limiter) if read_limiter is not None else None
+        for instance in instances:
+            instance.state = INSTANCE_WAITING
+        ordered = self.__ordered(instances)
+        with self.__pool(len(ordered)) as executor:
+            paths = list(executor.map(
+                lambda instance: self.__backup(instance, fair_share, source_dirs.get(instance.name)), ordered))
+        return {instance.name: path for instance, path in zip(ordered, paths)}
+
+    def abort(self, instances: List[BackupInstance]):
+        # 尚未开始的实例不再开始，进行中的实例终止压缩
+        self.aborted = True
+        for instance in instances:
+            instance.backup_manager.abort_backup_process()
@@ -0,0 +1,179 @@
+import os
+import json
+import zlib
+import base64
+import struct
+from array import array
+from typing import Dict, List, Optional, Tuple
+from .throttle import TokenBucket, throttled
+
+# 区域文件(.mca)由 8 KB 文件头（1024 个区块的位置表与时间戳表）和以 4 KB 扇区对齐的区块数据组成
+REGION_SUFFIX = '.mca'
+# 压缩包中只保存变化区块的成员后缀，恢复时与备份链中更早的版本合并为完整的区域文件
+DELTA_SUFFIX = '.chunkdelta'
+# 本地记录每个区域文件各区块时间戳与 CRC 的文件后缀，下次备份时据此判断区块是否变化
+REGION_STATE_SUFFIX = '.regions'
+SECTOR_SIZE = 4096
+CHUNKS_PER_REGION = 1024
+HEADER_SIZE = 2 * SECTOR_SIZE
+READ_BLOCK_SIZE = 1024 * 1024
+DELTA_MAGIC = b'FBRD\x01'
+DELTA_HEADER = struct.Struct('>5sQ')
+CHUNK_ABSENT = 0
+CHUNK_UNCHANGED = 1
+CHUNK_STORED = 2
+# 变化区块超过文件大小的该比例时直接保存完整文件，差量已无明显收益
+MAX_DELTA_RATIO = 0.5
+
+
+class RegionFormatError(Exception):
+    pass
+
+
+def is_region_file(rel_path: str) -> bool:
+    return rel_path.endswith(REGION_SUFFIX)
+
+
+def region_state_path(backup_path: str) -> str:
+    return backup_path + REGION_STATE_SUFFIX
+
+
+def read_file(path: str, limiter: Optional[TokenBucket] = None) -> bytes:
+    # 分块读取，限速时按块消耗令牌
+    blocks = []
+    with open(path, 'rb') as f:
+        reader = throttled(f, limiter)
+        while True:
+            block = reader.read(READ_BLOCK_SIZE)
+            if not block:
+                break
+            blocks.append(block)
+    return b''.join(blocks)
+
+
+def parse_region(data: bytes) -> Tuple[bytes, List[Optional[memoryview]]]:
+    """
+    解析区域文件，返回 (8 KB 文件头, 每个区块的原始记录)
+    区块记录包含 4 字节长度、1 字节压缩方式与压缩后的数据，不含扇区末尾的填充；未生成的区块为 None
+    """
+    if len(data) < HEADER_SIZE:
+        if data:
+            raise RegionFormatError("文件头不完整")
+        # 服务器刚创建的空区域文件
+        return bytes(HEADER_SIZE), [None] * CHUNKS_PER_REGION
+    view = memoryview(data)
+    chunks = []
+    for i in range(CHUNKS_PER_REGION):
+        location = struct.unpack_from('>I', data, i * 4)[0]
+        offset, count = location >> 8, location & 0xFF
+        if offset == 0 or count == 0:
+            chunks.append(None)
+            continue
+        start = offset * SECTOR_SIZE
+        if offset < 2 or start + 5 > len(data):
+            raise RegionFormatError(f"区块 {i} 的位置超出文件范围")
+        length = struct.unpack_from('>I', data, start)[0]
+        if length == 0 or 4 + length > count * SECTOR_SIZE or start + 4 + length > len(data):
+            raise RegionFormatError(f"区块 {i} 的长度无效")
+        chunks.append(view[start:start + 4 + length])
+    return bytes(data[:HEADER_SIZE]), chunks
+
+
+def fingerprint(header: bytes, chunks: List[Optional[memoryview]]) -> bytes:
+    # 每个区块记录 (时间戳, CRC-32)，未生成的区块为 (0, 0)
+    table = array('I', bytes(CHUNKS_PER_REGION * 8))
+    for i, chunk in enumerate(chunks):
+        if chunk is None:
+            continue
+        table[i * 2] = struct.unpack_from('>I', header, SECTOR_SIZE + i * 4)[0]
+        table[i * 2 + 1] = zlib.crc32(chunk) or 1
+    return table.tobytes()
+
+
+def make_delta(data: bytes, previous: bytes) -> Tuple[Optional[bytes], bytes]:
+    """
+    对比区域文件与上一次备份时的区块指纹，返回 (差量数据, 当前指纹)
+    时间戳与 CRC 均未变的区块只记录为未变化，差量不划算时返回的差量数据为 None
+    """
+    header, chunks = parse_region(data)
+    current = fingerprint(header, chunks)
+    if not data:
+        return None, current
+    new, old = array('I'), array('I')
+    new.frombytes(current)
+    old.frombytes(previous)
+    states = bytearray(CHUNKS_PER_REGION)
+    stored = []
+    stored_size = 0
+    for i, chunk in enumerate(chunks):
+        if chunk is None:
+            continue
+        if new[i * 2] == old[i * 2] and new[i * 2 + 1] == old[i * 2 + 1]:
+            states[i] = CHUNK_UNCHANGED
+        else:
+            states[i] = CHUNK_STORED
+            stored.append(chunk)
+            stored_size += len(chunk)
+    if stored_size > len(data) * MAX_DELTA_RATIO:
+        return None, current
+    return b''.join([DELTA_HEADER.pack(DELTA_MAGIC, len(data)), header, bytes(states)] + stored), current
+
+
+def apply_delta(base: bytes, delta: bytes) -> bytes:
+    """
+    将差量应用到上一版本的区域文件上，区块按原文件的位置表写回，重建的文件与备份时的文件
+    仅在未使用的扇区内容上可能不同（填充为 0）
+    """
+    magic, size = DELTA_HEADER.unpack_from(delta)
+    if magic != DELTA_MAGIC:
+        raise RegionFormatError("差量格式无效")
+    pos = DELTA_HEADER.size
+    header = delta[pos:pos + HEADER_SIZE]
+    states = delta[pos + HEADER_SIZE:pos + HEADER_SIZE + CHUNKS_PER_REGION]
+    pos += HEADER_SIZE + CHUNKS_PER_REGION
+    _, base_chunks = parse_region(base)
+    out = bytearray(size)
+    out[:HEADER_SIZE] = header
+    for i in range(CHUNKS_PER_REGION):
+        state = states[i]
+        if state == CHUNK_ABSENT:
+            continue
+        if state == CHUNK_STORED:
+            length = struct.unpack_from('>I', delta, pos)[0] + 4
+            chunk = delta[pos:pos + length]
+            pos += length
+        else:
+            chunk = base_chunks[i]
+            if chunk is None:
+                raise RegionFormatError(f"上一版本中缺少区块 {i}")
+        start = (struct.unpack_from('>I', header, i * 4)[0] >> 8) * SECTOR_SIZE
+        if start + len(chunk) > len(out):
+            out.extend(bytes(start + len(chunk) - len(out)))
+        out[start:start + len(chunk)] = chunk
+    return bytes(out)
+
+
+class RegionState:
+    # 一次备份时全部区域文件的区块指纹，随清单保存在本地
+    def __init__(self):
+        self.files: Dict[str, bytes] = {}
+
+    def save(self, path: str):
+        data = {p: base64.b64encode(table).decode('ascii') for p, table in self.files.items()}
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(zlib.compress(json.dumps(data, ensure_ascii=False, separators=(',', ':')).encode('utf-8')))
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> Optional['RegionState']:
+        if not os.path.isfile(path):
+            return None
+        try:
+            with open(path, 'rb') as f:
+                data = json.loads(zlib.decompress(f.read()).decode('utf-8'))
+        except (OSError, ValueError, zlib.error):
+            return None
+        state = cls()
+        state.files = {p: base64.b64decode(table) for p, table in data.items()}
+        return state
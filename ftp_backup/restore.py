@@ -0,0 +1,637 @@
+import io
+import os
+import json
+import zlib
+import queue
+import shutil
+import struct
+import hashlib
+import tarfile
+import zipfile
+import tempfile
+import threading
+from contextlib import nullcontext
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+from .scanner import ExcludeMatcher, scan_directory
+from .codec import ARCHIVE_SUFFIXES, import_zstandard
+from .segmented_upload import PARTS_MANIFEST_SUFFIX
+from .region_delta import DELTA_SUFFIX, apply_delta
+from .manifest import (BackupManifest, FileEntry, MANIFEST_NAME, MANIFEST_SUFFIX, BACKUP_FULL,
+                       BACKUP_DIFFERENTIAL, load_manifest)
+
+# 压缩包成员索引的本地文件后缀，记录每个成员在压缩包中的偏移、大小与校验值
+INDEX_SUFFIX = '.index.json'
+RESTORE_DIR = 'restore_tmp'
+READ_BLOCK_SIZE = 1024 * 1024
+# 首次读取远程压缩包末尾的长度，通常已包含完整的中央目录
+TAIL_SIZE = 256 * 1024
+# 相邻成员间隔小于 RANGE_GAP 时合并为一次范围读取，单次范围读取不超过 MAX_RANGE_SIZE（单个成员更大时除外）
+RANGE_GAP = 1024 * 1024
+MAX_RANGE_SIZE = 64 * 1024 * 1024
+# 范围数据不超过该大小时保存在内存中，否则写入临时文件
+SPOOL_SIZE = 16 * 1024 * 1024
+LOCAL_HEADER = struct.Struct('<4s5H3L2H')
+LOCAL_HEADER_SIGNATURE = b'PK\x03\x04'
+
+
+def index_path(backup_path: str) -> str:
+    return backup_path + INDEX_SUFFIX
+
+
+def arcname(rel_path: str) -> str:
+    return rel_path.replace(os.sep, '/')
+
+
+class MemberEntry:
+    __slots__ = ('offset', 'end', 'compress_size', 'file_size', 'compress_type', 'crc', 'digest')
+
+    def __init__(self, offset: int, end: int, compress_size: int, file_size: int, compress_type: int,
+                 crc: int, digest: Optional[str] = None):
+        # offset 为本地文件头的位置，end 为下一个成员（或中央目录）的起始位置
+        self.offset = offset
+        self.end = end
+        self.compress_size = compress_size
+        self.file_size = file_size
+        self.compress_type = compress_type
+        self.crc = crc
+        self.digest = digest
+
+    def to_list(self) -> list:
+        return [self.offset, self.end, self.compress_size, self.file_size, self.compress_type, self.crc, self.digest]
+
+    @classmethod
+    def from_list(cls, data: list) -> 'MemberEntry':
+        return cls(*data)
+
+
+class MemberIndex:
+    """
+    ZIP 压缩包的成员索引，恢复时只需读取所需成员所在的字节范围
+    可由本地压缩包或远程压缩包末尾的中央目录生成，哈希取自备份清单（启用 manifest_hash 时）
+    """
+
+    def __init__(self, name: str, archive_size: int):
+        self.name = name
+        self.archive_size = archive_size
+        self.members: Dict[str, MemberEntry] = {}
+
+    @classmethod
+    def from_zip(cls, name: str, zf: zipfile.ZipFile, archive_size: int,
+                 manifest: Optional[BackupManifest] = None) -> 'MemberIndex':
+        index = cls(name, archive_size)
+        infos = sorted(zf.infolist(), key=lambda i: i.header_offset)
+        digests = {arcname(p): e.digest for p, e in manifest.files.items()} if manifest is not None else {}
+        for i, info in enumerate(infos):
+            end = infos[i + 1].header_offset if i + 1 < len(infos) else zf.start_dir
+            index.members[info.filename] = MemberEntry(info.header_offset, end, info.compress_size, info.file_size,
+                                                       info.compress_type, info.CRC, digests.get(info.filename))
+        return index
+
+    def to_dict(self) -> dict:
+        return {'name': self.name, 'archive_size': self.archive_size,
+                'members': {name: entry.to_list() for name, entry in self.members.items()}}
+
+    @classmethod
+    def from_dict(cls, data: dict) -> 'MemberIndex':
+        index = cls(data['name'], data['archive_size'])
+        index.members = {name: MemberEntry.from_list(entry) for name, entry in data['members'].items()}
+        return index
+
+    def save(self, path: str):
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.to_dict(), f, ensure_ascii=False, separators=(',', ':'))
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> 'MemberIndex':
+        with open(path, 'r', encoding='utf-8') as f:
+            return cls.from_dict(json.load(f))
+
+
+def build_member_index(archive_path: str, manifest: Optional[BackupManifest] = None) -> MemberIndex:
+    with zipfile.ZipFile(archive_path) as zf:
+        index = MemberIndex.from_zip(os.path.basename(archive_path), zf, os.path.getsize(archive_path), manifest)
+    index.save(index_path(archive_path))
+    return index
+
+
+class _NeedMore(Exception):
+    def __init__(self, offset: int):
+        super().__init__(offset)
+        self.offset = offset
+
+
+class _TailFile:
+    # 只持有压缩包末尾数据的只读文件对象，zipfile 读取更靠前的位置时抛出 _NeedMore
+    def __init__(self, size: int, offset: int, data: bytes):
+        self.size = size
+        self.offset = offset
+        self.data = data
+        self.pos = 0
+
+    def seekable(self) -> bool:
+        return True
+
+    def seek(self, pos: int, whence: int = 0) -> int:
+        base = (0, self.pos, self.size)[whence]
+        if base + pos < 0:
+            raise OSError("无效的偏移")
+        self.pos = base + pos
+        return self.pos
+
+    def tell(self) -> int:
+        return self.pos
+
+    def read(self, n: int = -1) -> bytes:
+        if self.pos < self.offset:
+            raise _NeedMore(self.pos)
+        end = self.size if n is None or n < 0 else min(self.pos + n, self.size)
+        data = self.data[self.pos - self.offset:end - self.offset]
+        self.pos += len(data)
+        return data
+
+    def close(self):
+        pass
+
+
+def read_remote_index(name: str, archive_size: int, fetch: Callable[[int, int], bytes]) -> MemberIndex:
+    # 读取压缩包末尾的中央目录生成成员索引，中央目录超出已读取的范围时向前补读
+    offset = max(archive_size - TAIL_SIZE, 0)
+    while True:
+        data = fetch(offset, archive_size - offset)
+        try:
+            with zipfile.ZipFile(_TailFile(archive_size, offset, data)) as zf:
+                return MemberIndex.from_zip(name, zf, archive_size)
+        except _NeedMore as e:
+            if e.offset >= offset:
+                raise zipfile.BadZipFile("无法读取中央目录")
+            offset = e.offset
+
+
+def plan_ranges(entries: Iterable[Tuple[str, MemberEntry]]) -> List[Tuple[int, int, List[Tuple[str, MemberEntry]]]]:
+    # 按偏移排序并合并相邻成员，返回 [(起始偏移, 结束偏移, 成员列表)]
+    ranges = []
+    for name, entry in sorted(entries, key=lambda item: item[1].offset):
+        if ranges:
+            start, end, members = ranges[-1]
+            if entry.offset - end <= RANGE_GAP and entry.end - start <= MAX_RANGE_SIZE:
+                members.append((name, entry))
+                ranges[-1] = (start, max(end, entry.end), members)
+                continue
+        ranges.append((entry.offset, entry.end, [(name, entry)]))
+    return ranges
+
+
+def extract_member(src, base: int, entry: MemberEntry, dst_path: str):
+    """
+    从 src 中解出一个 ZIP 成员写入 dst_path，src 的位置 0 对应压缩包中的偏移 base
+    校验 CRC-32 与大小，索引中记录了 sha256 时一并校验
+    """
+    src.seek(entry.offset - base)
+    header = src.read(LOCAL_HEADER.size)
+    if len(header) != LOCAL_HEADER.size or header[:4] != LOCAL_HEADER_SIGNATURE:
+        raise IOError("成员文件头损坏")
+    fields = LOCAL_HEADER.unpack(header)
+    src.seek(fields[-2] + fields[-1], 1)
+    if entry.compress_type == zipfile.ZIP_DEFLATED:
+        decompressor = zlib.decompressobj(-15)
+    elif entry.compress_type == zipfile.ZIP_STORED:
+        decompressor = None
+    else:
+        raise IOError(f"不支持的压缩方式: {entry.compress_type}")
+    hasher = hashlib.sha256() if entry.digest else None
+    crc = 0
+    size = 0
+    remaining = entry.compress_size
+    with open(dst_path, 'wb') as out:
+        while remaining > 0:
+            block = src.read(min(READ_BLOCK_SIZE, remaining))
+            if not block:
+                raise IOError("成员数据不完整")
+            remaining -= len(block)
+            data = decompressor.decompress(block) if decompressor is not None else block
+            if decompressor is not None and remaining == 0:
+                data += decompressor.flush()
+            crc = zlib.crc32(data, crc)
+            size += len(data)
+            if hasher is not None:
+                hasher.update(data)
+            out.write(data)
+    if crc != entry.crc or size != entry.file_size:
+        raise IOError("CRC 校验失败")
+    if hasher is not None and hasher.hexdigest() != entry.digest:
+        raise IOError("sha256 校验失败")
+
+
+class PathSelector:
+    # 按 .gitignore 风格的规则选择要恢复的文件，命中目录时选择目录下的全部文件，未指定规则时选择全部
+    def __init__(self, patterns: List[str]):
+        self.matcher = ExcludeMatcher(patterns) if patterns else None
+
+    def __call__(self, rel_path: str) -> bool:
+        if self.matcher is None:
+            return True
+        path = arcname(rel_path)
+        if self.matcher.is_excluded(path):
+            return True
+        parts = path.split('/')
+        return any(self.matcher.is_excluded('/'.join(parts[:i]), True) for i in range(1, len(parts)))
+
+
+class RestorePlan:
+    def __init__(self, name: str, patterns: List[str]):
+        self.name = name
+        self.patterns = patterns
+        # 每个文件从哪个备份中取出，增量/差异备份中未变更的文件来自备份链中更早的备份
+        self.sources: Dict[str, List[str]] = {}
+        self.files: Dict[str, FileEntry] = {}
+        self.removed: List[str] = []
+        # 只保存了变化区块的区域文件，按时间顺序记录需要依次应用差量的备份
+        self.deltas: Dict[str, List[str]] = {}
+
+    @property
+    def total_bytes(self) -> int:
+        return sum(entry.size for entry in self.files.values())
+
+
+class RemoteArchive:
+    # 远程压缩包，分段上传时按分段清单把偏移映射到各个分段文件
+    def __init__(self, name: str, size: int, parts: Optional[List[dict]] = None):
+        self.name = name
+        self.size = size
+        self.parts = parts
+
+    def read_into(self, manager, config, offset: int, size: int, out) -> bool:
+        if self.parts is None:
+            return manager.download_range(self.name, offset, size, out, config)
+        end = offset + size
+        for part in self.parts:
+            start = max(offset, part['offset'])
+            stop = min(end, part['offset'] + part['size'])
+            if start >= stop:
+                continue
+            if not manager.download_range(part['name'], start - part['offset'], stop - start, out, config):
+                return False
+        return True
+
+    def fetch(self, manager, config, offset: int, size: int) -> bytes:
+        buffer = io.BytesIO()
+        if not self.read_into(manager, config, offset, size, buffer):
+            raise IOError(f"读取远程备份失败: {self.name}")
+        return buffer.getvalue()
+
+
+class RestoreAbortedException(Exception):
+    pass
+
+
+class Restorer:
+    """
+    按需恢复备份：根据备份清单确定每个文件所在的备份，ZIP 备份通过成员索引只读取所需的字节范围，
+    远程备份使用 FTP REST / SFTP 偏移读取，多个连接并行下载与解压
+    文件先解出到暂存目录，全部校验通过后再移动到服务器目录，停服时间只包含移动文件的时间
+    """
+
+    def __init__(self, server, config, backup_manager, connection_pool, remote_index):
+        self.server = server
+        self.config = config
+        self.backup_manager = backup_manager
+        self.backup_dir = backup_manager.backup_dir
+        self.connection_pool = connection_pool
+        self.remote_index = remote_index
+        self.staging_dir = os.path.join(self.backup_dir, RESTORE_DIR)
+        self.lock = threading.Lock()
+        self.abort = False
+        self.restored_files = 0
+        self.restored_bytes = 0
+
+    def __remote_files(self) -> Dict[str, Optional[int]]:
+        try:
+            with self.connection_pool.session() as manager:
+                if manager is None:
+                    return {}
+                return self.remote_index.get(manager, self.config)
+        except Exception as e:
+            self.server.logger.error(f"列出远程备份失败: {str(e)}")
+            return {}
+
+    def list_backups(self, include_remote: bool = True) -> List[str]:
+        if self.backup_manager.use_chunk_store():
+            return self.backup_manager.get_chunk_store().list_snapshots()
+        names = {f[:-len(MANIFEST_SUFFIX)] for f in os.listdir(self.backup_dir) if f.endswith(MANIFEST_SUFFIX)}
+        names |= {f for f in os.listdir(self.backup_dir) if f.endswith(ARCHIVE_SUFFIXES)}
+        if include_remote:
+            for name in self.__remote_files():
+                if name.endswith(PARTS_MANIFEST_SUFFIX):
+                    name = name[:-len(PARTS_MANIFEST_SUFFIX)]
+                if name.endswith('.zip'):
+                    names.add(name)
+        return sorted(n for n in names if n.startswith('backup_'))
+
+    def resolve_backup(self, key: str) -> Optional[str]:
+        # 支持完整文件名、时间戳前缀（如 20240101-120000）与 latest
+        names = self.list_backups()
+        if key == 'latest':
+            return names[-1] if names else None
+        if key in names:
+            return key
+        matches = [n for n in names if n.startswith(key) or n.startswith('backup_' + key)]
+        return matches[-1] if matches else None
+
+    def __remote_archive(self, name: str, manager) -> Optional[RemoteArchive]:
+        files = self.remote_index.get(manager, self.config)
+        if name in files:
+            size = files[name]
+            if size is None:
+                size = manager.file_size(name, self.config)
+            return RemoteArchive(name, size) if size is not None else None
+        if name + PARTS_MANIFEST_SUFFIX in files:
+            data = RemoteArchive(name + PARTS_MANIFEST_SUFFIX, 0).fetch(manager, self.config, 0, None)
+            parts = json.loads(data.decode('utf-8'))
+            return RemoteArchive(name, parts['size'], parts['parts'])
+        return None
+
+    def __load_index(self, name: str, manager=None) -> Tuple[MemberIndex, Optional[RemoteArchive]]:
+        local_path = os.path.join(self.backup_dir, name)
+        path = index_path(local_path)
+        if os.path.exists(local_path):
+            if os.path.exists(path):
+                return MemberIndex.load(path), None
+            return build_member_index(local_path, load_manifest(self.backup_dir, name)), None
+        if manager is None:
+            raise ConnectionError("无法连接远程服务器")
+        archive = self.__remote_archive(name, manager)
+        if archive is None:
+            raise FileNotFoundError(f"本地与远程均找不到备份: {name}")
+        if os.path.exists(path):
+            return MemberIndex.load(path), archive
+        self.server.logger.info(f"§6正在读取远程备份的成员索引: {name}")
+        index = read_remote_index(name, archive.size, lambda o, s: archive.fetch(manager, self.config, o, s))
+        index.save(path)
+        return index, archive
+
+    def __load_manifest(self, name: str) -> BackupManifest:
+        manifest = load_manifest(self.backup_dir, name)
+        if manifest is not None:
+            return manifest
+        if not name.endswith('.zip'):
+            raise FileNotFoundError(f"找不到备份清单: {name}")
+        # 没有本地清单副本时读取压缩包中的清单成员，远程备份只读取该成员所在的范围
+        local_path = os.path.join(self.backup_dir, name)
+        with nullcontext() if os.path.exists(local_path) else self.connection_pool.session() as manager, \
+                tempfile.TemporaryDirectory(dir=self.backup_dir) as tmp_dir:
+            index, archive = self.__load_index(name, manager)
+            entry = index.members.get(MANIFEST_NAME)
+            if entry is None:
+                raise FileNotFoundError(f"备份中没有清单: {name}")
+            tmp_path = os.path.join(tmp_dir, MANIFEST_NAME)
+            if archive is None:
+                with open(local_path, 'rb') as f:
+                    extract_member(f, 0, entry, tmp_path)
+            else:
+                data = archive.fetch(manager, self.config, entry.offset, entry.end - entry.offset)
+                extract_member(io.BytesIO(data), entry.offset, entry, tmp_path)
+            return BackupManifest.load(tmp_path)
+
+    def plan(self, name: str, patterns: List[str]) -> RestorePlan:
+        select = PathSelector(patterns)
+        plan = RestorePlan(name, patterns)
+        if self.backup_manager.use_chunk_store():
+            snapshot = self.backup_manager.get_chunk_store().load_snapshot(name)
+            known = snapshot.files
+            plan.files = {path: FileEntry(e.size, e.mtime_ns) for path, e in snapshot.files.items() if select(path)}
+            plan.sources[name] = sorted(plan.files)
+        else:
+            manifest = self.__load_manifest(name)
+            known = manifest.files
+            plan.files = {path: entry for path, entry in manifest.files.items() if select(path)}
+            self.__resolve_sources(plan, manifest)
+        if not plan.files:
+            raise ValueError("没有匹配的文件")
+
+        # 服务器目录中存在但备份时不存在的文件在恢复时删除，被排除的文件不受影响
+        matcher = ExcludeMatcher(self.config.exclude_patterns)
+        plan.removed = [f.rel_path for f in scan_directory(self.config.server_dir, matcher).files
+                        if f.rel_path not in known and select(f.rel_path)]
+        return plan
+
+    def __resolve_sources(self, plan: RestorePlan, manifest: BackupManifest):
+        # 沿备份链向前查找每个文件最后一次被完整写入的备份，途经的区域文件差量按时间顺序记录
+        pending = set(plan.files)
+        current = manifest
+        while pending:
+            found = pending.intersection(current.changed)
+            deltas = found.intersection(current.deltas)
+            for path in deltas:
+                plan.deltas.setdefault(path, []).insert(0, current.name)
+            found -= deltas
+            if found:
+                plan.sources[current.name] = sorted(found)
+                pending -= found
+            if not pending or current.backup_type == BACKUP_FULL:
+                break
+            previous = current.base if current.backup_type == BACKUP_DIFFERENTIAL else current.parent
+            current = self.__load_manifest(previous)
+        if pending:
+            raise FileNotFoundError(f"备份链不完整，{len(pending)} 个文件无法恢复")
+
+    def __check_abort(self):
+        if self.abort:
+            raise RestoreAbortedException("用户终止了恢复")
+
+    def __staged_path(self, rel_path: str) -> str:
+        path = os.path.join(self.staging_dir, rel_path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        return path
+
+    def __run_workers(self, tasks: list, handler: Callable, remote: bool):
+        # 每个工作线程持有一个连接，从队列中依次取出任务；任一任务失败则全部停止
+        pending = queue.Queue()
+        for task in tasks:
+            pending.put(task)
+        errors = []
+
+        def worker():
+            manager = self.connection_pool.acquire() if remote else None
+            try:
+                if remote and manager is None:
+                    raise ConnectionError("无法连接远程服务器")
+                while not errors:
+                    try:
+                        task = pending.get_nowait()
+                    except queue.Empty:
+                        return
+                    self.__check_abort()
+                    handler(task, manager)
+            except Exception as e:
+                errors.append(e)
+            finally:
+                if remote:
+                    self.connection_pool.release(manager)
+
+        workers = max(min(self.config.restore_workers, len(tasks)), 1)
+        threads = [threading.Thread(target=worker, name=f'ftp_backup_restore_{i}', daemon=True)
+                   for i in range(workers)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        if errors:
+            raise errors[0]
+
+    def __finish_file(self, plan: RestorePlan, path: str, staged: str, name: Optional[str] = None):
+        # name 为差量所在的备份，差量解出后合并到已解出的上一版本中；只有最终版本计入进度
+        if name is not None:
+            target = staged[:-len(DELTA_SUFFIX)]
+            with open(target, 'rb') as f:
+                base = f.read()
+            with open(staged, 'rb') as f:
+                data = apply_delta(base, f.read())
+            with open(target, 'wb') as f:
+                f.write(data)
+            os.remove(staged)
+            staged = target
+        entry = plan.files[path]
+        os.utime(staged, ns=(entry.mtime_ns, entry.mtime_ns))
+        if plan.deltas.get(path, [None])[-1] != name:
+            return
+        with self.lock:
+            self.restored_files += 1
+            self.restored_bytes += entry.size
+
+    def __fetch_chunks(self, plan: RestorePlan, paths: List[str]):
+        store = self.backup_manager.get_chunk_store()
+        snapshot = store.load_snapshot(plan.name)
+
+        def restore_file(path, _):
+            staged = self.__staged_path(path)
+            with open(staged, 'wb') as f:
+                for digest in snapshot.files[path].chunks:
+                    f.write(store.read_chunk(digest))
+            self.__finish_file(plan, path, staged)
+
+        self.__run_workers(paths, restore_file, False)
+
+    def __fetch_zip(self, plan: RestorePlan, name: str, paths: List[str], delta: bool = False):
+        local = os.path.exists(os.path.join(self.backup_dir, name))
+        suffix = DELTA_SUFFIX if delta else ''
+        delta_of = name if delta else None
+        with nullcontext() if local else self.connection_pool.session() as manager:
+            index, archive = self.__load_index(name, manager)
+        wanted = []
+        for path in paths:
+            entry = index.members.get(arcname(path) + suffix)
+            if entry is None:
+                raise FileNotFoundError(f"备份 {name} 中缺少 {path}")
+            wanted.append((path, entry))
+
+        if archive is None:
+            local_path = os.path.join(self.backup_dir, name)
+
+            def extract_local(item, _):
+                path, entry = item
+                staged = self.__staged_path(path) + suffix
+                with open(local_path, 'rb') as f:
+                    extract_member(f, 0, entry, staged)
+                self.__finish_file(plan, path, staged, delta_of)
+
+            self.__run_workers(wanted, extract_local, False)
+            return
+
+        def extract_range(task, manager):
+            start, end, members = task
+            with tempfile.SpooledTemporaryFile(max_size=SPOOL_SIZE, dir=self.staging_dir) as buffer:
+                if not archive.read_into(manager, self.config, start, end - start, buffer):
+                    raise IOError(f"读取远程备份失败: {name}")
+                for path, entry in members:
+                    self.__check_abort()
+                    staged = self.__staged_path(path) + suffix
+                    extract_member(buffer, start, entry, staged)
+                    self.__finish_file(plan, path, staged, delta_of)
+
+        ranges = plan_ranges(wanted)
+        self.server.logger.info(f"§b从远程备份 {name} 读取 {len(wanted)} 个文件，合并为 {len(ranges)} 次范围读取")
+        self.__run_workers(ranges, extract_range, True)
+
+    def __fetch_tar(self, plan: RestorePlan, name: str, paths: List[str], delta: bool = False):
+        # tar.zst 无法随机读取，按顺序解压整个压缩包并取出所需文件
+        zstandard = import_zstandard()
+        local_path = os.path.join(self.backup_dir, name)
+        downloaded = None
+        if not os.path.exists(local_path):
+            downloaded = os.path.join(self.staging_dir, name + '.download')
+            with self.connection_pool.session() as manager:
+                if manager is None:
+                    raise ConnectionError("无法连接远程服务器")
+                with open(downloaded, 'wb') as f:
+                    if not manager.download_range(name, 0, None, f, self.config):
+                        raise IOError(f"下载远程备份失败: {name}")
+            local_path = downloaded
+        suffix = DELTA_SUFFIX if delta else ''
+        wanted = {arcname(p) + suffix: p for p in paths}
+        try:
+            with open(local_path, 'rb') as f, zstandard.ZstdDecompressor().stream_reader(f) as reader, \
+                    tarfile.open(fileobj=reader, mode='r|') as tar:
+                for member in tar:
+                    self.__check_abort()
+                    path = wanted.pop(member.name, None)
+                    if path is None or not member.isfile():
+                        continue
+                    staged = self.__staged_path(path) + suffix
+                    with tar.extractfile(member) as src, open(staged, 'wb') as dst:
+                        shutil.copyfileobj(src, dst, READ_BLOCK_SIZE)
+                    self.__finish_file(plan, path, staged, name if delta else None)
+        finally:
+            if downloaded is not None:
+                os.remove(downloaded)
+        if wanted:
+            raise FileNotFoundError(f"备份 {name} 中缺少 {len(wanted)} 个文件")
+
+    def fetch(self, plan: RestorePlan):
+        # 将计划中的文件解出到暂存目录，此时服务器可以继续运行
+        self.abort = False
+        self.restored_files = 0
+        self.restored_bytes = 0
+        self.clear_staging()
+        os.makedirs(self.staging_dir)
+        for name, paths in plan.sources.items():
+            self.__check_abort()
+            if self.backup_manager.use_chunk_store():
+                self.__fetch_chunks(plan, paths)
+            elif name.endswith('.zip'):
+                self.__fetch_zip(plan, name, paths)
+            else:
+                self.__fetch_tar(plan, name, paths)
+        # 完整版本全部解出后，按备份时间顺序依次合并区域文件差量
+        for name in sorted({n for names in plan.deltas.values() for n in names}):
+            self.__check_abort()
+            paths = [path for path, names in plan.deltas.items() if name in names]
+            if name.endswith('.zip'):
+                self.__fetch_zip(plan, name, paths, True)
+            else:
+                self.__fetch_tar(plan, name, paths, True)
+
+    def apply(self, plan: RestorePlan):
+        # 服务器停止后将暂存目录中的文件移动到服务器目录，并删除备份时不存在的文件
+        server_dir = self.config.server_dir
+        for path in plan.files:
+            dst = os.path.join(server_dir, path)
+            os.makedirs(os.path.dirname(dst), exist_ok=True)
+            src = os.path.join(self.staging_dir, path)
+            try:
+                os.replace(src, dst)
+            except OSError:
+                # 暂存目录与服务器目录不在同一文件系统
+                shutil.move(src, dst)
+        for path in plan.removed:
+            try:
+                os.remove(os.path.join(server_dir, path))
+            except FileNotFoundError:
+                pass
+        self.clear_staging()
+
+    def clear_staging(self):
+        if os.path.exists(self.staging_dir):
+            shutil.rmtree(self.staging_dir)
+
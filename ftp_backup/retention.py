@@ -0,0 +1,194 @@
+import os
+import re
+import json
+import time
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+REMOTE_INDEX_NAME = 'remote_backups.json'
+# 备份名以创建时间开头，增量/差异备份带有 _inc/_diff 后缀
+BACKUP_NAME_PATTERN = re.compile(r'backup_(\d{8}-\d{6})(_inc|_diff)?')
+# 远程同一备份的分段、分段清单与本地清单文件归为一组，清理时一并删除
+REMOTE_MEMBER_PATTERN = re.compile(r'(.+?)(?:\.part\d{4}|\.parts\.json|\.manifest\.json)?')
+
+
+def backup_time(name: str) -> Optional[datetime]:
+    m = BACKUP_NAME_PATTERN.match(name)
+    if m is None:
+        return None
+    return datetime.strptime(m.group(1), '%Y%m%d-%H%M%S')
+
+
+def backup_kind(name: str) -> str:
+    m = BACKUP_NAME_PATTERN.match(name)
+    return m.group(2) if m is not None and m.group(2) else ''
+
+
+class RetentionPolicy:
+    """
+    分层(GFS)保留策略：保留最近 keep_last 个备份，另外按小时、天、周、月各保留最近若干个时段中最新的一个备份
+    被保留的增量备份连同其所在备份链中更早的备份一起保留，差异备份连同其基准全量备份一起保留
+    名称中不含时间的文件不会被清理
+    """
+
+    def __init__(self, keep_last: int, hourly: int = 0, daily: int = 0, weekly: int = 0, monthly: int = 0):
+        self.keep_last = keep_last
+        self.tiers = (
+            (hourly, lambda t: (t.year, t.month, t.day, t.hour)),
+            (daily, lambda t: (t.year, t.month, t.day)),
+            (weekly, lambda t: t.isocalendar()[:2]),
+            (monthly, lambda t: (t.year, t.month)),
+        )
+
+    @classmethod
+    def from_config(cls, config, keep_last: int) -> 'RetentionPolicy':
+        return cls(keep_last, config.retention_hourly, config.retention_daily,
+                   config.retention_weekly, config.retention_monthly)
+
+    def select(self, names: Iterable[str]) -> Set[str]:
+        dated = sorted((backup_time(n), n) for n in names if backup_time(n) is not None)
+        keep = set()
+        if self.keep_last > 0:
+            keep.update(n for _, n in dated[-self.keep_last:])
+        for count, period in self.tiers:
+            if count <= 0:
+                continue
+            periods = set()
+            for t, name in reversed(dated):
+                key = period(t)
+                if key in periods:
+                    continue
+                periods.add(key)
+                keep.add(name)
+                if len(periods) >= count:
+                    break
+        return self.__with_dependencies([n for _, n in dated], keep)
+
+    @staticmethod
+    def __with_dependencies(ordered: List[str], keep: Set[str]) -> Set[str]:
+        chain = []
+        result = set(keep)
+        for name in ordered:
+            kind = backup_kind(name)
+            if not kind:
+                chain = [name]
+                continue
+            chain.append(name)
+            if name not in keep:
+                continue
+            if kind == '_inc':
+                result.update(chain)
+            elif chain[0] != name:
+                result.add(chain[0])
+        return result
+
+    def prunable(self, names: Iterable[str]) -> List[str]:
+        # 返回按时间排序的待删除备份
+        names = list(names)
+        keep = self.select(names)
+        return sorted((n for n in names if backup_time(n) is not None and n not in keep), key=backup_time)
+
+
+def group_remote_files(files: Iterable[str]) -> Dict[str, List[str]]:
+    groups = {}
+    for name in files:
+        backup = REMOTE_MEMBER_PATTERN.fullmatch(name).group(1)
+        if backup_time(backup) is not None:
+            groups.setdefault(backup, []).append(name)
+    return groups
+
+
+class RemoteIndex:
+    """
+    远程备份目录的文件列表缓存，通过一次批量列目录(MLSD/NLST 或 listdir_attr)建立并保存在本地
+    上传与删除时同步更新，超过有效期或目标变化后重新列出
+    """
+
+    def __init__(self, path: str, target: str, ttl: int):
+        self.path = path
+        self.target = target
+        self.ttl = ttl
+        self.files: Optional[Dict[str, Optional[int]]] = None
+        self.updated = 0.0
+        self.__load()
+
+    def __load(self):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return
+        if data.get('target') == self.target:
+            self.files = data.get('files', {})
+            self.updated = data.get('updated', 0)
+
+    def save(self):
+        if self.files is None:
+            return
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'target': self.target, 'updated': self.updated, 'files': self.files},
+                      f, ensure_ascii=False, separators=(',', ':'))
+        os.replace(tmp_path, self.path)
+
+    def is_stale(self) -> bool:
+        return self.files is None or time.time() - self.updated > self.ttl
+
+    def refresh(self, manager, config):
+        self.files = manager.list_entries('', config)
+        self.updated = time.time()
+        self.save()
+
+    def get(self, manager, config) -> Dict[str, Optional[int]]:
+        if self.is_stale():
+            self.refresh(manager, config)
+        return self.files
+
+    def add(self, entries: Iterable[Tuple[str, int]]):
+        # 索引尚未建立时不记录，下次使用时整体列出
+        if self.files is None:
+            return
+        for name, size in entries:
+            self.files[name] = size
+        self.save()
+
+    def remove(self, names: Iterable[str]):
+        if self.files is None:
+            return
+        for name in names:
+            self.files.pop(name, None)
+
+    def invalidate(self):
+        self.files = None
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+def prune_remote(index: RemoteIndex, connection_pool, config, logger) -> List[str]:
+    # 按保留策略分批删除远程旧备份，每批完成后保存索引，返回已删除的备份名
+    with connection_pool.session() as manager:
+        if manager is None:
+            logger.error("远程清理失败：无法连接远程服务器")
+            return []
+        groups = group_remote_files(index.get(manager, config))
+        policy = RetentionPolicy.from_config(config, config.keep_remote_backups)
+        expired = policy.prunable(groups)
+        files = [f for backup in expired for f in sorted(groups[backup])]
+        batch_size = max(config.prune_batch_size, 1)
+        failed = set()
+        for i in range(0, len(files), batch_size):
+            deleted = []
+            for name in files[i:i + batch_size]:
+                if manager.delete_file(name, config):
+                    deleted.append(name)
+                else:
+                    failed.add(name)
+            index.remove(deleted)
+            index.save()
+        if failed:
+            # 删除失败通常意味着索引与远程不一致，下次清理时重新列出
+            index.invalidate()
+    removed = [backup for backup in expired if not failed.intersection(groups[backup])]
+    for backup in removed:
+        logger.info(f"§6已清理远程旧备份: {backup}")
+    return removed
@@ -0,0 +1,150 @@
+import os
+import re
+from typing import Iterable, List, Optional
+
+
+class ScannedFile:
+    __slots__ = ('path', 'rel_path', 'size', 'mtime_ns')
+
+    def __init__(self, path: str, rel_path: str, size: int, mtime_ns: int):
+        self.path = path
+        self.rel_path = rel_path
+        self.size = size
+        self.mtime_ns = mtime_ns
+
+
+class ScanResult:
+    def __init__(self):
+        self.files: List[ScannedFile] = []
+        self.total_bytes = 0
+
+    @property
+    def total_files(self) -> int:
+        return len(self.files)
+
+
+def translate_glob(pattern: str) -> str:
+    # 将 gitignore 风格的通配符转换为正则，* 与 ? 不跨越目录，** 可匹配任意层级
+    i, n = 0, len(pattern)
+    res = []
+    while i < n:
+        c = pattern[i]
+        if c == '*':
+            if pattern.startswith('**/', i):
+                res.append('(?:.*/)?')
+                i += 3
+                continue
+            if pattern.startswith('**', i):
+                res.append('.*')
+                i += 2
+                continue
+            res.append('[^/]*')
+        elif c == '?':
+            res.append('[^/]')
+        elif c == '[':
+            j = pattern.find(']', i + 2)
+            if j < 0:
+                res.append(re.escape(c))
+            else:
+                body = pattern[i + 1:j].replace('\\', '\\\\')
+                if body.startswith('!'):
+                    body = '^' + body[1:]
+                res.append(f'[{body}]')
+                i = j
+        else:
+            res.append(re.escape(c))
+        i += 1
+    return ''.join(res)
+
+
+class ExcludeMatcher:
+    """
+    将全部排除规则编译为一个正则，语义与 .gitignore 一致：
+    不含 / 的规则匹配任意层级的文件名，含 / 的规则相对服务器目录匹配，
+    以 / 结尾的规则只匹配目录，以 ! 开头的规则重新包含文件，后出现的规则优先
+    """
+
+    def __init__(self, patterns: Iterable[str]):
+        file_rules, dir_rules = [], []
+        for raw in patterns:
+            pattern = raw.strip()
+            if not pattern or pattern.startswith('#'):
+                continue
+            negate = pattern.startswith('!')
+            if negate:
+                pattern = pattern[1:]
+            dir_only = pattern.endswith('/')
+            pattern = pattern.rstrip('/')
+            if not pattern:
+                continue
+            if '/' in pattern:
+                regex = translate_glob(pattern.lstrip('/'))
+            else:
+                regex = '(?:.*/)?' + translate_glob(pattern)
+            dir_rules.append((regex, negate))
+            if not dir_only:
+                file_rules.append((regex, negate))
+        self.file_regex, self.file_negate = self.__compile(file_rules)
+        self.dir_regex, self.dir_negate = self.__compile(dir_rules)
+
+    @staticmethod
+    def __compile(rules):
+        if not rules:
+            return None, []
+        # 倒序拼接，正则返回的第一个完整匹配即最后一条命中的规则
+        rules = rules[::-1]
+        regex = re.compile('|'.join(f'({r})' for r, _ in rules), re.DOTALL)
+        # 规则内部没有捕获组，第 k 个分组即第 k 条规则
+        return regex, [negate for _, negate in rules]
+
+    @staticmethod
+    def __match(regex, negates, rel_path: str) -> bool:
+        if regex is None:
+            return False
+        m = regex.fullmatch(rel_path)
+        return m is not None and not negates[m.lastindex - 1]
+
+    def is_excluded(self, rel_path: str, is_dir: bool = False) -> bool:
+        if os.sep != '/':
+            rel_path = rel_path.replace(os.sep, '/')
+        if is_dir:
+            return self.__match(self.dir_regex, self.dir_negate, rel_path)
+        return self.__match(self.file_regex, self.file_negate, rel_path)
+
+
+def scan_directory(root: str, matcher: Optional[ExcludeMatcher] = None) -> ScanResult:
+    """
+    使用 os.scandir 单次遍历目录，记录文件大小与修改时间，后续流程不再重复 stat
+    被排除的目录不会进入，与 os.walk 一致，不跟随指向目录的符号链接
+    """
+    result = ScanResult()
+    stack = [(root, '')]
+    while stack:
+        dir_path, rel_dir = stack.pop()
+        try:
+            it = os.scandir(dir_path)
+        except OSError:
+            continue
+        subdirs = []
+        with it:
+            for entry in it:
+                rel_path = rel_dir + entry.name
+                try:
+                    if entry.is_dir():
+                        if entry.is_symlink():
+                            continue
+                        if matcher is None or not matcher.is_excluded(rel_path, True):
+                            subdirs.append((entry.path, rel_path + os.sep))
+                        continue
+                    if not entry.is_file():
+                        continue
+                    if matcher is not None and matcher.is_excluded(rel_path):
+                        continue
+                    st = entry.stat()
+                except OSError:
+                    continue
+                result.files.append(ScannedFile(entry.path, rel_path, st.st_size, st.st_mtime_ns))
+                result.total_bytes += st.st_size
+        # 倒序入栈，保证按目录项顺序深度优先遍历
+        stack.extend(reversed(subdirs))
+    return result
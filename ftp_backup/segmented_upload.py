@@ -0,0 +1,149 @@
+import os
+import json
+import time
+import queue
+import hashlib
+import tempfile
+import threading
+from typing import List, Tuple
+from .connection_pool import ConnectionPool
+
+PART_SUFFIX = '.part'
+PARTS_MANIFEST_SUFFIX = '.parts.json'
+JOIN_BLOCK_SIZE = 4 * 1024 * 1024
+
+
+class UploadPart:
+    def __init__(self, index: int, offset: int, size: int, name: str):
+        self.index = index
+        self.offset = offset
+        self.size = size
+        self.name = name
+        self.digest = None
+
+    def to_dict(self) -> dict:
+        return {'name': self.name, 'offset': self.offset, 'size': self.size, 'sha256': self.digest}
+
+
+def split_parts(file_name: str, file_size: int, part_size: int) -> List[UploadPart]:
+    parts = []
+    offset = 0
+    while offset < file_size or not parts:
+        size = min(part_size, file_size - offset)
+        parts.append(UploadPart(len(parts), offset, size, f"{file_name}{PART_SUFFIX}{len(parts) + 1:04d}"))
+        offset += size
+    return parts
+
+
+class SegmentedUploader:
+    """
+    将压缩包按固定大小切分为多个分段，通过多个并行连接同时上传
+    所有分段完成后上传分段清单，远程可按清单顺序拼接（如 cat backup.zip.part[0-9]* > backup.zip）或使用 join_parts 还原
+    """
+
+    def __init__(self, server, connection_pool: ConnectionPool, config):
+        self.server = server
+        self.connection_pool = connection_pool
+        self.config = config
+        self.lock = threading.Lock()
+        self.finished_parts = 0
+        self.parts: List[UploadPart] = []
+        self.uploaded: List[Tuple[str, int]] = []
+
+    def __upload_part(self, manager, file_path: str, part: UploadPart) -> bool:
+        for attempt in range(self.config.upload_retries + 1):
+            if attempt:
+                if manager.upload_limiter is not None and manager.upload_limiter.cancelled:
+                    return False
+                delay = min(self.config.retry_backoff * 2 ** (attempt - 1), 60)
+                self.server.logger.warning(f"分段 {part.index + 1} 上传失败，{delay} 秒后进行第 {attempt} 次重试")
+                time.sleep(delay)
+                manager.disconnect()
+                if not manager.connect(self.config):
+                    continue
+            hasher = hashlib.sha256()
+            if manager.upload_part(file_path, part.offset, part.size, part.name, self.config, hasher):
+                part.digest = hasher.hexdigest()
+                return True
+        return False
+
+    def upload(self, primary_manager, file_path: str) -> bool:
+        file_name = os.path.basename(file_path)
+        file_size = os.path.getsize(file_path)
+        parts = split_parts(file_name, file_size, max(self.config.upload_part_size_mb, 1) * 1024 * 1024)
+        self.parts = parts
+        connections = max(min(self.config.upload_connections, len(parts)), 1)
+        self.server.logger.info(f"§b开始分段上传: {len(parts)} 个分段，{connections} 个并行连接")
+
+        pending = queue.Queue()
+        for part in parts:
+            pending.put(part)
+        failed = threading.Event()
+        self.finished_parts = 0
+
+        def worker():
+            manager = self.connection_pool.acquire()
+            try:
+                if manager is None:
+                    failed.set()
+                    return
+                while not failed.is_set():
+                    try:
+                        part = pending.get_nowait()
+                    except queue.Empty:
+                        return
+                    if not self.__upload_part(manager, file_path, part):
+                        failed.set()
+                        return
+                    with self.lock:
+                        self.finished_parts += 1
+                        self.server.logger.info(f"§7分段 {part.index + 1} 上传完成 "
+                                                f"({self.finished_parts}/{len(parts)}，{part.size / 1024 / 1024:.1f} MB)")
+            finally:
+                self.connection_pool.release(manager)
+
+        threads = [threading.Thread(target=worker, name=f'ftp_backup_segment_{i}', daemon=True)
+                   for i in range(connections)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        if failed.is_set():
+            self.server.logger.error("§c分段上传失败")
+            return False
+
+        # 分段清单最后上传，清单存在即表示所有分段已完整上传
+        manifest = {'name': file_name, 'size': file_size, 'parts': [p.to_dict() for p in parts]}
+        fd, tmp_path = tempfile.mkstemp(suffix=PARTS_MANIFEST_SUFFIX)
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(manifest, f, ensure_ascii=False, indent=2)
+            if not primary_manager.upload_to(tmp_path, file_name + PARTS_MANIFEST_SUFFIX, self.config):
+                return False
+            self.uploaded = [(p.name, p.size) for p in parts]
+            self.uploaded.append((file_name + PARTS_MANIFEST_SUFFIX, os.path.getsize(tmp_path)))
+        finally:
+            os.remove(tmp_path)
+        self.server.logger.info(f"已分段上传 {file_name}")
+        return True
+
+
+def join_parts(manifest_path: str, output_path: str):
+    # 按分段清单拼接并校验分段，分段文件需与清单位于同一目录
+    with open(manifest_path, 'r', encoding='utf-8') as f:
+        manifest = json.load(f)
+    parts_dir = os.path.dirname(os.path.abspath(manifest_path))
+    with open(output_path, 'wb') as out:
+        for part in manifest['parts']:
+            hasher = hashlib.sha256()
+            with open(os.path.join(parts_dir, part['name']), 'rb') as f:
+                while True:
+                    data = f.read(JOIN_BLOCK_SIZE)
+                    if not data:
+                        break
+                    hasher.update(data)
+                    out.write(data)
+            if part.get('sha256') and hasher.hexdigest() != part['sha256']:
+                raise IOError(f"分段校验失败: {part['name']}")
+    if os.path.getsize(output_path) != manifest['size']:
+        raise IOError("拼接后的文件大小与清单不一致")
@@ -1,11 +1,78 @@
+import re
 import time
+import threading
+from typing import Callable, List, Optional
 from mcdreforged.api.all import *
 
+# 未收到 MCDR 停止事件时（如插件在关服途中重载）兜底检查服务器状态的间隔
+FALLBACK_CHECK_INTERVAL = 1
+# 已收到停止事件但进程尚未退出时的检查间隔
+STOP_CONFIRM_INTERVAL = 0.05
+
+
+class SaveWatcher:
+    """
+    等待"保存完成"的控制台输出，正则在创建时编译，只在 begin() 与 wait() 之间的保存窗口内匹配
+    其余时间 feed() 只做一次布尔判断，不影响控制台输出的处理
+    """
+
+    def __init__(self, pattern: str):
+        self.pattern = re.compile(pattern)
+        self.event = threading.Event()
+        self.active = False
+        self.started = 0.0
+        self.latency: Optional[float] = None
+
+    def set_pattern(self, pattern: str):
+        self.pattern = re.compile(pattern)
+
+    def begin(self):
+        self.event.clear()
+        self.latency = None
+        self.started = time.monotonic()
+        self.active = True
+
+    def feed(self, content: str):
+        if not self.active or self.pattern.fullmatch(content) is None:
+            return
+        self.active = False
+        self.latency = time.monotonic() - self.started
+        self.event.set()
+
+    def wait(self, timeout: float) -> Optional[float]:
+        # 返回从 begin() 到检测到保存完成的耗时，超时返回 None
+        completed = self.event.wait(timeout)
+        self.active = False
+        return self.latency if completed else None
+
+
 class ServerController:
     def __init__(self, server: PluginServerInterface):
         self.server = server
-        self.watcher_thread = None
         self.last_status = False
+        # 由 MCDR 的服务器启动/停止事件驱动，关服与开服完成时立即唤醒等待方
+        self.stopped = threading.Event()
+        self.start_requested: Optional[float] = None
+        self.startup_callbacks: List[Callable[[float], None]] = []
+        self.stop_latency = 0.0
+        self.startup_latency: Optional[float] = None
+
+    def register_events(self):
+        self.server.register_event_listener('mcdr.server_stop', self.on_server_stop)
+        self.server.register_event_listener('mcdr.server_startup', self.on_server_startup)
+
+    def on_server_stop(self, server: PluginServerInterface, return_code: int):
+        self.stopped.set()
+
+    def on_server_startup(self, server: PluginServerInterface):
+        if self.start_requested is None:
+            return
+        self.startup_latency = time.monotonic() - self.start_requested
+        self.start_requested = None
+        self.server.logger.info(f"§a服务器启动完成，耗时 {self.startup_latency:.1f} 秒")
+        callbacks, self.startup_callbacks = self.startup_callbacks, []
+        for callback in callbacks:
+            callback(self.startup_latency)
 
     def is_server_running(self) -> bool:
         current_status = self.server.is_server_running()
@@ -14,31 +81,45 @@ class ServerController:
             self.last_status = current_status
         return current_status
 
-    def safe_shutdown(self, callback: callable):
+    def __wait_stopped(self):
+        while self.is_server_running():
+            if self.stopped.is_set():
+                time.sleep(STOP_CONFIRM_INTERVAL)
+            else:
+                self.stopped.wait(FALLBACK_CHECK_INTERVAL)
+
+    def safe_shutdown(self, callback: callable, on_error: Optional[callable] = None):
+        # 关闭失败时调用 on_error，等待回调完成的一方不会一直阻塞
         @new_thread
         def watcher():
             try:
+                requested = time.monotonic()
+                self.stopped.clear()
                 if self.is_server_running():
                     self.server.logger.info("§6正在关闭服务器...")
                     self.server.stop()
                 else:
                     self.server.logger.warning("§e服务器已处于关闭状态")
 
-                check_interval = 0.1
-                while self.is_server_running():
-                    time.sleep(check_interval)
-                    check_interval = min(check_interval * 1.2, 5)  # 指数退避
-
-                self.server.logger.info("§a服务器关闭确认完成")
+                self.__wait_stopped()
+                self.stop_latency = time.monotonic() - requested
+                self.server.logger.info(f"§a服务器关闭确认完成，耗时 {self.stop_latency:.1f} 秒")
                 callback()
             except Exception as e:
                 self.server.logger.error(f"关闭过程出错: {str(e)}")
+                if on_error is not None:
+                    on_error()
 
         watcher()
 
-    def restart_server(self):
+    def restart_server(self, on_started: Optional[Callable[[float], None]] = None):
+        # on_started 在 MCDR 报告服务器启动完成时调用，参数为启动耗时(秒)
         if not self.is_server_running():
+            self.start_requested = time.monotonic()
+            self.startup_latency = None
+            if on_started is not None:
+                self.startup_callbacks.append(on_started)
             self.server.start()
             self.server.logger.info("§a正在启动服务器...")
         else:
-            self.server.logger.warning("§c服务器已在运行状态")
\ No newline at end of file
+            self.server.logger.warning("§c服务器已在运行状态")
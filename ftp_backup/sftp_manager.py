@@ -1,18 +1,51 @@
 import os
-import paramiko
-from typing import Optional
+import stat
+import time
+import posixpath
+from typing import TYPE_CHECKING, Dict, Optional, Tuple
 from mcdreforged.api.all import PluginServerInterface
+from .stream_pipe import RangeReader
+from .throttle import TokenBucket, TransferCancelled, throttled
+
+# paramiko 连同 cryptography 导入较慢，只在实际建立 SFTP 连接时导入
+if TYPE_CHECKING:
+    import paramiko
+
+STREAM_BLOCK_SIZE = 1024 * 1024
+# 范围读取时每批预取的块数，限制预取数据占用的内存
+READV_BATCH = 32
 
 
 class SFTPManager:
     def __init__(self, server: PluginServerInterface):
         self.server = server
-        self.transport: Optional[paramiko.Transport] = None
-        self.sftp_client: Optional[paramiko.SFTPClient] = None
+        self.transport: Optional['paramiko.Transport'] = None
+        self.sftp_client: Optional['paramiko.SFTPClient'] = None
+        self.known_dirs = set()
+        self.block_size = STREAM_BLOCK_SIZE
+        self.upload_limiter: Optional[TokenBucket] = None
+
+    def __create_transport(self, config) -> 'paramiko.Transport':
+        import paramiko
+        # 增大窗口与数据包大小，减少高延迟链路上等待窗口调整的往返
+        transport = paramiko.Transport(
+            (config.host, config.port),
+            default_window_size=config.sftp_window_mb * 1024 * 1024,
+            default_max_packet_size=config.sftp_max_packet_kb * 1024
+        )
+        if config.sftp_ciphers:
+            options = transport.get_security_options()
+            supported = set(options.ciphers)
+            preferred = [c for c in config.sftp_ciphers if c in supported]
+            options.ciphers = tuple(preferred + [c for c in options.ciphers if c not in preferred])
+        transport.use_compression(config.sftp_compression)
+        return transport
 
     def connect(self, config) -> bool:
         try:
-            self.transport = paramiko.Transport((config.host, config.port))
+            import paramiko
+            self.transport = self.__create_transport(config)
+            self.block_size = max(config.sftp_block_kb, 32) * 1024
 
             if config.private_key_path and os.path.exists(config.private_key_path):
                 try:
@@ -23,7 +56,9 @@ class SFTPManager:
             else:
                 self.transport.connect(username=config.username, password=config.password)
 
+            self.transport.set_keepalive(config.keepalive_interval)
             self.sftp_client = paramiko.SFTPClient.from_transport(self.transport)
+            self.known_dirs.clear()
             self.server.logger.info("SFTP连接成功")
             return True
         except Exception as e:
@@ -31,6 +66,18 @@ class SFTPManager:
             self.disconnect()
             return False
 
+    def is_connected(self) -> bool:
+        return self.sftp_client is not None and self.transport is not None and self.transport.is_active()
+
+    def is_alive(self) -> bool:
+        if not self.is_connected():
+            return False
+        try:
+            self.sftp_client.normalize('.')
+            return True
+        except Exception:
+            return False
+
     def upload_file(self, file_path: str, config) -> bool:
         if self.sftp_client is None:
             return False
@@ -45,13 +92,201 @@ class SFTPManager:
                 self.sftp_client.mkdir(remote_dir)
             
             remote_full_path = f"{remote_dir}/{remote_filename}".replace('//', '/')
-            self.sftp_client.put(file_path, remote_full_path)
+        except Exception as e:
+            self.server.logger.error(f"SFTP上传失败: {str(e)}")
+            return False
+        return self.__upload_resumable(file_path, remote_full_path, config)
+
+    def __remote_size(self, remote_path: str) -> Optional[int]:
+        try:
+            return self.sftp_client.stat(remote_path).st_size
+        except (IOError, OSError):
+            return None
+
+    def __write_pipelined(self, reader, remote_path: str, mode: str = 'wb', offset: int = 0):
+        # 大块读取本地数据，流水线写入远程，写请求不逐个等待确认，关闭文件时统一检查结果
+        reader = throttled(reader, self.upload_limiter)
+        with self.sftp_client.open(remote_path, mode, bufsize=self.block_size) as remote_file:
+            if offset:
+                remote_file.seek(offset)
+            remote_file.set_pipelined(True)
+            while True:
+                data = reader.read(self.block_size)
+                if not data:
+                    break
+                remote_file.write(data)
+
+    def __put_from(self, file_path: str, remote_path: str, offset: int):
+        with open(file_path, 'rb') as f:
+            f.seek(offset)
+            self.__write_pipelined(f, remote_path, 'r+b' if offset else 'wb', offset)
+
+    def __upload_resumable(self, file_path: str, remote_path: str, config) -> bool:
+        # 连接中断后重连并通过 stat 获取远程已有大小，从该位置继续写入
+        local_size = os.path.getsize(file_path)
+        offset = 0
+        attempts = 0
+        while True:
+            try:
+                if self.sftp_client is None:
+                    raise ConnectionError("重连失败，未连接到服务器")
+                self.__put_from(file_path, remote_path, offset)
+                remote_size = self.__remote_size(remote_path)
+                if remote_size is not None and remote_size != local_size:
+                    raise IOError(f"远程文件大小不一致: {remote_size} / {local_size}")
+                self.server.logger.info(f"已上传至 {remote_path}")
+                return True
+            except Exception as e:
+                attempts += 1
+                if not config.resume_upload or attempts > config.upload_retries or isinstance(e, TransferCancelled):
+                    self.server.logger.error(f"SFTP上传失败: {str(e)}")
+                    return False
+                delay = min(config.retry_backoff * 2 ** (attempts - 1), 60)
+                self.server.logger.warning(f"SFTP上传中断: {str(e)}，{delay} 秒后进行第 {attempts} 次重试")
+                time.sleep(delay)
+                self.disconnect()
+                if not self.connect(config):
+                    continue
+                offset = self.__remote_size(remote_path) or 0
+                if offset > local_size:
+                    offset = 0
+                if offset:
+                    self.server.logger.info(f"§6从第 {offset} 字节处继续上传")
+
+    def upload_stream(self, stream, filename: str, config) -> bool:
+        if self.sftp_client is None:
+            return False
+
+        remote_full_path = f"{config.remote_path}/{filename}".replace('//', '/')
+        try:
+            self.__ensure_dir(config.remote_path)
+            self.__write_pipelined(stream, remote_full_path)
             self.server.logger.info(f"已上传至 {remote_full_path}")
             return True
+        except Exception as e:
+            self.server.logger.error(f"SFTP流式上传失败: {str(e)}")
+            # 尽力删除不完整的远程文件，否则刷新索引后会被当作完整备份占用保留名额
+            try:
+                self.sftp_client.remove(remote_full_path)
+                self.server.logger.info(f"§7已删除不完整的远程文件: {remote_full_path}")
+            except Exception:
+                pass
+            return False
+
+    def __remote_path(self, rel_path: str, config) -> str:
+        return f"{config.remote_path}/{rel_path}".replace('//', '/')
+
+    def __ensure_dir(self, remote_dir: str):
+        path = '/' if remote_dir.startswith('/') else ''
+        for part in [p for p in remote_dir.split('/') if p]:
+            path = posixpath.join(path, part)
+            if path in self.known_dirs:
+                continue
+            try:
+                self.sftp_client.stat(path)
+            except FileNotFoundError:
+                self.sftp_client.mkdir(path)
+            self.known_dirs.add(path)
+
+    def upload_to(self, file_path: str, rel_path: str, config) -> bool:
+        if self.sftp_client is None:
+            return False
+
+        try:
+            remote_path = self.__remote_path(rel_path, config)
+            self.__ensure_dir(posixpath.dirname(remote_path))
+            with open(file_path, 'rb') as f:
+                self.__write_pipelined(f, remote_path)
+            return True
         except Exception as e:
             self.server.logger.error(f"SFTP上传失败: {str(e)}")
             return False
 
+    def upload_part(self, file_path: str, offset: int, size: int, rel_path: str, config, hasher=None) -> bool:
+        if self.sftp_client is None:
+            return False
+
+        try:
+            remote_path = self.__remote_path(rel_path, config)
+            self.__ensure_dir(posixpath.dirname(remote_path))
+            with open(file_path, 'rb') as f:
+                f.seek(offset)
+                self.__write_pipelined(RangeReader(f, size, hasher), remote_path)
+            return True
+        except Exception as e:
+            self.server.logger.error(f"SFTP分段上传失败: {str(e)}")
+            return False
+
+    def list_names(self, rel_dir: str, config) -> list:
+        if self.sftp_client is None:
+            return []
+
+        try:
+            return self.sftp_client.listdir(self.__remote_path(rel_dir, config))
+        except FileNotFoundError:
+            return []
+
+    def list_entries(self, rel_dir: str, config) -> Dict[str, Optional[int]]:
+        if self.sftp_client is None:
+            return {}
+
+        try:
+            return {attr.filename: attr.st_size
+                    for attr in self.sftp_client.listdir_attr(self.__remote_path(rel_dir, config))
+                    if attr.st_mode is None or stat.S_ISREG(attr.st_mode)}
+        except FileNotFoundError:
+            return {}
+
+    def file_size(self, rel_path: str, config) -> Optional[int]:
+        if self.sftp_client is None:
+            return None
+        return self.__remote_size(self.__remote_path(rel_path, config))
+
+    def remote_checksum(self, rel_path: str, algorithms: list, config) -> Optional[Tuple[str, str]]:
+        # 通过 check-file 扩展由服务器计算校验值，OpenSSH 等多数服务器不支持，此时返回 None
+        if self.sftp_client is None:
+            return None
+
+        try:
+            with self.sftp_client.open(self.__remote_path(rel_path, config), 'rb') as remote_file:
+                for algorithm in algorithms:
+                    try:
+                        return algorithm, remote_file.check(algorithm).hex()
+                    except IOError:
+                        continue
+        except Exception:
+            pass
+        return None
+
+    def download_range(self, rel_path: str, offset: int, size: Optional[int], out, config) -> bool:
+        # readv 一次发出一批读请求，按顺序返回数据，每批只等待一次往返
+        if self.sftp_client is None:
+            return False
+
+        try:
+            with self.sftp_client.open(self.__remote_path(rel_path, config), 'rb') as remote_file:
+                if size is None:
+                    size = remote_file.stat().st_size - offset
+                blocks = [(offset + pos, min(self.block_size, size - pos)) for pos in range(0, size, self.block_size)]
+                for i in range(0, len(blocks), READV_BATCH):
+                    for data in remote_file.readv(blocks[i:i + READV_BATCH]):
+                        out.write(data)
+            return True
+        except Exception as e:
+            self.server.logger.error(f"SFTP下载失败: {str(e)}")
+            return False
+
+    def delete_file(self, rel_path: str, config) -> bool:
+        if self.sftp_client is None:
+            return False
+
+        try:
+            self.sftp_client.remove(self.__remote_path(rel_path, config))
+            return True
+        except Exception as e:
+            self.server.logger.error(f"删除远程文件失败: {str(e)}")
+            return False
+
     def disconnect(self):
         if self.sftp_client:
             self.sftp_client.close()
@@ -0,0 +1,168 @@
+import time
+import queue
+import threading
+from typing import Callable, Optional
+
+BLOCK_SIZE = 1024 * 1024
+_EOF = object()
+
+
+class StreamAbortedError(IOError):
+    pass
+
+
+class StreamPipe:
+    """
+    压缩线程与上传线程之间的有界内存缓冲区
+    写入端不提供 tell()，zipfile 会将其视为不可寻址流并改用数据描述符
+    """
+
+    def __init__(self, max_buffer: int):
+        self.queue = queue.Queue(maxsize=max(max_buffer // BLOCK_SIZE, 1))
+        self.pending = bytearray()
+        self.current = b''
+        self.offset = 0
+        self.error: Optional[BaseException] = None
+        self.eof = False
+        self.bytes_written = 0
+
+    def __put(self, item):
+        while True:
+            if self.error is not None:
+                raise StreamAbortedError(f"流已中断: {self.error}")
+            try:
+                self.queue.put(item, timeout=0.5)
+                return
+            except queue.Full:
+                continue
+
+    # 写入端
+    def write(self, data) -> int:
+        self.pending += data
+        self.bytes_written += len(data)
+        while len(self.pending) >= BLOCK_SIZE:
+            self.__put(bytes(self.pending[:BLOCK_SIZE]))
+            del self.pending[:BLOCK_SIZE]
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        if self.pending:
+            self.__put(bytes(self.pending))
+            self.pending.clear()
+        self.__put(_EOF)
+
+    def abort(self, error: BaseException):
+        # 任一端出错时调用，另一端在下次读写时抛出异常
+        self.error = error
+        try:
+            self.queue.put_nowait(_EOF)
+        except queue.Full:
+            pass
+
+    # 读取端
+    def read(self, size: int = -1) -> bytes:
+        if size is None or size < 0:
+            size = BLOCK_SIZE
+        while self.offset >= len(self.current):
+            if self.eof:
+                return b''
+            if self.error is not None:
+                raise StreamAbortedError(f"流已中断: {self.error}")
+            try:
+                item = self.queue.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            if self.error is not None:
+                raise StreamAbortedError(f"流已中断: {self.error}")
+            if item is _EOF:
+                self.eof = True
+                return b''
+            self.current, self.offset = item, 0
+        data = self.current[self.offset:self.offset + size]
+        self.offset += len(data)
+        return data
+
+
+class RangeReader:
+    # 只读取文件中指定长度的一段，可选在读取时同步计算哈希
+    def __init__(self, file, size: int, hasher=None):
+        self.file = file
+        self.remaining = size
+        self.hasher = hasher
+
+    def read(self, size: int = -1) -> bytes:
+        if self.remaining <= 0:
+            return b''
+        if size is None or size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.file.read(size)
+        self.remaining -= len(data)
+        if self.hasher is not None:
+            self.hasher.update(data)
+        return data
+
+
+class TeeWriter:
+    # 同时写入本地文件与管道，用于流式上传时保留本地副本
+    def __init__(self, file, pipe: StreamPipe):
+        self.file = file
+        self.pipe = pipe
+
+    def write(self, data) -> int:
+        self.file.write(data)
+        return self.pipe.write(data)
+
+    def flush(self):
+        self.file.flush()
+
+
+class StreamUpload:
+    def __init__(self, upload_func: Callable[[StreamPipe, str], bool], max_buffer: int,
+                 discard_func: Optional[Callable[[str], None]] = None):
+        self.upload_func = upload_func
+        # 上传已完成但备份随后失败时删除远程文件；上传本身失败时由 upload_func 清理
+        self.discard_func = discard_func
+        self.pipe = StreamPipe(max_buffer)
+        self.thread: Optional[threading.Thread] = None
+        self.filename: Optional[str] = None
+        self.result = False
+        self.elapsed = 0.0
+
+    @property
+    def bytes_written(self) -> int:
+        return self.pipe.bytes_written
+
+    def start(self, filename: str):
+        self.filename = filename
+
+        def run():
+            started = time.time()
+            try:
+                self.result = self.upload_func(self.pipe, filename)
+            except Exception as e:
+                self.result = False
+                self.pipe.abort(e)
+                return
+            finally:
+                self.elapsed = time.time() - started
+            if not self.result:
+                self.pipe.abort(IOError("上传失败"))
+
+        self.thread = threading.Thread(target=run, name='ftp_backup_stream_upload', daemon=True)
+        self.thread.start()
+
+    def finish(self) -> bool:
+        self.pipe.close()
+        self.thread.join()
+        return self.result
+
+    def abort(self, error: BaseException):
+        self.pipe.abort(error)
+        if self.thread is not None:
+            self.thread.join()
+        if self.result and self.discard_func is not None:
+            self.result = False
+            self.discard_func(self.filename)
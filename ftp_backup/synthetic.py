@@ -0,0 +1,109 @@
+import os
+import zipfile
+from typing import Callable, Dict, List, Optional, Tuple
+from .compressor import write_raw_member
+from .manifest import BackupManifest, FileEntry, BACKUP_FULL, MANIFEST_SUFFIX, load_manifest
+from .restore import LOCAL_HEADER, LOCAL_HEADER_SIGNATURE, MemberEntry, MemberIndex, arcname, build_member_index, \
+    index_path
+from .scanner import ScannedFile
+from .throttle import TokenBucket, throttled
+
+REUSABLE_COMPRESS_TYPES = (zipfile.ZIP_STORED, zipfile.ZIP_DEFLATED)
+
+
+class ReusePlan:
+    """
+    合成全量备份：大小与修改时间与之前某个本地 ZIP 备份中完整保存的版本一致的文件，
+    直接复制其压缩数据与 CRC，不解压也不重新压缩，生成的仍是独立完整的普通 ZIP
+    复用成员保留原压缩方式，压缩级别或 codec_rules 修改后只对重新压缩的文件生效
+    """
+
+    def __init__(self):
+        self.members: Dict[str, Tuple[str, MemberEntry]] = {}
+        self.handles = {}
+
+    @property
+    def reused_bytes(self) -> int:
+        return sum(entry.file_size for _, entry in self.members.values())
+
+    def open_sources(self):
+        # 规划完成后立即打开来源压缩包，上传阶段同时清理旧备份时仍可读取已打开的文件
+        for archive in {archive for archive, _ in self.members.values()}:
+            try:
+                self.handles[archive] = open(archive, 'rb')
+            except OSError:
+                self.members = {path: item for path, item in self.members.items() if item[0] != archive}
+
+    def copy_to(self, zipf: zipfile.ZipFile, scanned: Dict[str, ScannedFile], limiter: Optional[TokenBucket],
+                on_written: Callable[[zipfile.ZipInfo], None], should_abort: Callable[[], bool]) -> bool:
+        # 按来源压缩包与偏移顺序读取，等同于顺序复制文件
+        for path, (archive, entry) in sorted(self.members.items(), key=lambda item: (item[1][0], item[1][1].offset)):
+            if should_abort():
+                return False
+            src = self.handles[archive]
+            src.seek(entry.offset)
+            header = src.read(LOCAL_HEADER.size)
+            if len(header) != LOCAL_HEADER.size or header[:4] != LOCAL_HEADER_SIGNATURE:
+                raise IOError(f"来源备份成员文件头损坏: {os.path.basename(archive)} {path}")
+            fields = LOCAL_HEADER.unpack(header)
+            src.seek(fields[-2] + fields[-1], 1)
+            zinfo = zipfile.ZipInfo.from_file(scanned[path].path, arcname(path))
+            zinfo.compress_type = entry.compress_type
+            zinfo.file_size = entry.file_size
+            zinfo.compress_size = entry.compress_size
+            zinfo.CRC = entry.crc
+            write_raw_member(zipf, zinfo, throttled(src, limiter))
+            on_written(zinfo)
+        return True
+
+    def close(self):
+        for handle in self.handles.values():
+            handle.close()
+        self.handles.clear()
+
+
+def _load_index(archive: str, manifest: BackupManifest) -> Optional[MemberIndex]:
+    try:
+        return MemberIndex.load(index_path(archive))
+    except (OSError, ValueError, KeyError):
+        pass
+    try:
+        # 成员索引缺失时只读取中央目录重建
+        return build_member_index(archive, manifest)
+    except (OSError, zipfile.BadZipFile):
+        return None
+
+
+def plan_reuse(backup_dir: str, files: Dict[str, FileEntry], candidates: List[str]) -> ReusePlan:
+    """
+    从新到旧查找本地 ZIP 备份，直到最近一个本地全量备份为止
+    只复用该备份实际写入的完整文件（不含区块差量），且大小与修改时间与当前文件一致
+    """
+    plan = ReusePlan()
+    pending = set(candidates)
+    names = sorted((f[:-len(MANIFEST_SUFFIX)] for f in os.listdir(backup_dir)
+                    if f.endswith(MANIFEST_SUFFIX) and f[:-len(MANIFEST_SUFFIX)].endswith('.zip')), reverse=True)
+    for name in names:
+        if not pending:
+            break
+        archive = os.path.join(backup_dir, name)
+        manifest = load_manifest(backup_dir, name)
+        if manifest is None or not os.path.isfile(archive):
+            continue
+        index = _load_index(archive, manifest)
+        if index is None:
+            continue
+        deltas = set(manifest.deltas)
+        for path in manifest.changed:
+            if path not in pending or path in deltas:
+                continue
+            old = manifest.files.get(path)
+            entry = index.members.get(arcname(path))
+            if old is None or entry is None or not files[path].same_stat(old) or \
+                    entry.file_size != old.size or entry.compress_type not in REUSABLE_COMPRESS_TYPES:
+                continue
+            plan.members[path] = (archive, entry)
+            pending.discard(path)
+        if manifest.backup_type == BACKUP_FULL:
+            break
+    return plan
@@ -0,0 +1,311 @@
+import os
+import re
+import sys
+import time
+import ctypes
+import platform
+import threading
+from typing import Optional
+
+MB = 1024 * 1024
+# 令牌桶最多积累 0.5 秒的额度，避免空闲后瞬间突发
+BURST_SECONDS = 0.5
+MIN_BURST = 64 * 1024
+# 自适应限速：每次退避速率减半，最低降至 10%，一段时间内无过载信号则逐步恢复
+MIN_FACTOR = 0.1
+BACKOFF_COOLDOWN = 2
+RECOVER_SECONDS = 30
+IDLE_SECONDS = 60
+THROTTLE_KEYS = ('read_limit_mb', 'upload_limit_mb', 'backup_niceness', 'backup_io_priority', 'adaptive_throttle')
+
+# ioprio_set 的系统调用号，其他架构不调整 I/O 优先级
+IOPRIO_SYSCALLS = {'x86_64': 251, 'amd64': 251, 'aarch64': 30, 'arm64': 30, 'i686': 289, 'armv7l': 314}
+IOPRIO_CLASSES = {'best-effort': 2, 'idle': 3}
+IOPRIO_CLASS_SHIFT = 13
+IOPRIO_WHO_PROCESS = 1
+
+
+class TransferCancelled(IOError):
+    pass
+
+
+class TokenBucket:
+    """
+    令牌桶限速，多个线程共享同一个桶时合计速率不超过上限，速率为 0 表示不限速
+    允许透支：先扣除令牌再按欠额休眠，单次读取大于桶容量时也能保持平均速率
+    取消后所有经过该桶的读取抛出 TransferCancelled，用于插件卸载时中断进行中的传输
+    """
+
+    def __init__(self, rate: float = 0):
+        self.lock = threading.Lock()
+        self.rate = 0.0
+        self.capacity = MIN_BURST
+        self.tokens = 0.0
+        self.updated = time.monotonic()
+        self.consumed = 0
+        self.last_used = 0.0
+        self.cancelled = False
+        self.set_rate(rate)
+
+    def set_rate(self, rate: float):
+        with self.lock:
+            self.rate = max(rate, 0)
+            self.capacity = max(self.rate * BURST_SECONDS, MIN_BURST)
+            self.tokens = min(self.tokens, self.capacity)
+
+    def cancel(self):
+        self.cancelled = True
+
+    def consume(self, n: int):
+        if self.cancelled:
+            raise TransferCancelled("传输已取消")
+        with self.lock:
+            now = time.monotonic()
+            self.consumed += n
+            self.last_used = now
+            if self.rate <= 0:
+                return
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= n
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0
+        if wait > 0:
+            time.sleep(wait)
+
+
+class FairShare:
+    """
+    多个参与者同时读取时平分一个令牌桶的速率：每个参与者的份额为总速率除以当前参与者数，
+    读取时同时扣除自己的份额与总令牌桶，合计不超过上限；有参与者离开后其余参与者的份额随即提高
+    总速率随自适应限速变化时份额同步调整
+    """
+
+    def __init__(self, parent: TokenBucket):
+        self.parent = parent
+        self.lock = threading.Lock()
+        self.members = 0
+
+    def join(self) -> 'ShareBucket':
+        with self.lock:
+            self.members += 1
+        return ShareBucket(self)
+
+    def leave(self):
+        with self.lock:
+            self.members -= 1
+
+    def share_rate(self) -> float:
+        return self.parent.rate / max(self.members, 1)
+
+
+class ShareBucket(TokenBucket):
+    def __init__(self, fair_share: FairShare):
+        super().__init__(fair_share.share_rate())
+        self.fair_share = fair_share
+
+    def consume(self, n: int):
+        rate = self.fair_share.share_rate()
+        if rate != self.rate:
+            self.set_rate(rate)
+        super().consume(n)
+        self.fair_share.parent.consume(n)
+
+    def leave(self):
+        self.fair_share.leave()
+
+
+class ThrottledReader:
+    # 读取时按实际读取的字节数消耗令牌
+    def __init__(self, file, limiter: TokenBucket):
+        self.file = file
+        self.limiter = limiter
+
+    def read(self, size: int = -1) -> bytes:
+        data = self.file.read(size)
+        if data:
+            self.limiter.consume(len(data))
+        return data
+
+
+def throttled(file, limiter: Optional[TokenBucket]):
+    return file if limiter is None else ThrottledReader(file, limiter)
+
+
+def set_thread_niceness(niceness: int) -> bool:
+    # Linux 下 nice 值按线程生效，之后由该线程创建的线程会继承
+    if not sys.platform.startswith('linux') or not hasattr(os, 'setpriority'):
+        return False
+    try:
+        os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), niceness)
+        return True
+    except OSError:
+        return False
+
+
+def set_thread_io_priority(io_class: str) -> bool:
+    ioprio_class = IOPRIO_CLASSES.get(io_class.lower())
+    syscall = IOPRIO_SYSCALLS.get(platform.machine().lower())
+    if ioprio_class is None or syscall is None or not sys.platform.startswith('linux'):
+        return False
+    # best-effort 使用最低的优先级 7，idle 类别不区分优先级
+    value = (ioprio_class << IOPRIO_CLASS_SHIFT) | (7 if ioprio_class == 2 else 0)
+    try:
+        libc = ctypes.CDLL(None, use_errno=True)
+        return libc.syscall(syscall, IOPRIO_WHO_PROCESS, threading.get_native_id(), value) == 0
+    except (OSError, AttributeError):
+        return False
+
+
+class ThrottleProfile:
+    def __init__(self, read_limit_mb: float = 0, upload_limit_mb: float = 0, backup_niceness: int = 0,
+                 backup_io_priority: str = '', adaptive_throttle: bool = False):
+        self.read_limit_mb = read_limit_mb
+        self.upload_limit_mb = upload_limit_mb
+        self.backup_niceness = backup_niceness
+        self.backup_io_priority = backup_io_priority
+        self.adaptive_throttle = adaptive_throttle
+
+    @classmethod
+    def from_config(cls, config, overrides: Optional[dict] = None) -> 'ThrottleProfile':
+        # 定时计划中的同名字段覆盖全局配置
+        overrides = overrides or {}
+        return cls(**{key: overrides.get(key, getattr(config, key)) for key in THROTTLE_KEYS})
+
+
+class ResourceGovernor:
+    """
+    限制备份读取磁盘与上传的速率，并可降低备份线程的 CPU 与 I/O 优先级
+    启用自适应限速时根据服务器的 MSPT 采样或 "Can't keep up" 警告降低速率，负载恢复后逐步还原
+    """
+
+    def __init__(self, server, config):
+        self.server = server
+        self.read_bucket = TokenBucket()
+        self.upload_bucket = TokenBucket()
+        self.profile = ThrottleProfile()
+        self.factor = 1.0
+        self.references = {}
+        self.last_backoff = 0.0
+        self.profile_started = time.monotonic()
+        self.baselines = {}
+        self.monitor_started = time.monotonic()
+        self.lock = threading.Lock()
+        self.monitor_thread: Optional[threading.Thread] = None
+        self.update_config(config)
+
+    def update_config(self, config):
+        self.config = config
+        self.overload_pattern = re.compile(config.overload_regex)
+        self.mspt_pattern = re.compile(config.mspt_regex)
+        self.apply_profile(ThrottleProfile.from_config(config))
+
+    def apply_profile(self, profile: ThrottleProfile):
+        with self.lock:
+            self.profile = profile
+            self.factor = 1.0
+            self.references.clear()
+            self.profile_started = time.monotonic()
+            self.baselines = {id(b): b.consumed for b in (self.read_bucket, self.upload_bucket)}
+            self.__apply_rates()
+        if profile.read_limit_mb > 0 or profile.upload_limit_mb > 0:
+            self.server.logger.info(f"§6备份限速: 读取 {profile.read_limit_mb or '不限'} MB/s，"
+                                    f"上传 {profile.upload_limit_mb or '不限'} MB/s")
+        if profile.adaptive_throttle:
+            self.__ensure_monitor()
+
+    @property
+    def read_limiter(self) -> Optional[TokenBucket]:
+        # 不限速且未启用自适应时返回 None，读取路径保持原样
+        if self.profile.read_limit_mb > 0 or self.profile.adaptive_throttle:
+            return self.read_bucket
+        return None
+
+    @property
+    def upload_limiter(self) -> TokenBucket:
+        return self.upload_bucket
+
+    def cancel(self):
+        # 插件卸载时中断所有读取与上传
+        self.read_bucket.cancel()
+        self.upload_bucket.cancel()
+
+    def lower_thread_priority(self):
+        # 在备份与上传线程开始时调用，由其创建的压缩、分段上传线程继承优先级
+        if self.profile.backup_niceness > 0 and not set_thread_niceness(self.profile.backup_niceness):
+            self.server.logger.debug("当前平台不支持调整线程 nice 值")
+        if self.profile.backup_io_priority and not set_thread_io_priority(self.profile.backup_io_priority):
+            self.server.logger.debug("当前平台不支持调整线程 I/O 优先级")
+
+    def __apply_rates(self):
+        for bucket, limit in ((self.read_bucket, self.profile.read_limit_mb),
+                              (self.upload_bucket, self.profile.upload_limit_mb)):
+            if limit > 0:
+                bucket.set_rate(limit * MB * self.factor)
+            elif self.factor >= 1:
+                bucket.set_rate(0)
+            else:
+                # 未设置上限时以退避前实测的吞吐量为基准，尚未开始传输的一方暂不限速
+                bucket.set_rate(self.references.get(id(bucket), 0) * self.factor)
+
+    def __is_active(self) -> bool:
+        now = time.monotonic()
+        return any(now - b.last_used < IDLE_SECONDS for b in (self.read_bucket, self.upload_bucket))
+
+    def __backoff(self, reason: str):
+        with self.lock:
+            now = time.monotonic()
+            if not self.profile.adaptive_throttle or now - self.last_backoff < BACKOFF_COOLDOWN:
+                return
+            # 首次退避时记录实测吞吐量，之后开始传输的一方在其后的退避中记录
+            elapsed = max(now - self.profile_started, 1)
+            for bucket in (self.read_bucket, self.upload_bucket):
+                consumed = bucket.consumed - self.baselines.get(id(bucket), 0)
+                if id(bucket) not in self.references and consumed > 0:
+                    self.references[id(bucket)] = max(consumed / elapsed, MB)
+            self.last_backoff = now
+            self.factor = max(self.factor / 2, MIN_FACTOR)
+            self.__apply_rates()
+        self.server.logger.info(f"§6{reason}，备份速率降至 {self.factor * 100:.0f}%")
+
+    def __recover(self):
+        with self.lock:
+            if self.factor >= 1:
+                return
+            self.factor = min(self.factor * 1.5, 1.0)
+            self.__apply_rates()
+        self.server.logger.info(f"§6服务器负载恢复，备份速率升至 {self.factor * 100:.0f}%")
+
+    def on_server_info(self, content: str):
+        if not self.profile.adaptive_throttle or not self.__is_active():
+            return
+        if self.overload_pattern.fullmatch(content):
+            self.__backoff("服务器过载")
+            return
+        m = self.mspt_pattern.fullmatch(content)
+        if m is None:
+            return
+        mspt = float(m.group(1))
+        if mspt > self.config.target_mspt:
+            self.__backoff(f"MSPT {mspt:.1f} ms 超过目标")
+        elif mspt < self.config.target_mspt * 0.8 and time.monotonic() - self.last_backoff > BACKOFF_COOLDOWN:
+            self.__recover()
+
+    def __ensure_monitor(self):
+        self.monitor_started = time.monotonic()
+        if self.monitor_thread is not None and self.monitor_thread.is_alive():
+            return
+        self.monitor_thread = threading.Thread(target=self.__monitor_loop, name='ftp_backup_throttle', daemon=True)
+        self.monitor_thread.start()
+
+    def __monitor_loop(self):
+        # 定期采样 MSPT 并在长时间无过载信号时恢复速率，备份空闲一段时间后退出
+        while self.profile.adaptive_throttle:
+            interval = self.config.tick_query_interval
+            time.sleep(interval if interval > 0 else 5)
+            if not self.__is_active() and time.monotonic() - self.monitor_started > IDLE_SECONDS:
+                break
+            if interval > 0 and self.server.is_server_running():
+                self.server.execute('tick query')
+            if time.monotonic() - self.last_backoff > RECOVER_SECONDS:
+                self.__recover()
+        self.monitor_thread = None
@@ -0,0 +1,91 @@
+import os
+import random
+
+import pytest
+
+from ftp_backup.chunk_store import ChunkStore, Snapshot, SnapshotFile
+
+
+def write_file(path, data: bytes):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(data)
+
+
+def make_snapshot(store: ChunkStore, name: str, files: dict) -> Snapshot:
+    snapshot = Snapshot(name)
+    for rel_path, full_path in files.items():
+        chunks, _ = store.store_file(full_path)
+        stat = os.stat(full_path)
+        snapshot.files[rel_path] = SnapshotFile(stat.st_size, stat.st_mtime_ns, chunks)
+    store.save_snapshot(snapshot)
+    return snapshot
+
+
+@pytest.fixture
+def store(tmp_path):
+    return ChunkStore(str(tmp_path / 'store'), 64 * 1024, level=1)
+
+
+@pytest.fixture
+def world(tmp_path):
+    rnd = random.Random(1)
+    paths = {}
+    for name in ('shared.dat', 'old.dat', 'new.dat'):
+        paths[name] = str(tmp_path / 'world' / name)
+        write_file(paths[name], rnd.randbytes(600 * 1024))
+    return paths
+
+
+def test_prune_keeps_shared_chunks(store, world, tmp_path):
+    old = make_snapshot(store, 'backup_20260101-000000', {'shared.dat': world['shared.dat'], 'old.dat': world['old.dat']})
+    new = make_snapshot(store, 'backup_20260102-000000', {'shared.dat': world['shared.dat'], 'new.dat': world['new.dat']})
+    shared = old.files['shared.dat'].chunks
+    assert shared == new.files['shared.dat'].chunks
+    orphaned = old.chunk_set() - new.chunk_set()
+    assert orphaned and len(shared) > 1
+
+    removed_snapshots, removed_chunks = store.prune({new.name})
+
+    assert removed_snapshots == [old.name]
+    assert set(removed_chunks) == orphaned
+    assert store.list_snapshots() == [new.name]
+    assert set(store.iter_chunks()) == new.chunk_set()
+    assert all(store.has_chunk(h) for h in shared)
+    assert not any(store.has_chunk(h) for h in orphaned)
+
+    target = tmp_path / 'restored'
+    store.restore_snapshot(new.name, str(target))
+    for name in ('shared.dat', 'new.dat'):
+        with open(target / name, 'rb') as restored, open(world[name], 'rb') as original:
+            assert restored.read() == original.read()
+
+
+def test_prune_chunk_repeated_within_snapshot(store, world, tmp_path):
+    # 同一数据块在一个快照中出现多次，只要仍有快照引用就不能删除
+    doubled = str(tmp_path / 'world' / 'doubled.dat')
+    with open(world['shared.dat'], 'rb') as f:
+        data = f.read()
+    write_file(doubled, data + data)
+    kept = make_snapshot(store, 'backup_20260102-000000', {'doubled.dat': doubled})
+    dropped = make_snapshot(store, 'backup_20260101-000000', {'shared.dat': world['shared.dat']})
+    assert len(kept.files['doubled.dat'].chunks) > len(kept.chunk_set())
+
+    _, removed_chunks = store.prune({kept.name})
+
+    assert not set(removed_chunks) & kept.chunk_set()
+    assert set(store.iter_chunks()) == kept.chunk_set()
+    assert dropped.chunk_set() - kept.chunk_set() == set(removed_chunks)
+
+
+def test_prune_keep_all_and_none(store, world):
+    first = make_snapshot(store, 'backup_20260101-000000', {'old.dat': world['old.dat']})
+    second = make_snapshot(store, 'backup_20260102-000000', {'new.dat': world['new.dat']})
+
+    assert store.prune({first.name, second.name}) == ([], [])
+    assert set(store.iter_chunks()) == first.chunk_set() | second.chunk_set()
+
+    removed_snapshots, removed_chunks = store.prune(set())
+    assert removed_snapshots == [first.name, second.name]
+    assert set(removed_chunks) == first.chunk_set() | second.chunk_set()
+    assert list(store.iter_chunks()) == []
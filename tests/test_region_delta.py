@@ -0,0 +1,126 @@
+import random
+import struct
+
+import pytest
+
+from ftp_backup import region_delta
+from ftp_backup.region_delta import (CHUNKS_PER_REGION, HEADER_SIZE, SECTOR_SIZE, RegionFormatError, apply_delta,
+                                     fingerprint, make_delta, parse_region)
+
+
+def build_region(chunks: dict) -> bytes:
+    # chunks: 区块序号 -> (时间戳, 压缩后的数据)，按序号依次分配扇区，扇区末尾填充 0
+    header = bytearray(HEADER_SIZE)
+    body = bytearray()
+    for index in sorted(chunks):
+        timestamp, payload = chunks[index]
+        record = struct.pack('>IB', len(payload) + 1, 2) + payload
+        sectors = -(-len(record) // SECTOR_SIZE)
+        offset = 2 + len(body) // SECTOR_SIZE
+        struct.pack_into('>I', header, index * 4, offset << 8 | sectors)
+        struct.pack_into('>I', header, SECTOR_SIZE + index * 4, timestamp)
+        body += record + bytes(sectors * SECTOR_SIZE - len(record))
+    return bytes(header + body)
+
+
+def random_chunks(rnd: random.Random, indexes, timestamp: int = 1) -> dict:
+    return {i: (timestamp, rnd.randbytes(rnd.randint(100, 9000))) for i in indexes}
+
+
+def state_of(data: bytes) -> bytes:
+    return fingerprint(*parse_region(data))
+
+
+def round_trip(current: bytes, previous: bytes) -> bytes:
+    delta, table = make_delta(current, state_of(previous))
+    assert delta is not None
+    assert table == state_of(current)
+    return apply_delta(previous, delta)
+
+
+@pytest.fixture
+def rnd():
+    return random.Random(7)
+
+
+def test_identical(rnd):
+    data = build_region(random_chunks(rnd, range(0, CHUNKS_PER_REGION, 3)))
+    delta, _ = make_delta(data, state_of(data))
+    # 没有区块变化时差量只包含文件头与区块状态表
+    assert len(delta) == region_delta.DELTA_HEADER.size + HEADER_SIZE + CHUNKS_PER_REGION
+    assert apply_delta(data, delta) == data
+
+
+def test_partially_changed(rnd):
+    chunks = random_chunks(rnd, range(64))
+    previous = build_region(chunks)
+    for i in (3, 10, 40):
+        chunks[i] = (2, rnd.randbytes(len(chunks[i][1])))
+    assert round_trip(build_region(chunks), previous) == build_region(chunks)
+
+
+def test_fully_changed(rnd, monkeypatch):
+    previous = build_region(random_chunks(rnd, range(32)))
+    current = build_region(random_chunks(rnd, range(32), timestamp=2))
+    assert make_delta(current, state_of(previous))[0] is None
+    monkeypatch.setattr(region_delta, 'MAX_DELTA_RATIO', 1.0)
+    assert round_trip(current, previous) == current
+
+
+def test_grown_file(rnd):
+    chunks = random_chunks(rnd, range(0, 200, 2))
+    previous = build_region(chunks)
+    chunks.update(random_chunks(rnd, [201, 500], timestamp=2))
+    chunks[10] = (2, rnd.randbytes(3 * SECTOR_SIZE))  # 区块变大后移动到其他扇区
+    current = build_region(chunks)
+    assert len(current) > len(previous)
+    assert round_trip(current, previous) == current
+
+
+def test_shrunk_file(rnd):
+    chunks = random_chunks(rnd, range(100))
+    previous = build_region(chunks)
+    for i in range(90, 100):
+        del chunks[i]
+    chunks[5] = (2, rnd.randbytes(50))
+    current = build_region(chunks)
+    assert len(current) < len(previous)
+    assert round_trip(current, previous) == current
+
+
+def test_new_region_file(rnd):
+    # 上一次备份时区域文件为空，指纹全为 0
+    current = build_region(random_chunks(rnd, [0]))
+    _, table = make_delta(b'', b'')
+    assert table == bytes(CHUNKS_PER_REGION * 8)
+    delta, _ = make_delta(current, table)
+    assert apply_delta(b'', delta) == current
+
+
+def test_empty_region_falls_back(rnd):
+    previous = build_region(random_chunks(rnd, range(8)))
+    delta, table = make_delta(b'', state_of(previous))
+    assert delta is None
+    assert table == bytes(CHUNKS_PER_REGION * 8)
+
+
+def test_fallback_still_returns_fingerprint(rnd):
+    # 差量不划算时保存完整文件，返回的指纹仍用于下一次备份
+    previous = build_region(random_chunks(rnd, range(16)))
+    chunks = random_chunks(rnd, range(16), timestamp=2)
+    current = build_region(chunks)
+    delta, table = make_delta(current, state_of(previous))
+    assert delta is None
+    chunks[0] = (3, rnd.randbytes(200))
+    following = build_region(chunks)
+    next_delta, _ = make_delta(following, table)
+    assert apply_delta(current, next_delta) == following
+
+
+def test_apply_to_wrong_base(rnd):
+    current = build_region(random_chunks(rnd, range(4)))
+    delta, _ = make_delta(current, state_of(current))
+    with pytest.raises(RegionFormatError):
+        apply_delta(b'', delta)
+    with pytest.raises(RegionFormatError):
+        apply_delta(current, b'XXXXX' + delta[5:])
@@ -0,0 +1,170 @@
+import logging
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+from ftp_backup.config import Config
+from ftp_backup.retention import RetentionPolicy, RemoteIndex, group_remote_files, prune_remote
+
+logger = logging.getLogger('test_retention')
+
+
+def name_at(t: datetime, kind: str = '') -> str:
+    return f"backup_{t:%Y%m%d-%H%M%S}{kind}.zip"
+
+
+def hourly_names(start: datetime, hours: int) -> list:
+    return [name_at(start + timedelta(hours=h)) for h in range(hours)]
+
+
+def test_keep_last():
+    names = hourly_names(datetime(2026, 1, 1), 5)
+    assert RetentionPolicy(2).select(names) == set(names[-2:])
+    assert RetentionPolicy(0).select(names) == set()
+
+
+def test_hourly_keeps_newest_per_hour():
+    start = datetime(2026, 1, 1)
+    names = [name_at(start + timedelta(minutes=m)) for m in range(0, 180, 20)]
+    keep = RetentionPolicy(0, hourly=2).select(names)
+    assert keep == {name_at(start + timedelta(minutes=160)), name_at(start + timedelta(minutes=100))}
+
+
+def test_daily_tier():
+    names = hourly_names(datetime(2026, 1, 1), 72)
+    keep = RetentionPolicy(0, daily=2).select(names)
+    assert keep == {name_at(datetime(2026, 1, 3, 23)), name_at(datetime(2026, 1, 2, 23))}
+
+
+def test_weekly_tier():
+    # 2026-01-05 与 2026-01-12 均为周一
+    names = [name_at(datetime(2026, 1, 1) + timedelta(days=d)) for d in range(21)]
+    keep = RetentionPolicy(0, weekly=3).select(names)
+    assert keep == {name_at(datetime(2026, 1, 21)), name_at(datetime(2026, 1, 18)), name_at(datetime(2026, 1, 11))}
+
+
+def test_monthly_tier():
+    names = [name_at(datetime(2026, 1, 1) + timedelta(days=d)) for d in range(0, 100, 10)]
+    keep = RetentionPolicy(0, monthly=2).select(names)
+    assert keep == {name_at(datetime(2026, 4, 1)), name_at(datetime(2026, 3, 22))}
+
+
+def test_tiers_combine_with_keep_last():
+    names = hourly_names(datetime(2026, 1, 1), 48)
+    keep = RetentionPolicy(3, daily=2).select(names)
+    assert keep == set(names[-3:]) | {name_at(datetime(2026, 1, 1, 23))}
+
+
+def test_incremental_chain_pinned():
+    day = datetime(2026, 1, 1)
+    full = name_at(day)
+    inc1 = name_at(day + timedelta(hours=1), '_inc')
+    inc2 = name_at(day + timedelta(hours=2), '_inc')
+    newer = name_at(day + timedelta(days=1))
+    keep = RetentionPolicy(1, daily=2).select([full, inc1, inc2, newer])
+    assert keep == {full, inc1, inc2, newer}
+    assert RetentionPolicy(1).prunable([full, inc1, inc2, newer]) == [full, inc1, inc2]
+
+
+def test_differential_pins_only_base():
+    day = datetime(2026, 1, 1)
+    full = name_at(day)
+    diff1 = name_at(day + timedelta(hours=1), '_diff')
+    diff2 = name_at(day + timedelta(hours=2), '_diff')
+    assert RetentionPolicy(1).select([full, diff1, diff2]) == {full, diff2}
+    assert RetentionPolicy(1).prunable([full, diff1, diff2]) == [diff1]
+
+
+def test_empty():
+    policy = RetentionPolicy(3, hourly=1, daily=1, weekly=1, monthly=1)
+    assert policy.select([]) == set()
+    assert policy.prunable([]) == []
+
+
+def test_unparsable_names_are_never_pruned():
+    names = ['notes.txt', 'backup_latest.zip', 'backup_2026-01-01.zip', 'chunks']
+    dated = hourly_names(datetime(2026, 1, 1), 3)
+    policy = RetentionPolicy(1)
+    assert policy.select(names) == set()
+    assert policy.prunable(names) == []
+    assert policy.prunable(names + dated) == dated[:2]
+    assert group_remote_files(names) == {}
+
+
+class FakeManager:
+    def __init__(self, files: dict, failing=()):
+        self.files = dict(files)
+        self.failing = set(failing)
+        self.deleted = []
+
+    def list_entries(self, rel_dir: str, config) -> dict:
+        return dict(self.files)
+
+    def delete_file(self, rel_path: str, config) -> bool:
+        if rel_path in self.failing:
+            return False
+        self.deleted.append(rel_path)
+        return self.files.pop(rel_path, None) is not None
+
+
+class FakePool:
+    def __init__(self, manager):
+        self.manager = manager
+
+    @contextmanager
+    def session(self):
+        yield self.manager
+
+
+def make_config(keep: int, **values) -> Config:
+    config = Config()
+    config.keep_remote_backups = keep
+    config.prune_batch_size = 2
+    for key, value in values.items():
+        setattr(config, key, value)
+    return config
+
+
+def remote_files(names: list) -> dict:
+    files = {'notes.txt': 1, 'chunks': None}
+    for name in names:
+        files[name] = 100
+    # 分段上传的备份：分段与分段清单同属一个备份
+    segmented = name_at(datetime(2026, 1, 1, 0, 30))
+    files.update({segmented + '.part0001': 50, segmented + '.part0002': 50, segmented + '.parts.json': 1,
+                  segmented + '.manifest.json': 1})
+    return files
+
+
+def test_prune_remote_deletes_only_what_select_drops(tmp_path):
+    names = hourly_names(datetime(2026, 1, 1), 30)
+    files = remote_files(names)
+    config = make_config(2, retention_daily=2)
+    groups = group_remote_files(files)
+    keep = RetentionPolicy.from_config(config, 2).select(groups)
+    expected = sorted(set(groups) - keep)
+
+    manager = FakeManager(files)
+    index = RemoteIndex(str(tmp_path / 'index.json'), 'target', 3600)
+    removed = prune_remote(index, FakePool(manager), config, logger)
+
+    assert sorted(removed) == expected
+    assert sorted(manager.deleted) == sorted(f for b in expected for f in groups[b])
+    assert set(group_remote_files(manager.files)) == keep
+    assert 'notes.txt' in manager.files and 'chunks' in manager.files
+    assert index.files == manager.files
+
+
+def test_prune_remote_skips_failed_deletes(tmp_path):
+    names = hourly_names(datetime(2026, 1, 1), 5)
+    manager = FakeManager({name: 100 for name in names}, failing={names[0]})
+    index = RemoteIndex(str(tmp_path / 'index.json'), 'target', 3600)
+    removed = prune_remote(index, FakePool(manager), make_config(2), logger)
+
+    assert removed == names[1:3]
+    assert names[0] in manager.files
+    assert index.files is None  # 删除失败后索引失效，下次重新列出
+
+
+def test_prune_remote_without_connection(tmp_path):
+    index = RemoteIndex(str(tmp_path / 'index.json'), 'target', 3600)
+    assert prune_remote(index, FakePool(None), make_config(1), logger) == []